@@ -1,38 +1,245 @@
 import os
+import threading
+import time
 
-from flask import g
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from werkzeug.local import LocalProxy
 import redis
 
+from app.metrics import record
+
+
+# Process-wide MongoDB client. MongoClient is thread-safe and owns its own connection pool,
+# so a single instance is shared by every request in a process. It is not fork-safe, so the
+# pid is tracked and a new client is created in any forked child (e.g. pre-fork servers).
+_mongo_client = None
+_mongo_client_pid = None
+_mongo_lock = threading.Lock()
+
+# Process-wide Redis connection pools, shared by every request in a process.
+_redis_pools = {}
+_redis_pools_pid = None
+_redis_lock = threading.Lock()
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+	"""
+	Collects connection pool statistics for the shared MongoClient.
+	Tracks open and checked-out connections, and how long requests waited for a connection.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		self.open_connections = 0
+		self.checked_out = 0
+		self.max_checked_out = 0
+		self.checkouts = 0
+		self.checkout_failures = 0
+		self.total_wait_time = 0.0
+		self.max_wait_time = 0.0
+		self.pending = {}
+
+	def stats(self):
+		with self.lock:
+			return {
+				"open_connections": self.open_connections,
+				"checked_out": self.checked_out,
+				"max_checked_out": self.max_checked_out,
+				"checkouts": self.checkouts,
+				"checkout_failures": self.checkout_failures,
+				"avg_wait_ms": (self.total_wait_time / self.checkouts) * 1000 if self.checkouts else 0.0,
+				"max_wait_ms": self.max_wait_time * 1000
+			}
+
+	def connection_check_out_started(self, event):
+		with self.lock:
+			self.pending[threading.get_ident()] = time.time()
+
+	def connection_checked_out(self, event):
+		with self.lock:
+			started = self.pending.pop(threading.get_ident(), None)
+			if started:
+				wait_time = time.time() - started
+				self.total_wait_time += wait_time
+				self.max_wait_time = max(self.max_wait_time, wait_time)
+			self.checkouts += 1
+			self.checked_out += 1
+			self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+	def connection_check_out_failed(self, event):
+		with self.lock:
+			self.pending.pop(threading.get_ident(), None)
+			self.checkout_failures += 1
+
+	def connection_checked_in(self, event):
+		with self.lock:
+			self.checked_out = max(0, self.checked_out - 1)
+
+	def connection_created(self, event):
+		with self.lock:
+			self.open_connections += 1
+
+	def connection_closed(self, event):
+		with self.lock:
+			self.open_connections = max(0, self.open_connections - 1)
+
+	def pool_created(self, event):
+		pass
+
+	def pool_ready(self, event):
+		pass
+
+	def pool_cleared(self, event):
+		with self.lock:
+			self.checked_out = 0
+
+	def pool_closed(self, event):
+		pass
+
+	def connection_ready(self, event):
+		pass
+
+
+class CommandTimingListener(monitoring.CommandListener):
+	"""
+	Attributes the time of MongoDB commands to the current request (see app.metrics).
+	"""
+	def started(self, event):
+		pass
+
+	def succeeded(self, event):
+		record("mongo", event.duration_micros / 1e6)
+
+	def failed(self, event):
+		record("mongo", event.duration_micros / 1e6)
+
+
+class TimedConnection(redis.Connection):
+	"""
+	Redis connection attributing the time spent sending commands and waiting for replies
+	to the current request (see app.metrics). Pipelines are timed as a whole.
+	"""
+	def send_packed_command(self, *args, **kwargs):
+		start = time.time()
+		try:
+			return super().send_packed_command(*args, **kwargs)
+		finally:
+			record("redis", time.time() - start)
+
+	def read_response(self, *args, **kwargs):
+		start = time.time()
+		try:
+			return super().read_response(*args, **kwargs)
+		finally:
+			record("redis", time.time() - start)
+
+
+mongo_pool_stats = PoolStatsListener()
+mongo_command_timing = CommandTimingListener()
+
+
+def get_mongo_client():
+	"""
+	Returns the process-wide MongoClient, creating it on first use (or after a fork).
+
+	Pool settings can be configured through the environment:
+		mongo_max_pool_size : maximum connections in the pool (default 100)
+		mongo_min_pool_size : connections kept open, also opened at warm-up (default 0)
+		mongo_max_idle_time_ms : idle time before a pooled connection is closed (default 60000)
+		mongo_wait_queue_timeout_ms : max time to wait for a free connection (default 10000)
+	"""
+	global _mongo_client, _mongo_client_pid
+
+	pid = os.getpid()
+	if _mongo_client is not None and _mongo_client_pid == pid:
+		return _mongo_client
+
+	with _mongo_lock:
+		if _mongo_client is None or _mongo_client_pid != pid:
+			# connections inherited from the parent process must not be reused
+			mongo_pool_stats.reset()
+			_mongo_client = MongoClient(
+				os.environ["cdl_uri"],
+				maxPoolSize=int(os.environ.get("mongo_max_pool_size", 100)),
+				minPoolSize=int(os.environ.get("mongo_min_pool_size", 0)),
+				maxIdleTimeMS=int(os.environ.get("mongo_max_idle_time_ms", 60000)),
+				waitQueueTimeoutMS=int(os.environ.get("mongo_wait_queue_timeout_ms", 10000)),
+				event_listeners=[mongo_pool_stats, mongo_command_timing],
+				connect=False
+			)
+			_mongo_client_pid = pid
+
+	return _mongo_client
+
+
+def warm_up_db():
+	"""
+	Opens the shared MongoClient at boot so that server discovery and the first connection
+	handshakes are not paid by the first request.
+	"""
+	client = get_mongo_client()
+	try:
+		client.admin.command("ping")
+	except Exception as e:
+		print("Unable to warm up MongoDB connection pool: ", e)
+
+
+def get_mongo_pool_stats():
+	"""
+	Returns a dict of connection pool statistics for the shared MongoClient, for monitoring.
+	"""
+	return mongo_pool_stats.stats()
+
 
 def get_db():
 	"""
 	Configuration method to return db instance
 	"""
-	db = getattr(g, "_database", None)
+	return get_mongo_client()[os.environ["db_name"]]
+
 
-	if db is None:
-		client = MongoClient(os.environ["cdl_uri"])
-		db = g._database = client[os.environ["db_name"]]
+def get_redis_pool(decode_responses=True):
+	"""
+	Returns the process-wide Redis connection pool, creating it on first use (or after a fork).
+	There is one pool for clients decoding responses as utf-8, and one for binary values.
+	The maximum number of connections can be set with redis_max_connections (default 50), callers
+	wait up to redis_pool_timeout seconds (default 5) for a free connection.
+	"""
+	global _redis_pools_pid
 
-	return db
+	pid = os.getpid()
+	if _redis_pools_pid == pid and decode_responses in _redis_pools:
+		return _redis_pools[decode_responses]
 
+	with _redis_lock:
+		if _redis_pools_pid != pid:
+			_redis_pools.clear()
+			_redis_pools_pid = pid
+		if decode_responses not in _redis_pools:
+			_redis_pools[decode_responses] = redis.BlockingConnectionPool(
+				host=os.environ["redis_host"],
+				port=int(os.environ["redis_port"]),
+				password=os.environ["redis_password"],
+				encoding="utf-8",
+				decode_responses=decode_responses,
+				connection_class=TimedConnection,
+				max_connections=int(os.environ.get("redis_max_connections", 50)),
+				timeout=int(os.environ.get("redis_pool_timeout", 5)),
+				health_check_interval=30
+			)
 
-def get_redis():
-	rds = getattr(g, "_redis", None)
+	return _redis_pools[decode_responses]
 
-	if rds is None:
-		rds = redis.Redis(
-			host=os.environ["redis_host"],
-			port=int(os.environ["redis_port"]),
-			password=os.environ["redis_password"],
-			charset="utf-8",
-			decode_responses=True
-		)
-		g.__setattr__("_redis", rds)
 
-	return rds
+def get_redis(decode_responses=True):
+	"""
+	Returns a Redis client. The client is a thin wrapper, connections come from the shared pool,
+	so this can also be used outside of a request (e.g. from background threads).
+	With decode_responses=False, values are returned as bytes (e.g. for compressed values).
+	"""
+	return redis.Redis(connection_pool=get_redis_pool(decode_responses))
 
 
 # Use LocalProxy to read the global db instance with just `db`
@@ -0,0 +1,190 @@
+import atexit
+import os
+import queue
+import threading
+import time
+import traceback
+
+from bson import ObjectId
+
+
+class DeferredInsertResult:
+	"""
+	Stands in for pymongo's InsertOneResult for inserts queued on the event pipeline.
+	The ObjectId is assigned before queueing, so callers can use inserted_id right away.
+	acknowledged is False if the event was dropped because the queue was full.
+	"""
+	def __init__(self, inserted_id, acknowledged):
+		self.inserted_id = inserted_id
+		self.acknowledged = acknowledged
+
+
+class EventPipeline:
+	"""
+	In-process pipeline for telemetry writes (clicks, views, community actions, judgments).
+
+	Events are put on a bounded queue and written by a background thread with insert_many,
+	batched per collection, so that user-facing requests do not wait on these writes.
+	Submission stats increments are summed per submission and written with one bulk_write, or added to the
+	Redis buffer when stats_write_behind is enabled (see SubmissionStats.increment_many).
+
+	Settings, from the environment:
+		event_queue_size : max number of queued events (default 10000)
+		event_batch_size : max number of events per flush (default 500)
+		event_flush_interval : max seconds an event waits before being written (default 1)
+		event_put_timeout : seconds to wait for room on a full queue before dropping (default 0.05)
+		async_event_logging : set to false to write events synchronously (default true)
+	"""
+	def __init__(self):
+		self.enabled = os.environ.get("async_event_logging", "true").lower() == "true"
+		self.batch_size = int(os.environ.get("event_batch_size", 500))
+		self.flush_interval = float(os.environ.get("event_flush_interval", 1))
+		self.put_timeout = float(os.environ.get("event_put_timeout", 0.05))
+		self.queue = queue.Queue(maxsize=int(os.environ.get("event_queue_size", 10000)))
+		self.stop_event = threading.Event()
+		self.flush_lock = threading.Lock()
+		self.counters_lock = threading.Lock()
+		self.counters = {"queued": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+		self.thread = None
+		if self.enabled:
+			self.thread = threading.Thread(target=self.run, name="event-pipeline", daemon=True)
+			self.thread.start()
+			atexit.register(self.stop)
+
+	def insert(self, collection, document):
+		"""
+		Queues a document to be inserted into a collection.
+
+		Arguments:
+			collection : pymongo Collection : where the document is written.
+			document : dict : the document, an _id is added if missing.
+
+		Returns:
+			DeferredInsertResult with the inserted_id of the document.
+		"""
+		document.setdefault("_id", ObjectId())
+		if not self.enabled:
+			inserted = collection.insert_one(document)
+			return DeferredInsertResult(inserted.inserted_id, inserted.acknowledged)
+		queued = self.put(("insert", collection, document))
+		return DeferredInsertResult(document["_id"], queued)
+
+	def increment_stats(self, submission_id, request_type):
+		"""
+		Queues a SubmissionStats update (see SubmissionStats.update_stats for request types).
+		"""
+		if not self.enabled:
+			from app.models.submission_stats import SubmissionStats
+			return SubmissionStats().update_stats(submission_id, request_type)
+		return self.put(("stats", submission_id, request_type))
+
+	def put(self, event):
+		# Backpressure: wait briefly for room, then drop rather than block the request
+		try:
+			self.queue.put(event, timeout=self.put_timeout)
+		except queue.Full:
+			self.count("dropped")
+			return False
+		self.count("queued")
+		return True
+
+	def count(self, name, value=1):
+		with self.counters_lock:
+			self.counters[name] += value
+
+	def stats(self):
+		with self.counters_lock:
+			stats = dict(self.counters)
+		stats["pending"] = self.queue.qsize()
+		return stats
+
+	def run(self):
+		while not self.stop_event.is_set():
+			self.flush(wait=True)
+
+	def flush(self, wait=False):
+		"""
+		Writes up to batch_size queued events.
+		With wait=True, blocks up to flush_interval for events to arrive.
+		"""
+		events = []
+		deadline = time.time() + self.flush_interval
+		while len(events) < self.batch_size:
+			try:
+				if wait:
+					timeout = deadline - time.time()
+					if timeout <= 0:
+						break
+					events.append(self.queue.get(timeout=timeout))
+				else:
+					events.append(self.queue.get_nowait())
+			except queue.Empty:
+				break
+		if events:
+			with self.flush_lock:
+				self.write(events)
+		return len(events)
+
+	def write(self, events):
+		inserts = {}
+		collections = {}
+		stats_increments = []
+		for event in events:
+			if event[0] == "insert":
+				_, collection, document = event
+				collections[collection.full_name] = collection
+				inserts.setdefault(collection.full_name, []).append(document)
+			else:
+				stats_increments.append(event[1:])
+
+		for name, documents in inserts.items():
+			try:
+				collections[name].insert_many(documents, ordered=False)
+				self.count("written", len(documents))
+			except Exception as e:
+				traceback.print_exc()
+				self.count("failed", len(documents))
+			self.count("batches")
+
+		if stats_increments:
+			try:
+				from app.models.submission_stats import SubmissionStats
+				SubmissionStats().increment_many(stats_increments)
+				self.count("written", len(stats_increments))
+			except Exception as e:
+				traceback.print_exc()
+				self.count("failed", len(stats_increments))
+			self.count("batches")
+
+	def stop(self):
+		"""
+		Stops the background thread and writes everything still queued (flush-on-shutdown).
+		"""
+		self.stop_event.set()
+		if self.thread is not None:
+			self.thread.join(timeout=self.flush_interval * 2)
+		while self.flush():
+			pass
+
+
+_event_pipeline = None
+_event_pipeline_pid = None
+_event_pipeline_lock = threading.Lock()
+
+
+def get_event_pipeline():
+	"""
+	Returns the process-wide event pipeline, starting it on first use (or after a fork).
+	"""
+	global _event_pipeline, _event_pipeline_pid
+
+	pid = os.getpid()
+	if _event_pipeline is not None and _event_pipeline_pid == pid:
+		return _event_pipeline
+
+	with _event_pipeline_lock:
+		if _event_pipeline is None or _event_pipeline_pid != pid:
+			_event_pipeline = EventPipeline()
+			_event_pipeline_pid = pid
+
+	return _event_pipeline
@@ -12,3 +12,11 @@ CODE_URL_NOT_PUBLICILY_ACCESSIBLE = 7
 # For visualization
 RE_URL_DESC = "(\/submissions\/).{24}"
 
+# Max length of the sanitized preview stored with each submission (see build_preview)
+PREVIEW_CHARS = 500
+
+# Markers that OpenSearch puts around highlighted terms, turned into <mark> tags after escaping (see render_highlight).
+# Private use characters, so that they cannot be confused with text or tags written by users.
+HIGHLIGHT_PRE_TAG = "\ue000"
+HIGHLIGHT_POST_TAG = "\ue001"
+
@@ -1,10 +1,12 @@
+import hmac
+import html
 import json
 import os
 import re
 import time
 import traceback
 from functools import wraps
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urldefrag, quote
 
 import jwt
 import bleach
@@ -13,6 +15,7 @@ from flask import request, current_app
 
 from app.helpers import response
 from app.helpers.status import Status
+from app.helpers.helper_constants import PREVIEW_CHARS, HIGHLIGHT_PRE_TAG, HIGHLIGHT_POST_TAG, RE_URL_DESC
 from app.models.users import Users
 from app.models.communities import Communities
 from app.models.not_logged_in_users import NotLoggedInUsers, NotLoggedInUser
@@ -221,6 +224,31 @@ def token_required(f):
 	return decorator
 
 
+def monitoring_access_required(f):
+	"""
+	This wrapper restricts monitoring endpoints (e.g. /api/metrics) to internal clients. A request is allowed if
+	it comes from an address in metrics_allowlist (comma-separated, default loopback only), or if metrics_token
+	is set and sent as "Authorization: Bearer <token>".
+	Arguments:
+		f : (function) : whatever function is being wrapped.
+
+	Returns:
+		The passed function if the request is allowed, otherwise a 403 error.
+	"""
+	@wraps(f)
+	def decorator(*args, **kwargs):
+		allowlist = [x.strip() for x in os.environ.get("metrics_allowlist", "127.0.0.1,::1").split(",") if x.strip()]
+		metrics_token = os.environ.get("metrics_token", "")
+		authorization = request.headers.get("Authorization", "")
+		if request.remote_addr in allowlist:
+			return f(*args, **kwargs)
+		if metrics_token and hmac.compare_digest(authorization.encode("utf8"), ("Bearer " + metrics_token).encode("utf8")):
+			return f(*args, **kwargs)
+		return response.error("Not allowed.", Status.FORBIDDEN)
+
+	return decorator
+
+
 def build_display_url(url):
 	"""
 	Helper function for building the display URL. Replaces "/" with " > ". Ignores last slash
@@ -243,14 +271,87 @@ def format_url(url, submission_id):
     submission_id: the str of the submission_id
     """
     if url == "":
-        if "localhost" in os.environ["api_url"]:
-            url = os.environ["api_url"] + ":" + os.environ["api_port"] + "/submissions/" + submission_id
-        else:
-            url = os.environ["api_url"] + "/submissions/" + submission_id
+        url = get_submission_url_prefix() + submission_id
     return url
+
+
+def get_submission_url_prefix():
+    """
+    The TextData submission URL, without the submission_id (see format_url).
+    """
+    if "localhost" in os.environ["api_url"]:
+        return os.environ["api_url"] + ":" + os.environ["api_port"] + "/submissions/"
+    return os.environ["api_url"] + "/submissions/"
     
     
 
+def create_redirect_url(url, search_id):
+    """Create the redirect URL for logging clicks.
+
+    Method Parameters
+    ----------
+    url : str, required
+        The target URL page to visit.
+
+    search_id : str, required
+        The search event ID.
+
+    Returns
+    ---------
+    str
+        The redirect URL that includes the target URL and the search ID.
+    """
+    return get_redirect_url_prefix(search_id) + format_redirect_target(url)
+
+
+def get_redirect_url_prefix(search_id):
+    """
+    The redirect URL of a search, up to the target URL (see create_redirect_url).
+    """
+    return os.environ["api_url"] + ":" + os.environ["api_port"] + "/api/search/redirect?search_id=" + search_id
+
+
+def format_redirect_target(url):
+    """
+    The redirect_url parameter of the redirect URL (see create_redirect_url).
+    """
+    redirect_url = ""
+    url, fragment = urldefrag(url)
+    # handling edge cases
+    if "pdf" in url or "smartdiff" in url and fragment != "":  # for proxies
+        redirect_url += "&redirect_url=" + url + "#" + fragment
+    elif "youtube" in url:
+        redirect_url += "&redirect_url=" + quote(url)
+    else:
+        redirect_url += "&redirect_url=" + url
+    return redirect_url
+
+
+class URLFormatter:
+	"""
+	Builds the URLs of many results of a search (see create_pages_submission), with the environment-derived
+	prefixes computed once instead of for every result.
+	Gives the same URLs as format_url, create_redirect_url, and build_display_url.
+	"""
+	def __init__(self, search_id):
+		self.submission_prefix = get_submission_url_prefix()
+		# the submission_id is hex, so it never changes how the target URL is handled
+		self.redirect_prefix = get_redirect_url_prefix(search_id) + format_redirect_target(self.submission_prefix)
+		# the display URL of a submission URL, without the submission_id (which has no "/")
+		self.display_prefix = build_display_url(self.submission_prefix + "0")[:-1]
+
+	def format_url(self, url, submission_id):
+		return url if url != "" else self.submission_prefix + submission_id
+
+	def redirect_url(self, submission_id):
+		return self.redirect_prefix + submission_id
+
+	def display_url(self, url, submission_id):
+		if url == "":
+			return self.display_prefix + submission_id
+		return build_display_url(url)
+
+
 def hydrate_with_hashtags(title, description):
     """Extracts hashtags from a submission title and description
 
@@ -304,4 +405,35 @@ def sanitize_input(input_data):
 		except Exception as e :
 			print(f"Error occured while sanitizing input data {input_data}: ", e)
 
-	return input_data
\ No newline at end of file
+	return input_data
+
+
+def build_preview(text, max_chars=PREVIEW_CHARS):
+	"""
+	Returns the sanitized start of a submission's text, cut at a word boundary.
+	Computed when a submission is written, and displayed as is for search results without highlights.
+	"""
+	if not text:
+		return ""
+	if len(text) > max_chars:
+		text = text[:max_chars].rsplit(" ", 1)[0] + " ..."
+	return sanitize_input(text)
+
+
+def find_mentions(text):
+	"""
+	Returns the IDs of the submissions linked to in a submission's text (/submissions/<id>), once per link.
+	Computed when a submission is written, and used for the mention edges of search visualizations.
+	"""
+	if not text:
+		return []
+	return [mention.group(0)[-24:] for mention in re.finditer(RE_URL_DESC, text)]
+
+
+def render_highlight(fragments):
+	"""
+	Converts OpenSearch highlight fragments (with HIGHLIGHT_PRE_TAG/HIGHLIGHT_POST_TAG markers) into display HTML.
+	Only the fragments are escaped, and only the markers become <mark> tags, so no sanitizer pass is needed.
+	"""
+	text = html.escape(" .... ".join(fragments), quote=False)
+	return text.replace(HIGHLIGHT_PRE_TAG, "<mark>").replace(HIGHLIGHT_POST_TAG, "</mark>")
\ No newline at end of file
@@ -0,0 +1,206 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request
+
+
+# The backends whose time is attributed to requests. The rest of a request's time is reported as "self".
+COMPONENTS = ["mongo", "redis", "elastic", "neural", "web"]
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+_current_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+	"""
+	The time a request spent in each backend. Stages run on other threads (see submit_stage in views/search.py)
+	add to the same timings, so concurrent backend time can add up to more than the request's wall time.
+	"""
+	def __init__(self):
+		self.started = time.time()
+		self.lock = threading.Lock()
+		self.durations = {}
+
+	def add(self, component, elapsed):
+		with self.lock:
+			self.durations[component] = self.durations.get(component, 0.0) + elapsed
+
+	def finish(self):
+		"""
+		Returns {component: seconds} for the backends used, along with "self" and "total".
+		"""
+		total = time.time() - self.started
+		with self.lock:
+			durations = dict(self.durations)
+		durations["self"] = max(0.0, total - sum(durations.values()))
+		durations["total"] = total
+		return durations
+
+
+def start_request():
+	_current_timings.set(RequestTimings())
+
+
+def end_request():
+	"""
+	Returns the timings of the current request (see RequestTimings.finish), or None outside of a request.
+	"""
+	timings = _current_timings.get()
+	_current_timings.set(None)
+	return timings.finish() if timings else None
+
+
+def record(component, elapsed):
+	"""
+	Attributes time spent in a backend to the current request. Does nothing outside of a request,
+	e.g. in background threads.
+	"""
+	timings = _current_timings.get()
+	if timings is not None:
+		timings.add(component, elapsed)
+
+
+@contextmanager
+def timed(component):
+	start = time.time()
+	try:
+		yield
+	finally:
+		record(component, time.time() - start)
+
+
+def format_server_timing(durations):
+	"""
+	Formats request timings as a Server-Timing header value, in milliseconds.
+	"""
+	return ", ".join(f"{component};dur={durations[component] * 1000:.1f}"
+					 for component in COMPONENTS + ["self", "total"] if component in durations)
+
+
+class Histogram:
+	def __init__(self):
+		self.counts = [0] * (len(BUCKETS) + 1)
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		for i, bound in enumerate(BUCKETS):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+		else:
+			self.counts[-1] += 1
+		self.sum += value
+		self.count += 1
+
+
+class RequestMetrics:
+	"""
+	Per-endpoint latency histograms of each component of requests (see COMPONENTS, self and total),
+	and request counts by endpoint and status, rendered in the Prometheus text format.
+	Endpoints are Flask endpoint names, so that the number of series is bounded.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.histograms = {}
+		self.requests = {}
+
+	def observe(self, endpoint, status, durations):
+		with self.lock:
+			self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+			for component in COMPONENTS + ["self", "total"]:
+				histogram = self.histograms.get((endpoint, component))
+				if histogram is None:
+					histogram = self.histograms[(endpoint, component)] = Histogram()
+				histogram.observe(durations.get(component, 0.0))
+
+	def render(self):
+		lines = [
+			"# HELP textdata_request_duration_seconds Time spent in each backend per request, self is the time outside of them.",
+			"# TYPE textdata_request_duration_seconds histogram"
+		]
+		with self.lock:
+			for (endpoint, component), histogram in sorted(self.histograms.items()):
+				labels = f'endpoint="{escape_label(endpoint)}",component="{component}"'
+				cumulative = 0
+				for bound, count in zip(BUCKETS + ["+Inf"], histogram.counts):
+					cumulative += count
+					lines.append(f'textdata_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+				lines.append(f"textdata_request_duration_seconds_sum{{{labels}}} {histogram.sum}")
+				lines.append(f"textdata_request_duration_seconds_count{{{labels}}} {histogram.count}")
+
+			lines.append("# HELP textdata_requests_total Requests by endpoint and status.")
+			lines.append("# TYPE textdata_requests_total counter")
+			for (endpoint, status), count in sorted(self.requests.items()):
+				lines.append(f'textdata_requests_total{{endpoint="{escape_label(endpoint)}",status="{status}"}} {count}')
+		return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+	return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_stats(name, help_text, stats, label=None):
+	"""
+	Formats a dict of statistics as Prometheus gauges, e.g. the pool and pipeline stats.
+
+	Arguments:
+		name : str : the metric name prefix, each stat is exported as <name>_<stat>.
+		help_text : str : the description of the stats.
+		stats : dict : {stat: number}, or with a label, {label value: {stat: number}}.
+		label : str : the label name, for nested stats.
+	"""
+	samples = {}
+	if label:
+		for label_value, label_stats in stats.items():
+			for stat, value in label_stats.items():
+				samples.setdefault(stat, []).append((f'{{{label}="{escape_label(label_value)}"}}', value))
+	else:
+		for stat, value in stats.items():
+			samples.setdefault(stat, []).append(("", value))
+
+	lines = []
+	for stat, values in sorted(samples.items()):
+		values = [(labels, value) for labels, value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+		if not values:
+			continue
+		lines.append(f"# HELP {name}_{stat} {help_text}")
+		lines.append(f"# TYPE {name}_{stat} gauge")
+		for labels, value in values:
+			lines.append(f"{name}_{stat}{labels} {value}")
+	return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+def init_app(app):
+	"""
+	Times every request of a Flask app: adds a Server-Timing header (unless server_timing is false)
+	and records the timings in request_metrics.
+	"""
+	server_timing = os.environ.get("server_timing", "true").lower() == "true"
+
+	@app.before_request
+	def start_timing():
+		start_request()
+
+	@app.after_request
+	def end_timing(resp):
+		durations = end_request()
+		if durations is None:
+			return resp
+		request_metrics.observe(request.endpoint or "unknown", resp.status_code, durations)
+		if server_timing:
+			resp.headers["Server-Timing"] = format_server_timing(durations)
+		return resp
+
+	@app.teardown_request
+	def clear_timing(exc):
+		# after_request is skipped when a request fails with an exception
+		_current_timings.set(None)
@@ -1,54 +1,530 @@
+import hashlib
 import json
+import os
+import random
+import threading
+import traceback
 
 from app.db import get_redis
 
 from app.models.redis_wrapper import Redis
+from app.models.cache_codecs import CacheCodec, get_codec
+from app.helpers.helpers import URLFormatter
+
+
+# Returns the number of hits and a window of results in the active sort order, in one round trip.
+# The results and orders are shared between searches (see Cache), and found through the digest in the meta hash.
+# KEYS: meta hash
+# ARGV: start, stop (inclusive, -1 for the last result), "1" to also return the positions of the results, then the sort names
+WINDOW_SCRIPT = """
+local meta = redis.call('HMGET', KEYS[1], 'number_of_hits', 'sort_by', 'digest', 'materialized')
+if not meta[1] then
+	return {-1}
+end
+local hits = tonumber(meta[1])
+-- lazy searches only hold the first results, see Cache.insert
+local materialized = tonumber(meta[4] or meta[1])
+local sort_by = meta[2] or 'relevance'
+local start = tonumber(ARGV[1])
+local with_positions = ARGV[3] == '1'
+local sorts_from = 4
+local stop = tonumber(ARGV[2])
+if stop < 0 or stop >= materialized then
+	stop = materialized - 1
+end
+if not meta[3] or materialized == 0 then
+	return {hits, sort_by, {}}
+end
+
+local results_key = 'results:' .. meta[3]
+if redis.call('EXISTS', results_key) == 0 then
+	-- the shared result set was released, treat the search as not cached
+	return {-1}
+end
+local order_key = nil
+for i = sorts_from, #ARGV do
+	if ARGV[i] == sort_by then
+		order_key = results_key .. ':order:' .. sort_by
+	end
+end
+
+local ids = {}
+if order_key and redis.call('EXISTS', order_key) == 1 then
+	ids = redis.call('LRANGE', order_key, start, stop)
+else
+	for i = start, stop do
+		ids[#ids + 1] = i
+	end
+end
+if #ids == 0 then
+	return {hits, sort_by, {}}
+end
+local values = {}
+for i = 1, #ids, 1000 do
+	local chunk = redis.call('HMGET', results_key, unpack(ids, i, math.min(i + 999, #ids)))
+	for j = 1, #chunk do
+		values[#values + 1] = chunk[j]
+	end
+end
+if with_positions then
+	return {hits, sort_by, values, ids}
+end
+return {hits, sort_by, values}
+"""
+
+# Points a search at a shared result set, storing the set if it is not there yet.
+# Returns 0 if the set is missing and no results were sent (the caller retries with the results), 1 otherwise.
+# KEYS: meta hash, results hash, refs counter, previous results hash, previous refs counter,
+#       then one order list per sort, then the previous order lists
+# ARGV: ttl, number of results, encoded bytes, digest, previous digest, relevance, number of hits,
+#       JSON object of additional meta fields (e.g. the lazy session),
+#       then the number of results sent n, the n encoded results (in positions 0..n-1), then one JSON order per sort (or "")
+STORE_SCRIPT = """
+local ttl = tonumber(ARGV[1])
+local hits = tonumber(ARGV[2])
+local n = tonumber(ARGV[9])
+local sorts = (#KEYS - 5) / 2
+local previous = redis.call('HGET', KEYS[1], 'digest')
+local stored = false
+
+if hits > 0 and redis.call('EXISTS', KEYS[2]) == 0 then
+	if n == 0 then
+		return 0
+	end
+	for i = 1, n, 1000 do
+		local fields = {}
+		for j = i, math.min(i + 999, n) do
+			fields[#fields + 1] = j - 1
+			fields[#fields + 1] = ARGV[9 + j]
+		end
+		redis.call('HSET', KEYS[2], unpack(fields))
+	end
+	for i = 1, sorts do
+		local order = ARGV[9 + n + i]
+		redis.call('DEL', KEYS[5 + i])
+		if order and order ~= '' then
+			local positions = cjson.decode(order)
+			for j = 1, #positions, 1000 do
+				redis.call('RPUSH', KEYS[5 + i], unpack(positions, j, math.min(j + 999, #positions)))
+			end
+		end
+	end
+	redis.call('SET', KEYS[3], 0)
+	stored = true
+end
+
+-- the shared keys live at least as long as any search pointing at them
+if hits > 0 then
+	if stored or previous ~= ARGV[4] then
+		redis.call('INCR', KEYS[3])
+	end
+	for _, key in ipairs({KEYS[2], KEYS[3], unpack(KEYS, 6, 5 + sorts)}) do
+		if redis.call('TTL', key) < ttl then
+			redis.call('EXPIRE', key, ttl)
+		end
+	end
+end
+
+-- release the result set the search pointed at before, unless it is the same one
+if previous and previous == ARGV[5] and previous ~= ARGV[4] then
+	if redis.call('DECR', KEYS[5]) <= 0 then
+		redis.call('DEL', KEYS[4], KEYS[5], unpack(KEYS, 6 + sorts))
+	end
+end
+
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'number_of_hits', ARGV[7], 'materialized', hits, 'sort_by', ARGV[6], 'encoded_bytes', ARGV[3], 'digest', ARGV[4])
+for field, value in pairs(cjson.decode(ARGV[8])) do
+	redis.call('HSET', KEYS[1], field, value)
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+return 1
+"""
+
+# Replaces results of a shared result set, only while it is cached (so that it is never recreated without a TTL).
+# KEYS: results hash
+# ARGV: position, encoded result, position, encoded result, ...
+UPDATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+	redis.call('HSET', KEYS[1], unpack(ARGV))
+end
+return 1
+"""
+
+# Appends the next results of a lazy search to its result set, only if the set still holds the results the caller
+# fetched after, so that concurrent requests fetching the same hits do not append them twice.
+# KEYS: meta hash
+# ARGV: ttl, expected number of results, number of hits, session (or "" once every hit is fetched), encoded bytes,
+#       then the encoded results
+# Returns 1 if the results were appended, 0 otherwise.
+APPEND_SCRIPT = """
+local meta = redis.call('HMGET', KEYS[1], 'materialized', 'digest', 'encoded_bytes')
+local start = tonumber(ARGV[2])
+if not meta[1] or not meta[2] or tonumber(meta[1]) ~= start then
+	return 0
+end
+local results_key = 'results:' .. meta[2]
+if redis.call('EXISTS', results_key) == 0 then
+	return 0
+end
+local n = #ARGV - 5
+for i = 1, n, 1000 do
+	local fields = {}
+	for j = i, math.min(i + 999, n) do
+		fields[#fields + 1] = start + j - 1
+		fields[#fields + 1] = ARGV[5 + j]
+	end
+	redis.call('HSET', results_key, unpack(fields))
+end
+redis.call('HSET', KEYS[1], 'materialized', start + n, 'number_of_hits', ARGV[3],
+	'encoded_bytes', tonumber(meta[3] or 0) + tonumber(ARGV[5]))
+if ARGV[4] == '' then
+	redis.call('HDEL', KEYS[1], 'session')
+else
+	redis.call('HSET', KEYS[1], 'session', ARGV[4])
+end
+local ttl = tonumber(ARGV[1])
+for _, key in ipairs({KEYS[1], results_key, results_key .. ':refs'}) do
+	redis.call('EXPIRE', key, ttl)
+end
+return 1
+"""
+
+# Sets the active sort of a search, only while it is cached (so that the meta hash is never recreated without a TTL).
+# KEYS: meta hash
+# ARGV: sort name
+# Returns 1 if the sort was set, 0 otherwise.
+SET_SORT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+	return 0
+end
+redis.call('HSET', KEYS[1], 'sort_by', ARGV[1])
+return 1
+"""
+
+
+class CacheMemoryStats:
+	"""
+	The memory used by cached searches, from a sample of inserts (see Cache.memory_usage).
+	The sample rate is set with cache_memory_sample_rate (default 0.01), 0 to disable.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.sampled = 0
+		self.total_encoded_bytes = 0
+		self.total_redis_bytes = 0
+		self.max_redis_bytes = 0
+		self.total_references = 0
+
+	def observe(self, usage):
+		with self.lock:
+			self.sampled += 1
+			self.total_encoded_bytes += usage["encoded_bytes"]
+			self.total_redis_bytes += usage["redis_bytes"]
+			self.max_redis_bytes = max(self.max_redis_bytes, usage["redis_bytes"])
+			self.total_references += usage["references"]
+
+	def stats(self):
+		with self.lock:
+			sampled = self.sampled or 1
+			return {
+				"sampled_searches": self.sampled,
+				"avg_encoded_bytes": self.total_encoded_bytes / sampled,
+				"avg_redis_bytes": self.total_redis_bytes / sampled,
+				"max_redis_bytes": self.max_redis_bytes,
+				"avg_references": self.total_references / sampled
+			}
+
+
+cache_memory_stats = CacheMemoryStats()
+
+
+def get_cache_memory_stats():
+	"""
+	Returns a dict of the memory used per cached search, for monitoring.
+	"""
+	return cache_memory_stats.stats()
 
 
 class Cache(Redis):
+	"""
+	Caches the formatted results of a search.
+
+	Result sets are content-addressed, so identical results (e.g. the same community listing run by many users)
+	are stored once. Each result set is stored under its digest:
+		results:<digest> : a hash {position: encoded result}, positions are in relevance order.
+		results:<digest>:order:<sort> : for each precomputed sort (e.g. date, popularity), a list of positions.
+		results:<digest>:refs : the number of searches pointing at the result set.
+	and each search only holds a reference:
+		<user_id>-<search_id>:meta : a hash with the number of hits, the active sort, the encoded size, and the digest.
+	Any (offset, page_size) window in the active sort, along with the number of hits, is served with one call.
+
+	A lazy search caches only its first results, along with a session to fetch the rest (see get_session).
+	Its result set is not shared, so that the next results are appended in place (see append), and it is
+	re-inserted with its sort orders once every result is fetched.
+	With deferred highlighting, results are cached without their highlighted description, along with the
+	query to highlight them (see get_highlight_query), and are updated as their pages are highlighted.
+
+	A result set is deleted when the last search pointing at it is replaced, and otherwise expires with the
+	longest-lived search pointing at it (its TTL is extended on every reference).
+	Results are encoded with a pluggable codec (see cache_codecs), compressed and without derivable fields by default.
+	The search-specific fields are not stored, so the digest does not depend on the user or search.
+	"""
 	NUMBER_OF_HITS = "number_of_hits"
+	SORT_BY = "sort_by"
+	ENCODED_BYTES = "encoded_bytes"
+	DIGEST = "digest"
+	MATERIALIZED = "materialized"
+	SESSION = "session"
+	HIGHLIGHT_QUERY = "highlight_query"
+	RELEVANCE = "relevance"
+	SORTS = ["date", "popularity"]
+	PAGE_SIZE = 10
 
-	def __init__(self, time_to_live=60*60):
-		self.rds = get_redis()
+	def __init__(self, time_to_live=60*60, codec=None):
+		# values are compressed, so responses are not decoded as utf-8
+		self.rds = get_redis(decode_responses=False)
+		self.codec = codec or get_codec()
 		# Time to live in seconds, default is one hour
 		self.time_to_live = time_to_live
 		self.seperator = "-"
+		self.window_script = self.rds.register_script(WINDOW_SCRIPT)
+		self.store_script = self.rds.register_script(STORE_SCRIPT)
+		self.update_script = self.rds.register_script(UPDATE_SCRIPT)
+		self.append_script = self.rds.register_script(APPEND_SCRIPT)
+		self.set_sort_script = self.rds.register_script(SET_SORT_SCRIPT)
+		self.memory_sample_rate = float(os.environ.get("cache_memory_sample_rate", 0.01))
 
 	def get_key(self, user_id, search_id):
 		return self.seperator.join([user_id, search_id])
 
-	def search(self, user_id, search_id, page):
-		key = self.get_key(user_id, search_id)
+	def get_meta_key(self, user_id, search_id):
+		return self.get_key(user_id, search_id) + ":meta"
+
+	def get_results_key(self, digest):
+		return "results:" + digest
+
+	def get_refs_key(self, digest):
+		return self.get_results_key(digest) + ":refs"
+
+	def get_order_key(self, digest, sort_by):
+		return self.get_results_key(digest) + ":order:" + sort_by
+
+	def get_digest(self, encoded, sort_orders, salt=""):
+		"""
+		Returns the digest of a result set: its encoded results (in relevance order) and its sort orders.
+		The salt separates result sets that are equal but not interchangeable (e.g. not yet highlighted).
+		"""
+		digest = hashlib.sha1()
+		for value in encoded:
+			digest.update(len(value).to_bytes(4, "big"))
+			digest.update(value)
+		digest.update(json.dumps([sort_orders.get(x) for x in self.SORTS]).encode("utf8"))
+		digest.update(salt.encode("utf8"))
+		return digest.hexdigest()
+
+	def search(self, user_id, search_id, page, page_size=PAGE_SIZE, with_positions=False):
+		"""
+		Returns a page of cached results, in the active sort order.
+
+		Returns:
+			(-1, []) if the search is not cached, (0, []) if the page is past the last result,
+			otherwise the number of hits and the results on the page.
+			With with_positions, also the positions of the results (see update_results).
+		"""
+		window = self.get_window(user_id, search_id, page * page_size, page_size, with_positions=with_positions)
+		if window[0] == -1 or not window[1]:
+			window = (-1 if window[0] == -1 else 0, []) + (([],) if with_positions else ())
+		return window
+
+	def get_window(self, user_id, search_id, offset, page_size, with_positions=False):
+		"""
+		Returns the number of hits and the cached results in [offset, offset + page_size), in one round trip.
+		The number of hits is -1 if the search is not cached.
+		"""
+		return self.get_range(user_id, search_id, offset, offset + page_size - 1, with_positions=with_positions)
+
+	def get_all(self, user_id, search_id, with_positions=False):
+		"""
+		Returns the number of hits and every cached result (in the active sort order), in one round trip.
+		"""
+		return self.get_range(user_id, search_id, 0, -1, with_positions=with_positions)
+
+	def get_range(self, user_id, search_id, start, stop, with_positions=False):
+		resp = self.window_script(keys=[self.get_meta_key(user_id, search_id)],
+								  args=[start, stop, "1" if with_positions else "0"] + self.SORTS)
+
+		if resp[0] == -1:
+			return (-1, [], []) if with_positions else (-1, [])
+		urls = URLFormatter(search_id)
+		results = [CacheCodec.decode(x, search_id, urls=urls) if x else None for x in resp[2]]
+		if with_positions:
+			positions = [int(x) for x, result in zip(resp[3], results) if result]
+			return int(resp[0]), [x for x in results if x], positions
+		return int(resp[0]), [x for x in results if x]
+
+	def get_sort(self, user_id, search_id):
+		"""
+		Returns the active sort of a cached search, or None if the search is not cached.
+		"""
+		meta = self.hash_multi_get(self.get_meta_key(user_id, search_id), [self.NUMBER_OF_HITS, self.SORT_BY])
+		if meta[0] is None:
+			return None
+		return meta[1].decode("utf8") if meta[1] else self.RELEVANCE
+
+	def set_sort(self, user_id, search_id, sort_by):
+		"""
+		Sets the active sort of a cached search. Only O(1), the orders are precomputed on insert.
+
+		Returns:
+			True if the sort is available and the search is cached.
+		"""
+		if sort_by != self.RELEVANCE and sort_by not in self.SORTS:
+			return False
+		return bool(self.set_sort_script(keys=[self.get_meta_key(user_id, search_id)], args=[sort_by]))
+
+	def get_session(self, user_id, search_id):
+		"""
+		Returns the session of a lazy search that still has results to fetch, otherwise None.
+		"""
+		meta = self.hash_multi_get(self.get_meta_key(user_id, search_id), [self.MATERIALIZED, self.SESSION])
+		if meta[0] is None or not meta[1]:
+			return None
+		session = json.loads(meta[1])
+		session["materialized"] = int(meta[0])
+		return session
+
+	def get_result_digest(self, user_id, search_id):
+		"""
+		Returns the digest of a search's result set, which identifies the same results across searches, otherwise None.
+		"""
+		digest = self.rds.hget(self.get_meta_key(user_id, search_id), self.DIGEST)
+		return digest.decode("utf8") if digest else None
+
+	def get_highlight_query(self, user_id, search_id):
+		"""
+		Returns the query to highlight the results of a search with deferred highlighting, otherwise None.
+		"""
+		highlight_query = self.rds.hget(self.get_meta_key(user_id, search_id), self.HIGHLIGHT_QUERY)
+		return json.loads(highlight_query) if highlight_query else None
+
+	def update_results(self, user_id, search_id, results):
+		"""
+		Replaces cached results in place, e.g. once they are highlighted.
+		The results are shared with any search with the same result set.
+
+		Args:
+			results: dict {position: result}, with the positions from search/get_all with_positions.
+		"""
+		digest = self.rds.hget(self.get_meta_key(user_id, search_id), self.DIGEST)
+		if not digest or not results:
+			return
+		results_key = self.get_results_key(digest.decode("utf8"))
+		fields = []
+		urls = URLFormatter(search_id)
+		for position, x in results.items():
+			fields += [position, self.codec.encode(x, search_id, urls=urls)]
+		self.update_script(keys=[results_key], args=fields)
+
+	def insert(self, user_id, search_id, results, index, page_size=PAGE_SIZE, sort_orders=None, number_of_hits=None, session=None,
+			   highlight_query=None):
+		"""
+		Caches the results of a search, replacing any previous results for it.
+		The results should be in relevance order, which is the active sort after insert.
+		If the same result set is already cached (by any search), it is only referenced.
+
+		Args:
+			sort_orders: dict {sort name: list of positions into results}, for each of SORTS.
+			number_of_hits: the total number of hits, for lazy searches where results are only the first hits.
+			session: JSON-serializable state to fetch the rest of the hits of a lazy search.
+			highlight_query: the query to highlight the results with, when highlighting is deferred.
+
+		Returns:
+			The results on page index.
+		"""
+		meta_key = self.get_meta_key(user_id, search_id)
+		sort_orders = sort_orders or {}
+		urls = URLFormatter(search_id)
+		encoded = [self.codec.encode(x, search_id, urls=urls) for x in results]
+		extra_meta = {}
+		if session:
+			extra_meta[self.SESSION] = json.dumps(session)
+		if highlight_query:
+			extra_meta[self.HIGHLIGHT_QUERY] = json.dumps(highlight_query)
+		salt = extra_meta.get(self.HIGHLIGHT_QUERY, "")
+		if session:
+			# lazy result sets grow in place, see append
+			salt += meta_key
+		digest = self.get_digest(encoded, sort_orders, salt=salt)
+
+		previous = self.rds.hget(meta_key, self.DIGEST)
+		previous = previous.decode("utf8") if previous else digest
+
+		keys = [meta_key, self.get_results_key(digest), self.get_refs_key(digest)]
+		keys += [self.get_results_key(previous), self.get_refs_key(previous)]
+		keys += [self.get_order_key(digest, x) for x in self.SORTS]
+		keys += [self.get_order_key(previous, x) for x in self.SORTS]
+		args = [self.time_to_live, len(results), sum(len(x) for x in encoded), digest, previous, self.RELEVANCE,
+				len(results) if number_of_hits is None else number_of_hits, json.dumps(extra_meta)]
+
+		# Most inserts of a popular result set find it cached, so the results are only sent when missing
+		if not self.store_script(keys=keys, args=args + [0]):
+			orders = [json.dumps(sort_orders[x]) if sort_orders.get(x) else "" for x in self.SORTS]
+			self.store_script(keys=keys, args=args + [len(encoded)] + encoded + orders)
+
+		if self.memory_sample_rate and random.random() < self.memory_sample_rate:
+			try:
+				cache_memory_stats.observe(self.memory_usage(user_id, search_id))
+			except Exception as e:
+				traceback.print_exc()
+
+		return results[index * page_size:(index + 1) * page_size]
+
+	def append(self, user_id, search_id, materialized, results, number_of_hits, session=None):
+		"""
+		Appends the next results of a lazy search, in relevance order, in one round trip.
 
-		if not self.rds.exists(key):
-			return -1, []
+		Args:
+			materialized: the number of results the search held when the results were fetched (see get_session).
+				Nothing is appended if it changed, e.g. when a concurrent request already appended the same results.
+			number_of_hits: the total number of hits.
+			session: the session to fetch the rest of the hits, None once every hit is fetched.
 
-		# Subtract one to not count 'NUMBER_OF_HITS' page.
-		pages_cached = len(self.hash_keys(key)) - 1
-		# If the number of cached pages is less than the requested page number then return.
-		if pages_cached <= page:
-			return 0, []
+		Returns:
+			True if the results were appended.
+		"""
+		urls = URLFormatter(search_id)
+		encoded = [self.codec.encode(x, search_id, urls=urls) for x in results]
+		args = [self.time_to_live, materialized, number_of_hits, json.dumps(session) if session else "",
+				sum(len(x) for x in encoded)] + encoded
+		return bool(self.append_script(keys=[self.get_meta_key(user_id, search_id)], args=args))
 
-		jsn = self.hash_get(key, page)
-		number_of_hits = self.hash_get(key, self.NUMBER_OF_HITS)
-		return number_of_hits, json.loads(jsn) if jsn else []
+	def memory_usage(self, user_id, search_id):
+		"""
+		Returns the memory used by a cached search, in bytes. Sampled on insert, see CacheMemoryStats.
 
-	def insert(self, user_id, search_id, pages, index):
-		key = self.get_key(user_id, search_id)
+		Returns:
+			A dict with
+				encoded_bytes : the size of the encoded results.
+				redis_bytes : the memory reported by Redis (MEMORY USAGE) for the search and its result set.
+				references : the number of searches sharing the result set.
+		"""
+		meta_key = self.get_meta_key(user_id, search_id)
+		meta = self.hash_multi_get(meta_key, [self.ENCODED_BYTES, self.DIGEST])
+		keys = [meta_key]
+		if meta[1]:
+			digest = meta[1].decode("utf8")
+			keys += [self.get_results_key(digest), self.get_refs_key(digest)]
+			keys += [self.get_order_key(digest, x) for x in self.SORTS]
 
-		# Storing number of hits in the cache to be used in frontend.
-		mappings = {
-			self.NUMBER_OF_HITS: len(pages)
+		with self.batch(transaction=False) as pipe:
+			for key in keys:
+				pipe.memory_usage(key)
+			if meta[1]:
+				pipe.get(self.get_refs_key(digest))
+			resp = pipe.execute()
+		return {
+			"encoded_bytes": int(meta[0] or 0),
+			"redis_bytes": sum(x or 0 for x in resp[:len(keys)]),
+			"references": int(resp[len(keys)] or 0) if meta[1] else 0
 		}
-		# Converting the list of results into pages and storing into the cache.
-		batch = []
-		page_size = 10
-		for i, page in enumerate(pages):
-			batch.append(page)
-			if len(batch) == page_size:
-				mappings[i // page_size] = json.dumps(batch)
-				batch = []
-		if len(batch) > 0:
-			mappings[len(pages) // page_size] = json.dumps(batch)
-		self.hash_set(key, mappings)
-		return json.loads(mappings.get(index)) if mappings.get(index) else []
@@ -0,0 +1,122 @@
+import json
+import os
+import zlib
+
+from app.helpers.helpers import URLFormatter
+
+# Faster/smaller packers and compressors, in requirements.txt. Without them, the codecs fall back to json/zlib.
+try:
+	import msgpack
+except ImportError:
+	msgpack = None
+
+try:
+	import lz4.frame
+except ImportError:
+	lz4 = None
+
+
+# Fields of a formatted submission result that are rebuilt on read instead of stored
+DERIVED_FIELDS = ["redirect_url", "display_url"]
+
+
+def derive_fields(result, urls):
+	"""
+	Rebuilds the derived fields of a formatted submission result (see create_pages_submission).
+
+	Args:
+		urls: the URLFormatter of the search
+	"""
+	submission_id = result["submission_id"]
+	return {
+		"redirect_url": urls.redirect_url(submission_id),
+		"display_url": urls.display_url(result.get("orig_url") or "", submission_id)
+	}
+
+
+class CacheCodec:
+	"""
+	Encodes cached search results. Every encoded value starts with a two byte header naming its packer
+	and compressor, so values written with any codec can be read back whatever the configured codec is.
+
+	Args:
+		packer: "json" or "msgpack"
+		compressor: "none", "zlib", or "lz4"
+		strip_derived: drop redirect_url/display_url when they can be rebuilt on read
+	"""
+	PACKERS = {"json": b"j", "msgpack": b"m"}
+	COMPRESSORS = {"none": b"n", "zlib": b"z", "lz4": b"l"}
+
+	def __init__(self, packer="json", compressor="zlib", strip_derived=True, level=6):
+		if packer == "msgpack" and msgpack is None:
+			print("msgpack is not installed, cache codec falling back to json.")
+			packer = "json"
+		if compressor == "lz4" and lz4 is None:
+			print("lz4 is not installed, cache codec falling back to zlib.")
+			compressor = "zlib"
+		self.packer = packer
+		self.compressor = compressor
+		self.strip_derived = strip_derived
+		self.level = level
+		self.header = self.PACKERS[packer] + self.COMPRESSORS[compressor]
+
+	@property
+	def name(self):
+		return f"{self.packer}-{self.compressor}" + ("-stripped" if self.strip_derived else "")
+
+	def encode(self, result, search_id, urls=None):
+		"""
+		Args:
+			urls: the URLFormatter of the search, to share between many results
+		"""
+		if self.strip_derived and result.get("type") == "submission" and result.get("submission_id"):
+			derived = derive_fields(result, urls or URLFormatter(search_id))
+			if all(result.get(field) == derived[field] for field in DERIVED_FIELDS):
+				result = {k: v for k, v in result.items() if k not in DERIVED_FIELDS}
+
+		if self.packer == "msgpack":
+			data = msgpack.packb(result, use_bin_type=True)
+		else:
+			data = json.dumps(result, separators=(",", ":")).encode("utf8")
+
+		if self.compressor == "zlib":
+			data = zlib.compress(data, self.level)
+		elif self.compressor == "lz4":
+			data = lz4.frame.compress(data)
+		return self.header + data
+
+	@classmethod
+	def decode(cls, data, search_id, urls=None):
+		packer, compressor, data = data[:1], data[1:2], data[2:]
+
+		if compressor == b"z":
+			data = zlib.decompress(data)
+		elif compressor == b"l":
+			data = lz4.frame.decompress(data)
+
+		if packer == b"m":
+			result = msgpack.unpackb(data, raw=False)
+		else:
+			result = json.loads(data)
+
+		if result.get("type") == "submission" and "redirect_url" not in result:
+			result.update(derive_fields(result, urls or URLFormatter(search_id)))
+		return result
+
+
+def get_codec(name=None):
+	"""
+	Returns the codec for the cache, configured with cache_codec (default "compact"):
+		json : plain JSON, the original format
+		compact : compact JSON + zlib, derived fields stripped
+		msgpack : msgpack + zlib, derived fields stripped
+		msgpack-lz4 : msgpack + lz4, derived fields stripped (faster, slightly larger)
+	"""
+	name = name or os.environ.get("cache_codec", "compact")
+	if name == "json":
+		return CacheCodec("json", "none", strip_derived=False)
+	elif name == "msgpack":
+		return CacheCodec("msgpack", "zlib")
+	elif name == "msgpack-lz4":
+		return CacheCodec("msgpack", "lz4")
+	return CacheCodec("json", "zlib")
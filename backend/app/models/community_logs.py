@@ -20,7 +20,7 @@ class CommunityLogs(Mongo):
 			id=log_db["_id"]
 		)
 
-	def insert(self, log):
+	def insert(self, log, deferred=False):
 		log_db = {
 			"ip": log.ip,
 			"user_id": log.user_id,
@@ -30,7 +30,10 @@ class CommunityLogs(Mongo):
 		}
 		if log.submission_id:
 			log_db['submission_id'] = log.submission_id
-		log.id = self.collection.insert_one(log_db)
+		if deferred:
+			log.id = self.insert_one_deferred(log_db)
+		else:
+			log.id = self.collection.insert_one(log_db)
 		return log.id
 
 
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+
+from app.db import get_redis
+
+from app.models.redis_wrapper import Redis
+
+
+class GraphCache(Redis):
+	"""
+	Caches the work of building search visualizations (see build_search_graph).
+
+		graph:<digest>:<communities> : the nodes and edges of the graph of a result set (see Cache), for the
+			communities its questions were drawn from. Searches with the same results share the graph.
+			Kept for graph_cache_ttl seconds (default 600), so new questions show up after that.
+		rerank:<question> : a hash {<document>: score} of the rerank scores of a question, so that only
+			new question/document pairs are sent to rerank. Kept for rerank_cache_ttl seconds (default one day).
+
+	Questions and documents are identified by their sha1.
+	"""
+	def __init__(self):
+		self.rds = get_redis()
+		self.time_to_live = int(os.environ.get("graph_cache_ttl", 600))
+		self.scores_time_to_live = int(os.environ.get("rerank_cache_ttl", 60*60*24))
+
+	@staticmethod
+	def hash_text(text):
+		return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+	def get_graph_key(self, digest, communities):
+		communities = self.hash_text(",".join(sorted(str(x) for x in communities)))
+		return "graph:" + digest + ":" + communities
+
+	def get_scores_key(self, question):
+		return "rerank:" + self.hash_text(question)
+
+	def get_graph(self, digest, communities):
+		graph = self.get(self.get_graph_key(digest, communities))
+		return json.loads(graph) if graph else None
+
+	def set_graph(self, digest, communities, graph):
+		self.set(self.get_graph_key(digest, communities), json.dumps(graph))
+
+	def get_scores(self, questions, documents):
+		"""
+		Returns the cached rerank scores of every question/document pair, in one round trip.
+
+		Args:
+			questions: list of str
+			documents: list of str
+
+		Returns:
+			A list with, for each question, a list with the score of each document, or None if not cached.
+		"""
+		document_hashes = [self.hash_text(x) for x in documents]
+		with self.rds.pipeline(transaction=False) as pipe:
+			for question in questions:
+				pipe.hmget(self.get_scores_key(question), document_hashes)
+			scores = pipe.execute()
+		return [[float(x) if x is not None else None for x in row] for row in scores]
+
+	def set_scores(self, scores):
+		"""
+		Caches rerank scores.
+
+		Args:
+			scores: dict {question: {document: score}}
+		"""
+		with self.rds.pipeline(transaction=False) as pipe:
+			for question, document_scores in scores.items():
+				if not document_scores:
+					continue
+				key = self.get_scores_key(question)
+				pipe.hset(key, mapping={self.hash_text(document): score for document, score in document_scores.items()})
+				pipe.expire(key, self.scores_time_to_live)
+			pipe.execute()
@@ -17,14 +17,17 @@ class Judgments(Mongo):
 			judgment_db["_id"],
 		)
 
-	def insert(self, judgment):
+	def insert(self, judgment, deferred=False):
 		judgment_db = {
 			"ip": judgment.ip,
 			"user_id": judgment.user_id,
 			"time": judgment.time,
 			"judgments": judgment.judgments
 		}
-		judgment.id = self.collection.insert_one(judgment_db)
+		if deferred:
+			judgment.id = self.insert_one_deferred(judgment_db)
+		else:
+			judgment.id = self.collection.insert_one(judgment_db)
 		return judgment.id
 
 
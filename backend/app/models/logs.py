@@ -21,7 +21,9 @@ class Logs(Mongo):
 			submit_time=log_db["time"],
 			type="submit_context",
 			id=log_db["_id"],
-			anonymous=log_db.get("anonymous", True)
+			anonymous=log_db.get("anonymous", True),
+			preview=log_db.get("preview"),
+			mentions=log_db.get("mentions")
 		)
 
 	def insert(self, log):
@@ -34,13 +36,15 @@ class Logs(Mongo):
 			"type": "submit_context",
 			"communities": log.communities,
 			"time": log.time,
-			"anonymous": log.anonymous
+			"anonymous": log.anonymous,
+			"preview": log.preview,
+			"mentions": log.mentions
 		})
 		return inserted
 
 class Log:
 	def __init__(self, ip, user_id, highlighted_text, source_url, explanation, communities, deleted=False, anonymous=True,
-				 submit_time=None, type="submit_context", id=None):
+				 submit_time=None, type="submit_context", id=None, preview=None, mentions=None):
 		self.id = id
 		self.ip = ip
 		self.user_id = user_id
@@ -52,6 +56,10 @@ class Log:
 		self.time = time.time() if not submit_time else submit_time
 		self.deleted = deleted
 		self.anonymous = anonymous
+		# sanitized start of highlighted_text, set when written (see build_preview)
+		self.preview = preview
+		# IDs of the submissions linked to in highlighted_text, set when written (see find_mentions)
+		self.mentions = mentions
 
 	def to_dict(self):
 		return {
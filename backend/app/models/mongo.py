@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
 
+from app.event_pipeline import get_event_pipeline
+
 
 class Mongo(ABC):
 	collection = None
@@ -31,13 +33,17 @@ class Mongo(ABC):
 	def insert_one_db(self, document):
 		return self.collection.insert_one(document)
 
+	# Queued on the event pipeline and inserted in the background, for telemetry logs
+	def insert_one_deferred(self, document):
+		return get_event_pipeline().insert(self.collection, document)
+
 	# Searching one directly to MongoDB without Model
 	def find_one_db(self, query):
 		return self.collection.find_one(query)
 
 	# Searching all directly to MongoDB without Model
-	def find_db(self, query):
-		return self.collection.find(query)
+	def find_db(self, query, projection=None):
+		return self.collection.find(query, projection)
 
 	def aggregate(self,query):
 		return self.collection.aggregate(query)
@@ -0,0 +1,97 @@
+import json
+import os
+import zlib
+
+from app.db import get_redis
+
+from app.models.redis_wrapper import Redis
+
+
+# Finds the entry of a query signature at the current versions of its communities, in one round trip.
+# The entry key is derived from the signature, the communities and their versions, so bumping a version
+# orphans every entry of the community (they expire with their TTL). The version keys are hashed along with
+# the versions, as communities that never changed are all at version 0.
+# KEYS: the version key of each community, then the recent key of each community
+# ARGV: signature
+# Returns {entry key, entry or false, 1 if a community changed in the last few seconds}
+LOOKUP_SCRIPT = """
+local n = #KEYS / 2
+local parts = {ARGV[1]}
+local recent = 0
+for i = 1, n do
+	parts[#parts + 1] = KEYS[i] .. '=' .. (redis.call('GET', KEYS[i]) or '0')
+	if redis.call('EXISTS', KEYS[n + i]) == 1 then
+		recent = 1
+	end
+end
+local entry_key = 'query:' .. redis.sha1hex(table.concat(parts, ':'))
+return {entry_key, redis.call('GET', entry_key) or false, recent}
+"""
+
+
+class QueryCache(Redis):
+	"""
+	Caches submission search results (the Elastic hits) across users, keyed on a canonical query signature
+	(see search_submissions), so that identical searches are served without a round trip to Elastic.
+
+		search_version:<community_id> : a counter bumped whenever a submission of the community is added,
+			edited, moved or deleted (see bump_versions). Entries are keyed on the versions of their communities,
+			so they are never served once a community has changed.
+		search_version:<community_id>:recent : set for a few seconds after a bump. Elastic makes changes
+			searchable on its next refresh, so results are not cached while a community is still refreshing.
+		query:<sha1> : the compressed number of hits and hits.
+
+	Settings, from the environment:
+		query_cache : set to false to disable the cache (default true)
+		query_cache_ttl : seconds an entry is kept (default 300)
+		query_cache_max_bytes : max compressed size of an entry (default 1MB), larger results are not cached
+		query_cache_refresh_seconds : how long after a change results are not cached (default 2)
+	"""
+	def __init__(self):
+		# entries are compressed, so responses are not decoded as utf-8
+		self.rds = get_redis(decode_responses=False)
+		self.enabled = os.environ.get("query_cache", "true").lower() == "true"
+		self.time_to_live = int(os.environ.get("query_cache_ttl", 300))
+		self.max_bytes = int(os.environ.get("query_cache_max_bytes", 1024 * 1024))
+		self.refresh_seconds = int(os.environ.get("query_cache_refresh_seconds", 2))
+		self.lookup_script = self.rds.register_script(LOOKUP_SCRIPT)
+
+	def get_version_key(self, community_id):
+		return "search_version:" + str(community_id)
+
+	def get_recent_key(self, community_id):
+		return self.get_version_key(community_id) + ":recent"
+
+	def lookup(self, signature, communities):
+		"""
+		Returns the cached number of hits and hits of a query, or None, and the key to store the results under
+		(None if they should not be cached).
+
+		Args:
+			signature: dict, the canonical description of the query
+			communities: list of the community IDs searched
+		"""
+		communities = sorted(set(str(x) for x in communities))
+		keys = [self.get_version_key(x) for x in communities] + [self.get_recent_key(x) for x in communities]
+		entry_key, entry, recent = self.lookup_script(keys=keys, args=[json.dumps(signature, sort_keys=True)])
+		if entry:
+			cached = json.loads(zlib.decompress(entry))
+			return (cached["hits"], cached["results"]), None
+		return None, (None if recent else entry_key)
+
+	def store(self, entry_key, number_of_hits, hits):
+		data = zlib.compress(json.dumps({"hits": number_of_hits, "results": hits}, separators=(",", ":")).encode("utf8"))
+		if len(data) > self.max_bytes:
+			return False
+		self.rds.set(entry_key, data, ex=self.time_to_live)
+		return True
+
+	def bump_versions(self, communities):
+		"""
+		Invalidates the cached results of the communities, after their submissions changed.
+		"""
+		with self.rds.pipeline(transaction=False) as pipe:
+			for community_id in set(str(x) for x in communities):
+				pipe.incr(self.get_version_key(community_id))
+				pipe.set(self.get_recent_key(community_id), 1, ex=self.refresh_seconds)
+			pipe.execute()
@@ -1,4 +1,5 @@
 from abc import ABC
+from contextlib import contextmanager
 
 
 class Redis(ABC):
@@ -13,8 +14,7 @@ class Redis(ABC):
 			key: key string
 			value: value string
 		"""
-		self.rds.set(key, value)
-		self.rds.expire(key, self.time_to_live)
+		self.rds.set(key, value, ex=self.time_to_live)
 
 	def get(self, key):
 		"""
@@ -64,8 +64,10 @@ class Redis(ABC):
 		Returns:
 			all the hash values attached to a hash name
 		"""
-		self.rds.hset(name, mapping=mapping)
-		self.rds.expire(name, self.time_to_live)
+		# HSET and EXPIRE are sent together in a single round trip
+		with self.batch() as pipe:
+			pipe.hset(name, mapping=mapping)
+			pipe.expire(name, self.time_to_live)
 
 	def hash_get(self, name, key):
 		"""
@@ -104,3 +106,56 @@ class Redis(ABC):
 		"""
 		return self.rds.hkeys(name)
 
+	def hash_multi_get(self, name, keys):
+		"""
+		Returns the values attached to a list of keys in the hash, in one round trip
+
+		Args:
+			name: name of the hash
+			keys: list of keys in the hashmap
+
+		Returns:
+			list of values (None for missing keys)
+		"""
+		return self.rds.hmget(name, keys)
+
+	def hash_multi_get_many(self, requests):
+		"""
+		Runs HMGET against several hashes in a single round trip
+
+		Args:
+			requests: list of (name, keys) tuples
+
+		Returns:
+			list with one list of values per request
+		"""
+		with self.batch(transaction=False) as pipe:
+			for name, keys in requests:
+				pipe.hmget(name, keys)
+			return pipe.execute()
+
+	@contextmanager
+	def batch(self, transaction=True):
+		"""
+		Queues multiple commands and sends them to Redis in one round trip.
+		With transaction=True, the commands are wrapped in MULTI/EXEC and applied atomically.
+		Any commands still queued when the block exits are executed then; call pipe.execute()
+		inside the block to get the results.
+		For instance,
+			with self.batch() as pipe:
+				pipe.hset(name, mapping=mapping)
+				pipe.expire(name, self.time_to_live)
+
+		Args:
+			transaction: wrap the commands in MULTI/EXEC, defaults to True
+
+		Returns:
+			the redis pipeline
+		"""
+		pipe = self.rds.pipeline(transaction=transaction)
+		try:
+			yield pipe
+			if len(pipe):
+				pipe.execute()
+		finally:
+			pipe.reset()
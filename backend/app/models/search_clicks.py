@@ -15,12 +15,16 @@ class SearchClicks(Mongo):
 			id=sc_db["_id"]
 		)
 
-	def insert(self, search_click):
-		inserted = self.collection.insert_one({
+	def insert(self, search_click, deferred=False):
+		search_click_db = {
 			"time": search_click.time,
 			"search_id": search_click.search_id,
 			"clicked_url": search_click.clicked_url
-		})
+		}
+		if deferred:
+			inserted = self.insert_one_deferred(search_click_db)
+		else:
+			inserted = self.collection.insert_one(search_click_db)
 		return inserted.inserted_id
 
 
@@ -1,13 +1,56 @@
-from app.db import get_db
+import atexit
+import os
+import threading
+import time
+import traceback
+import uuid
+
+from app.db import get_db, get_redis
 from app.models.mongo import Mongo
 from app.models.searches_clicks import *
 from app.models.recommendations_clicks import *
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# Maps request types to the counter they increment
+STATS_FIELDS = {
+	"submission_view": "views",
+	"click_search_result": "search_clicks",
+	"click_recommendation_result": "recomm_clicks",
+	"likes": "likes",
+	"dislikes": "dislikes"
+}
+
+# High-volume counters that may be buffered in Redis (see write-behind below).
+# Likes and dislikes are always written through, since callers depend on the result.
+WRITE_BEHIND_FIELDS = ["views", "search_clicks", "recomm_clicks"]
+
+# Redis hash holding pending increments, as {"<submission_id>:<field>": count}
+PENDING_STATS_KEY = "submission_stats:pending"
+
 
 class SubmissionStats(Mongo):
+	index_created = False
+
 	def __init__(self):
 		cdl_db = get_db()
 		self.collection = cdl_db.submission_stats
+		# With write-behind, view/click increments accumulate in Redis and are flushed
+		# periodically to MongoDB by StatsFlusher, instead of one update per event.
+		self.write_behind = os.environ.get("stats_write_behind", "false").lower() == "true"
+		if not SubmissionStats.index_created:
+			self.create_index()
+		if self.write_behind:
+			StatsFlusher.start()
+
+	def create_index(self):
+		# One stats document per submission, so that concurrent upserts cannot create duplicates
+		try:
+			self.collection.create_index("submission_id", unique=True)
+		except Exception as e:
+			print("Could not create unique submission_id index on submission_stats: ", e)
+		SubmissionStats.index_created = True
 
 	def convert(self, stats_db):
 		return Stats(
@@ -19,53 +62,256 @@ class SubmissionStats(Mongo):
 			stats_db["dislikes"],
 			stats_db["_id"]
 		)
-		
+
+	def find_one(self, query):
+		"""
+		Also includes increments that are still pending in Redis, when write-behind is enabled.
+		"""
+		stats = super().find_one(query)
+		if not self.write_behind or "submission_id" not in query:
+			return stats
+
+		submission_id = query["submission_id"]
+		try:
+			pending = get_redis().hmget(PENDING_STATS_KEY, [f"{submission_id}:{field}" for field in WRITE_BEHIND_FIELDS])
+		except Exception as e:
+			print("Unable to read pending submission stats: ", e)
+			return stats
+
+		if not stats and not any(pending):
+			return None
+		if not stats:
+			stats = Stats(ObjectId(submission_id))
+		for field, count in zip(WRITE_BEHIND_FIELDS, pending):
+			if count:
+				setattr(stats, field, getattr(stats, field) + int(count))
+		return stats
+
 	def update_stats(self, submission_id, request_type, val=0):
 		'''
-		Creates and/or Updates the metrics in submission_stats db
+		Creates and/or Updates the metrics in submission_stats db with a single atomic upsert
 
-		Args: 
+		Args:
 			- submission_id (str) : submission_id of the submission
 			- request_type (str): possible values are [submission_view, click_search_result, click_recommendation_result, likes, dislikes]
 			- val (int): value to increment or decrement for likes and dislikes field (1/-1)
 
 		Returns:
-			Dictonary object of the updated document
+			Dictonary object of the update result, "n" is 1 when the stats were updated
+
 
-		
 		'''
 		submission_id = ObjectId(submission_id)
-		filter_criteria = {"submission_id": submission_id}
-		insert_fields = {
-			"submission_id" : submission_id,
-			"search_clicks" : 0,
-			"recomm_clicks" : 0,
-			"views" : 0,
-			"likes" : 0,
-			"dislikes" : 0
+		field = STATS_FIELDS[request_type]
+		if field in ["views", "search_clicks", "recomm_clicks"]:
+			val = 1
+
+		if self.write_behind and field in WRITE_BEHIND_FIELDS:
+			try:
+				get_redis().hincrby(PENDING_STATS_KEY, f"{submission_id}:{field}", val)
+				return {"n": 1, "nModified": 1, "ok": 1.0}
+			except Exception as e:
+				# fall back to writing through
+				print("Unable to buffer submission stats: ", e)
 
+		filter_criteria = {"submission_id": submission_id}
+		update_operation = {
+			"$inc": {field: val},
+			"$setOnInsert": {x: 0 for x in STATS_FIELDS.values() if x != field}
 		}
-		if self.collection.find_one(filter_criteria) == None:
-			self.collection.insert_one(insert_fields)
-
-		update_operation  = {}
-		if request_type == "submission_view":
-			update_operation["$inc"] = {"views": 1}
-		elif request_type == "click_search_result":
-			update_operation["$inc"] = {"search_clicks": 1}
-		elif request_type == "click_recommendation_result":
-			update_operation["$inc"] = {"recomm_clicks": 1}
-		elif request_type == "likes":
-			update_operation["$inc"] = {"likes": val}
-		elif request_type == "dislikes":
-			update_operation["$inc"] = {"dislikes": val}
-
-		updated_document = self.collection.update_one(
-			filter=filter_criteria,
-			update=update_operation,
-		)
+		try:
+			updated_document = self.collection.update_one(filter_criteria, update_operation, upsert=True)
+		except DuplicateKeyError:
+			# two concurrent upserts raced to insert, the document now exists
+			updated_document = self.collection.update_one(filter_criteria, update_operation, upsert=True)
 		return updated_document.raw_result
 
+	def flush_pending(self):
+		'''
+		Writes the increments buffered in Redis to MongoDB with one bulk_write.
+		Also flushes the buffers left behind by flushes that did not finish (e.g. the process died),
+		once they are older than stats_flush_stale_seconds (default 600).
+
+		Returns:
+			The number of submissions updated
+		'''
+		rds = get_redis()
+		updated = 0
+		# RENAME is atomic, so increments arriving during the flush go to a fresh hash
+		flushing_key = self.get_flushing_key()
+		try:
+			rds.rename(PENDING_STATS_KEY, flushing_key)
+		except Exception:
+			# nothing pending
+			flushing_key = None
+		if flushing_key:
+			updated += self.flush_key(rds, flushing_key)
+
+		stale_before = time.time() - float(os.environ.get("stats_flush_stale_seconds", 600))
+		for key in rds.scan_iter(match=PENDING_STATS_KEY + ":*"):
+			if float(key.split(":")[-2]) >= stale_before:
+				continue
+			# claim the buffer, so that only one process flushes it
+			claimed_key = self.get_flushing_key()
+			try:
+				rds.rename(key, claimed_key)
+			except Exception:
+				continue
+			updated += self.flush_key(rds, claimed_key)
+		return updated
+
+	def get_flushing_key(self):
+		return f"{PENDING_STATS_KEY}:{time.time()}:{uuid.uuid4()}"
+
+	def flush_key(self, rds, flushing_key):
+		'''
+		Writes the increments of a buffer being flushed and deletes it. Increments that could not be
+		written are put back in the pending buffer, to be retried on the next flush.
+
+		Returns:
+			The number of submissions updated
+		'''
+		pending = rds.hgetall(flushing_key)
+		increments = {}
+		for name, count in pending.items():
+			submission_id, field = name.rsplit(":", 1)
+			increments.setdefault(submission_id, {})[field] = int(count)
+
+		failed = {}
+		try:
+			updated = self.bulk_increment(increments)
+		except BulkWriteError as e:
+			traceback.print_exc()
+			# the bulk_write is unordered, the other operations were applied
+			submission_ids = list(increments)
+			failed = {submission_ids[error["index"]]: increments[submission_ids[error["index"]]]
+					  for error in e.details.get("writeErrors", [])}
+			updated = len(increments) - len(failed)
+		except Exception as e:
+			traceback.print_exc()
+			failed = increments
+			updated = 0
+
+		# the retried increments and the deletion are applied together
+		with rds.pipeline() as pipe:
+			for submission_id, counts in failed.items():
+				for field, count in counts.items():
+					pipe.hincrby(PENDING_STATS_KEY, f"{submission_id}:{field}", count)
+			pipe.delete(flushing_key)
+			pipe.execute()
+		return updated
+
+	def increment_many(self, increments):
+		'''
+		Applies many view/click increments with a single bulk_write
+
+		Args:
+			- increments (list): (submission_id, request_type) tuples, see update_stats for request types
+
+		Returns:
+			The number of submissions updated
+		'''
+		counts = {}
+		for submission_id, request_type in increments:
+			field = STATS_FIELDS[request_type]
+			submission_counts = counts.setdefault(str(submission_id), {})
+			submission_counts[field] = submission_counts.get(field, 0) + 1
+		if self.write_behind:
+			counts = self.buffer_increments(counts)
+		return self.bulk_increment(counts)
+
+	def buffer_increments(self, counts):
+		'''
+		Adds the write-behind increments to the Redis buffer, in one round trip
+
+		Args:
+			- counts (dict): {submission_id (str): {field: value to increment}}
+
+		Returns:
+			The increments that still have to be written through (likes and dislikes, or all of them
+			if Redis is unavailable), in the same format
+		'''
+		remaining = {}
+		try:
+			with get_redis().pipeline(transaction=False) as pipe:
+				for submission_id, submission_counts in counts.items():
+					for field, count in submission_counts.items():
+						if field in WRITE_BEHIND_FIELDS:
+							pipe.hincrby(PENDING_STATS_KEY, f"{submission_id}:{field}", count)
+						else:
+							remaining.setdefault(submission_id, {})[field] = count
+				pipe.execute()
+		except Exception as e:
+			# fall back to writing through
+			print("Unable to buffer submission stats: ", e)
+			return counts
+		return remaining
+
+	def bulk_increment(self, increments):
+		'''
+		Upserts counter increments for many submissions with one unordered bulk_write
+
+		Args:
+			- increments (dict): {submission_id (str): {field: value to increment}}, operations are sent
+				in the order of the dict, so the indexes of a BulkWriteError map to its keys
+
+		Returns:
+			The number of submissions updated
+		'''
+		requests = [UpdateOne(
+			{"submission_id": ObjectId(submission_id)},
+			{
+				"$inc": counts,
+				"$setOnInsert": {x: 0 for x in STATS_FIELDS.values() if x not in counts}
+			},
+			upsert=True
+		) for submission_id, counts in increments.items()]
+		if requests:
+			self.collection.bulk_write(requests, ordered=False)
+		return len(requests)
+
+
+class StatsFlusher:
+	"""
+	Background thread that periodically flushes write-behind submission stats to MongoDB.
+	The interval is set with stats_flush_interval (seconds, default 10).
+	One flusher runs per process, and a final flush is made on shutdown.
+	"""
+	thread = None
+	pid = None
+	lock = threading.Lock()
+	stop_event = threading.Event()
+
+	@classmethod
+	def start(cls):
+		if cls.thread is not None and cls.pid == os.getpid():
+			return
+		with cls.lock:
+			if cls.thread is not None and cls.pid == os.getpid():
+				return
+			cls.pid = os.getpid()
+			cls.thread = threading.Thread(target=cls.run, name="stats-flusher", daemon=True)
+			cls.thread.start()
+			atexit.register(cls.stop)
+
+	@classmethod
+	def run(cls):
+		interval = float(os.environ.get("stats_flush_interval", 10))
+		while not cls.stop_event.wait(interval):
+			cls.flush()
+
+	@classmethod
+	def flush(cls):
+		try:
+			SubmissionStats().flush_pending()
+		except Exception as e:
+			traceback.print_exc()
+
+	@classmethod
+	def stop(cls):
+		cls.stop_event.set()
+		cls.flush()
+
 
 class Stats:
 	"""
@@ -88,4 +334,4 @@ class Stats:
 		self.views = views
 		self.likes = likes
 		self.dislikes = dislikes
-		
+
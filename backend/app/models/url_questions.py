@@ -0,0 +1,113 @@
+import time
+
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from app.db import get_db
+from app.models.mongo import Mongo
+
+
+class UrlQuestions(Mongo):
+	"""
+	Index of the distinct questions generated for extension searches on each webpage (users also ask).
+	One document per (url, question), with how many times it was asked (typed_count: with a typed query),
+	when it was last asked, and the communities of the searches. It is updated with each search log
+	(see log_search_request), so that reading the questions of webpages is one indexed lookup instead of
+	a scan of their search logs.
+	"""
+	index_created = False
+
+	def __init__(self):
+		db = get_db()
+		self.collection = db.url_questions
+		if not UrlQuestions.index_created:
+			self.create_index()
+
+	def create_index(self):
+		try:
+			self.collection.create_index([("url", 1), ("question", 1)], unique=True)
+			self.collection.create_index([("url", 1), ("last_asked", DESCENDING)])
+		except Exception as e:
+			print("Could not create indexes on url_questions: ", e)
+		UrlQuestions.index_created = True
+
+	def convert(self, uq_db):
+		return UrlQuestion(
+			uq_db["url"],
+			uq_db["question"],
+			count=uq_db.get("count", 0),
+			typed_count=uq_db.get("typed_count", 0),
+			communities=uq_db.get("communities", []),
+			first_asked=uq_db.get("first_asked"),
+			last_asked=uq_db.get("last_asked"),
+			id=uq_db["_id"]
+		)
+
+	def record(self, url, question, asked_time=None, communities=None, typed=False):
+		'''
+		Counts a question asked on a webpage with a single upsert
+
+		Args:
+			- url (str) : the webpage
+			- question (str) : the generated question
+			- asked_time (float) : when it was asked, defaults to now
+			- communities (list) : the communities of the search
+			- typed (bool) : if the user typed a query
+		'''
+		asked_time = asked_time or time.time()
+		filter_criteria = {"url": url, "question": question}
+		update_operation = {
+			"$inc": {"count": 1, "typed_count": 1 if typed else 0},
+			"$max": {"last_asked": asked_time},
+			"$setOnInsert": {"first_asked": asked_time}
+		}
+		if communities:
+			update_operation["$addToSet"] = {"communities": {"$each": list(communities)}}
+		try:
+			return self.collection.update_one(filter_criteria, update_operation, upsert=True)
+		except DuplicateKeyError:
+			# two concurrent upserts raced to insert, the document now exists
+			return self.collection.update_one(filter_criteria, update_operation, upsert=True)
+
+	def find_questions(self, url, limit=20, max_time_ms=None):
+		'''
+		Returns the most recently asked questions on a webpage
+
+		Args:
+			- url (str) : the webpage
+			- limit (int) : the max number of questions
+			- max_time_ms (int) : optional server-side time limit of the lookup
+
+		Returns:
+			A list of questions (str), most recent first
+		'''
+		cursor = self.collection.find({"url": url}, {"question": 1}).sort("last_asked", DESCENDING).limit(limit)
+		if max_time_ms:
+			cursor = cursor.max_time_ms(max_time_ms)
+		return [document["question"] for document in cursor]
+
+	def find_typed_questions(self, urls, communities):
+		'''
+		Returns the questions asked with a typed query on any of the webpages, from searches in any of the communities
+
+		Args:
+			- urls (list) : the webpages
+			- communities (list) : the community IDs
+
+		Returns:
+			A list of (url, question) tuples
+		'''
+		query = {"url": {"$in": urls}, "communities": {"$in": communities}, "typed_count": {"$gt": 0}}
+		return [(document["url"], document["question"]) for document in self.collection.find(query, {"url": 1, "question": 1})]
+
+
+class UrlQuestion:
+	def __init__(self, url, question, count=0, typed_count=0, communities=[], first_asked=None, last_asked=None, id=None):
+		self.id = id
+		self.url = url
+		self.question = question
+		self.count = count
+		self.typed_count = typed_count
+		self.communities = communities
+		self.first_asked = first_asked
+		self.last_asked = last_asked
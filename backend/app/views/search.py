@@ -1,29 +1,36 @@
+import contextvars
+import csv
+import io
 import os
-import re
 import traceback
 import math
 import json
 import requests
 import random
+import threading
 import time
 
-from flask import Blueprint, request, redirect
+from flask import Blueprint, Response, request, redirect, stream_with_context
 from flask_cors import CORS
 from bson import ObjectId
-from urllib.parse import urldefrag, quote
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
-from app.helpers.helpers import token_required, token_required_public, response, Status, format_url, format_time_for_display, sanitize_input, build_display_url, hydrate_with_hashtags
-from app.helpers.helper_constants import RE_URL_DESC
+from app.helpers.helpers import token_required, token_required_public, response, Status, format_url, format_time_for_display, render_highlight, build_display_url, hydrate_with_hashtags, create_redirect_url, URLFormatter, find_mentions
 from app.helpers.prompts import llama3suffix_prompt, ics_query_prefix_prompt, ics_noquery_prefix_prompt, summarize_prefix_prompt
 
 from app.models.cache import Cache
+from app.models.graph_cache import GraphCache
+from app.models.query_cache import QueryCache
 from app.models.search_logs import SearchLogs, SearchLog
+from app.models.url_questions import UrlQuestions
 from app.models.search_clicks import SearchClicks, SearchClick
 from app.models.logs import Logs
 from app.models.users import Users
 from app.models.communities import Communities
 from app.models.submission_stats import SubmissionStats
+from app.event_pipeline import get_event_pipeline
+from app.metrics import timed
 
 
 
@@ -42,6 +49,28 @@ elastic_manager = ElasticManager(
     None,
     "submissions")
 
+# Latency budget of an extension search in seconds (extension_search_budget), and the default deadline
+# of each of its stages (extension_timeout_<stage>). Stages that miss their deadline are left out of the results.
+EXTENSION_SEARCH_BUDGET = 4.0
+EXTENSION_STAGE_TIMEOUTS = {
+    "generate": 2.0,
+    "web": 2.5,
+    "submissions": 2.5,
+    "users_also_ask": 1.0
+}
+
+# How many of the most recent questions asked on a webpage are sampled from for users also ask
+USERS_ALSO_ASK_CANDIDATES = 20
+
+# Streamed export formats (see stream_export), and the columns of CSV exports
+EXPORT_MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_CSV_FIELDS = ["submission_id", "title", "description", "submission_url", "source_url", "time", "score", "type", "communities"]
+
+# Process-wide thread pool for concurrent search stages, see get_stage_executor
+_stage_executor = None
+_stage_executor_pid = None
+_stage_executor_lock = threading.Lock()
+
 ### Endpoints ###
 @search.route("/api/search/summarize", methods=["GET"])
 @token_required
@@ -149,15 +178,21 @@ def extension_search(current_user):
     if not partial_intent and not highlighted_text:
         return response.error("One of partial_intent, highlighted_text must be provided.", Status.BAD_REQUEST)
     
+    started = time.time()
+
+    # The users also ask lookup only needs the URL, so it runs while the intent is generated
+    users_also_ask_future = submit_stage(find_asked_questions, url)
+
     try:
+        generate_timeout = stage_timeout("generate", started)
         if partial_intent and partial_intent[-1] == "?":
             predicted_intent = partial_intent  
         elif partial_intent:
             input_text = str({"partial_intent": partial_intent, "highlighted_text": highlighted_text})
-            predicted_intent = generate(input_text, ics_query_prefix_prompt, llama3suffix_prompt)[0]
+            predicted_intent = generate(input_text, ics_query_prefix_prompt, llama3suffix_prompt, timeout=generate_timeout)[0]
         else:
             input_text = str({"highlighted_text": highlighted_text})
-            predicted_intent = generate(input_text, ics_noquery_prefix_prompt, llama3suffix_prompt)[0]
+            predicted_intent = generate(input_text, ics_noquery_prefix_prompt, llama3suffix_prompt, timeout=generate_timeout)[0]
     except Exception as e:
         traceback.print_exc()
         predicted_intent = partial_intent
@@ -181,36 +216,24 @@ def extension_search(current_user):
                                    }
                                    )
     
-
-    # Get the web results
-    web_results = search_webpages(predicted_intent, search_id)
-
-    # Get any really good matches to the community submissions
+    # Web results and the best matching community submission are retrieved concurrently
     str_user_comm = [str(x) for x in user_communities]
-    num_results, submission_results = search_submissions(str(user_id), str_user_comm, predicted_intent, own_submissions=False, num_results=5)
-    if num_results > 0:
-        submission_results_pages = create_pages_submission_lite(submission_results, str(search_id))
-        queries = [predicted_intent]
-        documents = [x["title"] + " - " + x["description"] for x in submission_results_pages]
-        reranked_submissions = rerank(queries, documents)
-        if reranked_submissions:
-            ## Assume a single query
-            indices = reranked_submissions['0']["indices"]
-            scores = reranked_submissions['0']["scores"]
-            for i in range(len(indices)):
-                if scores[i] > 40:
-                    web_results = [submission_results_pages[indices[i]]] + web_results
-                    # Only include one result from submission
-                    break
+    stages = {
+        "web": submit_stage(search_webpages, predicted_intent, search_id, timeout=stage_timeout("web", started)),
+        "submissions": submit_stage(find_extension_submission, str(user_id), str_user_comm, predicted_intent, search_id, started),
+        "users_also_ask": users_also_ask_future
+    }
+    results, missed = wait_for_stages(stages, started, defaults={"web": [], "submissions": None, "users_also_ask": []})
+    if missed:
+        print(f"Extension search {search_id} returned partial results, stages past their deadline: {missed}")
+
+    web_results = results["web"]
+    if results["submissions"]:
+        # Only include one result from submission
+        web_results = [results["submissions"]] + web_results
 
     # Add Users Also Ask questions (used to be from just user's communities, now it is pulled from everywhere)
-    sl_db = SearchLogs()
-    searches_on_url = sl_db.find({"context.url": url})#, "filters.communities": {"$in": user_communities}})
-    asked_questions = []
-    for search_log in searches_on_url:
-        genq = search_log.intent["generated_question"]
-        if genq not in asked_questions and genq != predicted_intent and genq != "":
-            asked_questions.append(genq)
+    asked_questions = [x for x in results["users_also_ask"] if x != predicted_intent]
     random.shuffle(asked_questions)
     asked_questions = asked_questions[:5]
 
@@ -291,6 +314,9 @@ def website_search(current_user):
     ## Handle if page is negative, convert to int
     page = max(0, int(page))
     sort_by = request.args.get("sort_by", None)
+    if sort_by == "time":
+        # stored as "date" (see search_sort_by)
+        sort_by = "date"
 
     user_id = current_user.id
     user_communities = current_user.communities
@@ -314,11 +340,19 @@ def website_search(current_user):
             if sort_by != None and prior_search.filters["sort_by"] != sort_by:
                 search_sort_by(str(user_id),search_id,sort_by)
 
+            # Visualizations are served from their cached graph
+            if source == "website_visualize":
+                graph_data = build_search_graph(str(user_id), search_id, prior_search.filters["communities"])
+                return response.success(graph_data, Status.OK)
+
             search_results = []
             number_of_hits = -1
 
             if cache and search_id != "":
-                number_of_hits, search_results = cache.search(str(user_id), search_id, page)
+                # lazy searches fetch the results up to the requested page on demand
+                materialize_search(cache, str(user_id), search_id, (page + 1) * Cache.PAGE_SIZE)
+                number_of_hits, search_results, positions = cache.search(str(user_id), search_id, page, with_positions=True)
+                search_results = highlight_results(cache, str(user_id), search_id, search_results, positions)
                 return_obj = {
                     "search_id": search_id,
                     "total_num_results": number_of_hits,
@@ -344,7 +378,25 @@ def website_search(current_user):
         if source not in ["website_visualize", "website_homepage_recs", "website_community_page", "website_searchbar"]:
             return response.error("Invalid source.", Status.BAD_REQUEST) 
 
-        num_search_results, search_results = search_submissions(str(user_id), [str(x) for x in requested_communities], query=query, own_submissions=own_submissions)
+        # With lazy_search_pages set, only the first pages are fetched and formatted, the rest on demand.
+        # Visualizations need every result, so they are always fetched in full.
+        lazy_search_pages = int(os.environ.get("lazy_search_pages", 0))
+        lazy_session = None
+        # With deferred_highlighting, queries are ranked without highlighting, and only displayed pages are highlighted.
+        deferred_highlight = os.environ.get("deferred_highlighting", "false").lower() == "true" and query != "" and source != "website_visualize"
+        highlight_query = None
+        if deferred_highlight:
+            highlight_query, _ = submissions_query(str(user_id), [str(x) for x in requested_communities], query=query, own_submissions=own_submissions, highlight=False)
+
+        if lazy_search_pages and source != "website_visualize":
+            es_query, limit = submissions_query(str(user_id), [str(x) for x in requested_communities], query=query, own_submissions=own_submissions, highlight=not deferred_highlight)
+            # the point in time is only kept for a short while, so that searches that are not paged through
+            # do not hold it open (later pages continue with from/size)
+            lazy_session = {"query": es_query, "limit": limit,
+                            "cursor": elastic_manager.open_cursor(os.environ.get("lazy_search_pit_keep_alive", "2m"))}
+            num_search_results, search_results, lazy_session = fetch_lazy_hits(lazy_session, (page + lazy_search_pages) * Cache.PAGE_SIZE)
+        else:
+            num_search_results, search_results = search_submissions(str(user_id), [str(x) for x in requested_communities], query=query, own_submissions=own_submissions, highlight=not deferred_highlight)
         community_names = find_community_names(requested_communities)
         search_id = log_search_request(user_id, 
                                    source,
@@ -358,80 +410,24 @@ def website_search(current_user):
                                        "sort_by": "relevance"
                                    }
                                    )
-        pages = create_pages_submission(search_results, str(search_id), community_names)
-        number_of_hits = len(pages)
-        result_page = cache.insert(str(user_id), str(search_id), pages, page)
+        pages = create_pages_submission(search_results, str(search_id), community_names, deferred_highlight=deferred_highlight)
+        if lazy_session:
+            # the sort orders are computed once every result is fetched, see materialize_search
+            lazy_session["community_names"] = community_names
+            number_of_hits = num_search_results
+            result_page = cache.insert(str(user_id), str(search_id), pages, page, number_of_hits=number_of_hits, session=lazy_session,
+                                       highlight_query=highlight_query)
+        else:
+            number_of_hits = len(pages)
+            result_page = cache.insert(str(user_id), str(search_id), pages, page, sort_orders=compute_sort_orders(pages),
+                                       highlight_query=highlight_query)
+        # the new search is in relevance order, so the page is at its positions
+        result_page = highlight_results(cache, str(user_id), str(search_id), result_page,
+                                        list(range(page * Cache.PAGE_SIZE, page * Cache.PAGE_SIZE + len(result_page))))
 
 
-        # Call export with this `search_id` -> list of submissions for that search -> exported_list
         if source == "website_visualize":
-            submissions = export_helper(str(user_id), str(search_id))
-            sl_db = SearchLogs()
-
-            sub_mentions = {}
-            questions_list = []
-            docs = []
-            urls_to_find = {}
-
-            for obj in submissions['data']:
-                mentions = re.finditer(RE_URL_DESC, obj['description'])
-                for mention in mentions:
-                    par_sub_id = mention.group(0)[-24:]
-                    if sub_mentions.get(par_sub_id):
-                        sub_mentions[par_sub_id].append(obj['submission_id'])
-                    else:
-                        sub_mentions[par_sub_id] = [obj['submission_id']]
-
-                sub_url = obj["submission_url"]
-                source_url = obj["source_url"]
-
-
-                if sub_url not in urls_to_find:
-                    urls_to_find[sub_url] = [obj["submission_id"]]
-                else:
-                    urls_to_find[sub_url].append(obj["submission_id"])
-
-                if source_url:
-                    if source_url not in urls_to_find:
-                        urls_to_find[source_url] = [obj["submission_id"]]
-                    else:
-                        urls_to_find[source_url].append(obj["submission_id"])
-                
-                doc = obj["title"] + " - " + obj["description"]
-                docs.append(doc)
-
-
-            all_url_list = list(urls_to_find.keys())
-            searches_on_urls = sl_db.find_db({"context.url" : {"$in": all_url_list}, "filters.communities": {"$in": requested_communities}})
-            for search_log in searches_on_urls:
-                genq = search_log["intent"]["generated_question"]
-                if search_log["intent"].get("typed_query", "") != "":
-                    url = search_log["context"]["url"]
-                    sources = urls_to_find[url]
-                    for source_id in sources:
-                        q_obj = {"text": genq, "source_id": source_id}
-                        if q_obj not in questions_list:
-                            questions_list.append(q_obj)
-
-            
-            if docs and questions_list:
-                scored_docs = rerank([x["text"] for x in questions_list], docs)
-                if scored_docs:
-                    for qidx in scored_docs:
-                        indices = scored_docs[qidx]["indices"]
-                        scores = scored_docs[qidx]["scores"]
-                        qidx = int(qidx)
-                        # Only check top question-doc pair, and only have a single target
-                        if scores[0] > 40:
-                            target_id  = submissions["data"][indices[0]]["submission_id"]
-                            questions_list[qidx]["target_id"] = target_id
-
-            # Using sub_mentions dict to create mentions
-            for obj in submissions['data']:
-                curr_id = obj['submission_id']
-                obj["mentions"] = sub_mentions.get(curr_id, [])
-
-            graph_data = prep_subs_viz_conns(submissions['data'], questions_list)
+            graph_data = build_search_graph(str(user_id), str(search_id), requested_communities)
             return response.success(graph_data, Status.OK)
         else:
             # add the all community
@@ -489,7 +485,17 @@ def autocomplete(current_user):
             user_communities.append(x)
 
     try:
-        _, submissions_hits = elastic_manager.auto_complete(query, user_communities, page=0, page_size=20)
+        # Titles starting with the query, from the completion index and already deduplicated
+        try:
+            submissions_hits = elastic_manager.suggest_titles(query, user_communities, size=topn)
+        except Exception as e:
+            print("Title suggestions not available, searching titles instead: ", e)
+            submissions_hits = []
+
+        # Otherwise, titles containing the query anywhere
+        if not submissions_hits:
+            _, submissions_hits = elastic_manager.auto_complete(query, user_communities, page=0, page_size=20)
+
         seen_titles = {}
         suggestions = []
         for x in submissions_hits:
@@ -526,12 +532,24 @@ def export(current_user):
         search_id: str, required
             The ID of the search to export.
 
+        format: str, optional
+            "json" (default), or "ndjson"/"csv" to stream the export in chunks (see stream_export).
+
     Returns
     ---------
-    On success, a response.success object with the output of export_helper.
+    On success, a response.success object with the output of export_helper,
+    or the streamed export file for the ndjson and csv formats.
     """
     search_id = request.args.get("search_id", "")
+    export_format = request.args.get("format", "json")
     user_id = str(current_user.id)
+    if export_format in EXPORT_MIMETYPES:
+        # checked before streaming, since errors cannot be returned once the response has started
+        if not ObjectId.is_valid(search_id):
+            return response.error("Invalid search_id.", Status.BAD_REQUEST)
+        return Response(stream_with_context(stream_export(user_id, search_id, export_format)),
+                        mimetype=EXPORT_MIMETYPES[export_format],
+                        headers={"Content-Disposition": f"attachment; filename=export_{search_id}.{export_format}"})
     return response.success(export_helper(user_id, search_id), Status.OK)
 
 ### Helpers ###
@@ -557,7 +575,8 @@ def create_pages_submission_lite(search_results, search_id):
     for hit in search_results:
         sub_id = str(hit["_id"])
         url = format_url("", sub_id)
-        description = hit["_source"].get("highlighted_text", "")
+        # the text is not returned with hits, see SUBMISSION_RESULT_FIELDS
+        description = hit["_source"].get("preview")
         if not description:
             description = "No Preview Available."
         result = {
@@ -577,7 +596,76 @@ def create_pages_submission_lite(search_results, search_id):
     return all_results
         
 
-def create_pages_submission(search_results, search_id, community_names, toggle_display="highlight"):
+def format_description(hit, toggle_display="highlight"):
+    """Formats the description of a submission hit, from its highlight fragments or its text.
+
+    Method Parameters
+    ----------
+    hit : dict, required
+        An OpenSearch hit.
+
+    toggle_display : str, optional
+        See create_pages_submission.
+
+    Returns
+    ---------
+    str
+        The sanitized description, keeping the <mark> tags of highlights.
+    """
+    if hit.get("highlight", None) and hit["highlight"].get("highlighted_text") and toggle_display == "highlight":
+        # only the fragments are escaped, the highlight markers become <mark> tags
+        return render_highlight(hit["highlight"]["highlighted_text"])
+
+    # sanitized when the submission was written (see build_preview), existing submissions are backfilled
+    # by elastic/oct2026_sanitize_previews.py
+    return hit["_source"].get("preview") or "No Preview Available"
+
+
+def highlight_results(cache, user_id, search_id, results, positions):
+    """Fills in the descriptions of results cached with deferred highlighting (see website_search),
+    with one highlight query per 100 results, and caches them.
+
+    Method Parameters
+    ----------
+    cache : Cache, required
+    user_id : str, required
+        The ID of the user.
+    search_id : str, required
+        The ID of the search.
+    results : list of dict, required
+        Cached results, e.g. a page.
+    positions : list of int, required
+        The positions of the results in the cache.
+
+    Returns
+    ---------
+    list of dict
+        The results, highlighted.
+    """
+    pending = [i for i, x in enumerate(results) if x.get("highlight_pending")]
+    if not pending:
+        return results
+
+    highlight_query = cache.get_highlight_query(user_id, search_id)
+    updated = {}
+    for start in range(0, len(pending), 100):
+        chunk = pending[start:start + 100]
+        hits = {}
+        if highlight_query:
+            hits = elastic_manager.get_highlights(highlight_query, [results[i]["submission_id"] for i in chunk])
+        for i in chunk:
+            result = results[i]
+            result["description"] = format_description(hits.get(result["submission_id"], {"_source": {}}))
+            if not result.get("hashtags"):
+                result["hashtags"] = hydrate_with_hashtags(result["title"], result["description"])
+            del result["highlight_pending"]
+            updated[positions[i]] = result
+
+    cache.update_results(user_id, search_id, updated)
+    return results
+
+
+def create_pages_submission(search_results, search_id, community_names, toggle_display="highlight", deferred_highlight=False):
     """Formats raw OpenSearch search results for display on the website.
 
     Method Parameters
@@ -594,93 +682,245 @@ def create_pages_submission(search_results, search_id, community_names, toggle_d
     toggle_display : str, optional
         Can either be "highlight" which will add markers for highlighting matching text of query, and not otherwise.
 
+    deferred_highlight : bool, optional
+        If true, the hits were ranked without highlighting, and the descriptions are left to highlight_results.
+
     Returns
     ---------
     list of dict
         A list of search results.
     """
     return_obj = []
-    cdl_users = Users()
+    urls = URLFormatter(search_id)
+
+    # the usernames of every non-anonymous creator, in one query
+    # (old submissions may not have the anonymous field, default to true)
+    creator_ids = {ObjectId(hit["_source"]["user_id"]) for hit in search_results
+                   if not hit["_source"].get("anonymous", True) and hit["_source"].get("user_id")}
+    usernames = {}
+    if creator_ids:
+        for creator in Users().find_db({"_id": {"$in": list(creator_ids)}}, {"username": 1}):
+            usernames[str(creator["_id"])] = creator.get("username", "")
 
     for hit in search_results:
+        source = hit["_source"]
+        submission_id = str(hit["_id"])
+        url = source.get("source_url", "")
+
         result = {
-            "redirect_url": None,
-            "display_url": None,
-            "orig_url": None,
-            "submission_id": None,
-            "title": None,
+            "redirect_url": urls.redirect_url(submission_id),
+            "display_url": urls.display_url(url, submission_id),
+            "orig_url": url,
+            "submission_id": submission_id,
+            "title": source.get("explanation", "No Title Available"),
             "description": None,
-            "score": hit.get("_score", 0),
+            "score": hit.get("_score", 0) or 0,
             "time": "",
             "type": "submission",
-            "communities_part_of": [],
+            # possible that returns additional communities?
+            "communities_part_of": {community_id: community_names[community_id] for community_id in
+                                    source.get("communities", []) if community_id in community_names},
             "username": ""
         }
 
-        if not result["score"]: 
-            result["score"] = 0
+        if not source.get("anonymous", True):
+            result["username"] = usernames.get(source.get("user_id"), "")
 
-        result["title"] = hit["_source"].get("explanation", "No Title Available")
+        if deferred_highlight:
+            # filled in when the page is displayed, see highlight_results
+            result["description"] = ""
+            result["highlight_pending"] = True
+        else:
+            result["description"] = format_description(hit, toggle_display=toggle_display)
 
+        if "time" in source:
+            result["time"] = format_time_for_display(source["time"])
+        elif "scrape_time" in source:
+            result["time"] = format_time_for_display(source["scrape_time"])
 
-        # Old submissions may not have the anonymous field, default to true
-        is_anonymous  = hit["_source"].get("anonymous", True)
-        if not is_anonymous:
-            creator = cdl_users.find_one({"_id": ObjectId(hit["_source"]["user_id"])})
-            if creator:
-                    result["username"] = creator.username
+        # the hashtags extracted at index time, from the title and the whole text
+        if "hashtags" in source:
+            result["hashtags"] = source["hashtags"]
+        else:
+            result["hashtags"] = hydrate_with_hashtags(result["title"], result["description"])
+        return_obj.append(result)
 
+    return return_obj
 
-        description = " .... ".join(hit["highlight"].get("highlighted_text", [])) if hit.get("highlight", None) and toggle_display == "highlight" else hit["_source"].get("highlighted_text", None)
-        if not description:
-            description ="No Preview Available"
 
-        
-        
-        result["description"] = description
+def get_stage_executor():
+    """Returns the process-wide thread pool that runs the concurrent stages of a search.
+    Threads do not survive a fork, so a new pool is created in any forked child.
+    The number of threads is set with search_stage_workers (default 16).
+    """
+    global _stage_executor, _stage_executor_pid
 
-        # So that we can (1) mitigate XSS and (2) keep the highlighted match text
-        # AND (3) properly render markdown pages on submission view (quote, code, etc.)
-        result["description"] = re.sub("<mark>", "@startmark@", result["description"])
-        result["description"] = re.sub("<\/mark>", "@endmark@", result["description"])
-        result["description"] = sanitize_input(result["description"])
-        result["description"] = re.sub("@startmark@", "<mark>", result["description"])
-        result["description"] = re.sub("@endmark@", "</mark>", result["description"])
+    pid = os.getpid()
+    if _stage_executor is not None and _stage_executor_pid == pid:
+        return _stage_executor
 
+    with _stage_executor_lock:
+        if _stage_executor is None or _stage_executor_pid != pid:
+            _stage_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("search_stage_workers", 16)),
+                                                 thread_name_prefix="search-stage")
+            _stage_executor_pid = pid
 
+    return _stage_executor
 
-        # possible that returns additional communities?
-        result["communities_part_of"] = {community_id: community_names[community_id] for community_id in
-                                         hit["_source"].get("communities", []) if community_id in community_names}
 
-        result["submission_id"] = str(hit["_id"])
+def submit_stage(fn, *args, **kwargs):
+    """Runs a search stage on the stage thread pool (see get_stage_executor).
+    The stage runs in a copy of the request's context, so its backend time is attributed to the request (see app.metrics).
 
-        if "time" in hit["_source"]:
-            formatted_time = format_time_for_display(hit["_source"]["time"])
-            result["time"] = formatted_time
-        elif "scrape_time" in hit["_source"]:
-            formatted_time = format_time_for_display(hit["_source"]["scrape_time"])
-            result["time"] = formatted_time
+    Returns
+    ---------
+    Future
+        The result of the stage, with the time.time() it was submitted (submitted), from which its deadline is measured.
+    """
+    submitted = time.time()
+    future = get_stage_executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    future.submitted = submitted
+    return future
 
 
-        # Display URL
-        url = hit["_source"].get("source_url", "")
+def stage_deadline(stage, started, submitted=None):
+    """Returns the time.time() by which a stage of the extension search should be done: its timeout
+    (extension_timeout_<stage>) from when it was submitted, capped by the end of the request budget
+    (extension_search_budget) measured from when the request started.
 
-        url_for_display = format_url(url, str(result["submission_id"]))
-        url_for_redirect = format_url("", str(result["submission_id"]))
+    Method Parameters
+    ----------
+    stage : str, required
+        One of EXTENSION_STAGE_TIMEOUTS.
+    started : float, required
+        The time.time() the request started.
+    submitted : float, optional
+        The time.time() the stage was submitted, default is now.
 
-        display_url = build_display_url(url_for_display)
-        result["display_url"] = display_url
-        result["orig_url"] = url
-        result["redirect_url"] = create_redirect_url(url_for_redirect, search_id)
+    Returns
+    ---------
+    float
+        The deadline.
+    """
+    budget = float(os.environ.get("extension_search_budget", EXTENSION_SEARCH_BUDGET))
+    timeout = float(os.environ.get("extension_timeout_" + stage, EXTENSION_STAGE_TIMEOUTS[stage]))
+    submitted = submitted if submitted is not None else time.time()
+    return min(submitted + timeout, started + budget)
 
-        result["hashtags"] = hydrate_with_hashtags(result["title"], result["description"])          
-        return_obj.append(result)
 
-    return return_obj
+def stage_timeout(stage, started):
+    """Returns how long a stage of the extension search may take from now, in seconds (see stage_deadline).
+
+    Method Parameters
+    ----------
+    stage : str, required
+        One of EXTENSION_STAGE_TIMEOUTS.
+    started : float, required
+        The time.time() the request started.
+
+    Returns
+    ---------
+    float
+        The timeout in seconds, at least 10ms (requests does not accept a timeout of 0).
+    """
+    return max(0.01, stage_deadline(stage, started) - time.time())
+
+
+def wait_for_stages(stages, started, defaults):
+    """Waits for concurrently running stages until their deadlines (see stage_deadline), measured from when
+    each stage was submitted (see submit_stage).
+    A stage that misses its deadline or fails gets its default, so partial results can be returned.
+    Stages that miss their deadline keep running in the background, but their results are dropped.
+
+    Method Parameters
+    ----------
+    stages : dict, required
+        {<stage name>: <Future of the stage, from submit_stage>}
+    started : float, required
+        The time.time() the request started.
+    defaults : dict, required
+        {<stage name>: <result used when the stage misses its deadline>}
+
+    Returns
+    ---------
+    dict, list
+        {<stage name>: <result>}, and the names of the stages that missed their deadline.
+    """
+    deadlines = {name: stage_deadline(name, started, getattr(stages[name], "submitted", None)) for name in stages}
+    results = {}
+    missed = []
+    for name in sorted(stages, key=lambda x: deadlines[x]):
+        try:
+            results[name] = stages[name].result(timeout=max(0.0, deadlines[name] - time.time()))
+        except FutureTimeoutError:
+            stages[name].cancel()
+            results[name] = defaults[name]
+            missed.append(name)
+        except Exception as e:
+            traceback.print_exc()
+            results[name] = defaults[name]
+    return results, missed
+
+
+def find_extension_submission(user_id, requested_communities, query, search_id, started):
+    """Finds the best community submission for an extension search, if it is a really good match.
+
+    Method Parameters
+    ----------
+    user_id : str, required
+        The ID of the user performing the search.
+    requested_communities: list of str, required
+        The community IDs to search.
+    query : str, required
+        The predicted intent of the search.
+    search_id : ObjectId, required
+        The ID of the search.
+    started : float, required
+        The time.time() the request started, for the rerank timeout.
+
+    Returns
+    ---------
+    dict
+        The formatted submission result (see create_pages_submission_lite), or None.
+    """
+    # The extension only shows the stored preview, so there is nothing to highlight
+    num_results, submission_results = search_submissions(user_id, requested_communities, query, own_submissions=False, num_results=5, highlight=False)
+    if num_results == 0:
+        return None
+
+    submission_results_pages = create_pages_submission_lite(submission_results, str(search_id))
+    queries = [query]
+    documents = [x["title"] + " - " + x["description"] for x in submission_results_pages]
+    reranked_submissions = rerank(queries, documents, timeout=stage_timeout("submissions", started))
+    if reranked_submissions:
+        ## Assume a single query
+        indices = reranked_submissions['0']["indices"]
+        scores = reranked_submissions['0']["scores"]
+        for i in range(len(indices)):
+            if scores[i] > 40:
+                return submission_results_pages[indices[i]]
+    return None
+
+
+def find_asked_questions(url):
+    """Finds the questions previously generated for searches on a webpage (users also ask).
 
+    Method Parameters
+    ----------
+    url : str, required
+        The URL of the webpage.
 
-def search_webpages(query, search_id, format_for_frontend=True):
+    Returns
+    ---------
+    list of str
+        The most recently asked distinct questions, at most USERS_ALSO_ASK_CANDIDATES.
+    """
+    # Bound the lookup on the server too, past the deadline the result is dropped anyway
+    max_time_ms = int(stage_timeout("users_also_ask", time.time()) * 1000)
+    return UrlQuestions().find_questions(url, limit=USERS_ALSO_ASK_CANDIDATES, max_time_ms=max_time_ms)
+
+
+def search_webpages(query, search_id, format_for_frontend=True, timeout=None):
     """Calls the external search API to search webpages.
     Previously, we indexed, but now we rely on an external service.
 
@@ -696,6 +936,9 @@ def search_webpages(query, search_id, format_for_frontend=True):
         If True, the data is hydrated for display.
         Otherwise the raw results are returned.
 
+    timeout: float, optional
+        The timeout of the request in seconds, defaults to no timeout.
+
     Returns
     ---------
     list of dict
@@ -715,7 +958,8 @@ def search_webpages(query, search_id, format_for_frontend=True):
 
     # Call the API
     try:
-        response = requests.get(endpoint, headers=headers, params=params)
+        with timed("web"):
+            response = requests.get(endpoint, headers=headers, params=params, timeout=timeout)
         response.raise_for_status()
         response = response.json()
         if format_for_frontend:
@@ -747,7 +991,7 @@ def search_webpages(query, search_id, format_for_frontend=True):
         traceback.print_exc()
         return []
 
-def search_submissions(user_id, requested_communities, query="", own_submissions=True, num_results=2000):
+def search_submissions(user_id, requested_communities, query="", own_submissions=True, num_results=2000, highlight=True):
     """Communicates with Elastic to search submissions. Handles 4 cases:
     1. Viewing one's own submissions
     2. Viewing all submissions to a community
@@ -766,12 +1010,35 @@ def search_submissions(user_id, requested_communities, query="", own_submissions
         If true, then search is scoped over user's submissions. Defaults to true.
     num_results : int, optional
         The number of results to return (via the single page), default is 2000
+    highlight : bool, optional
+        If false, queries are ranked without highlighting (see highlight_results). Defaults to true.
 
     Returns
     ---------
     int, list
         The number of hits, the list of the search results from Elastic.
     """
+    # Identical searches are shared across users, until a submission of one of the communities changes (see QueryCache)
+    entry_key = None
+    try:
+        query_cache = QueryCache()
+        if query_cache.enabled:
+            # the results of own submissions and of most recent submissions depend on the user
+            per_user = own_submissions or (query == "" and len(requested_communities) != 1)
+            signature = {
+                "query": elastic_manager.process_query(query) if query else "",
+                "own_submissions": bool(own_submissions),
+                "user_id": str(user_id) if per_user else None,
+                "num_results": num_results,
+                "highlight": highlight
+            }
+            cached, entry_key = query_cache.lookup(signature, requested_communities)
+            if cached:
+                return cached
+    except Exception as e:
+        traceback.print_exc()
+        query_cache = None
+
     if query == "":
         # Case - viewing all of one's submissions
         if own_submissions:
@@ -787,15 +1054,129 @@ def search_submissions(user_id, requested_communities, query="", own_submissions
     else:
         # Case - querying own submissions
         if own_submissions:
-            number_of_hits, hits = elastic_manager.search(query, requested_communities, user_id=str(user_id), page_size=num_results)
+            number_of_hits, hits = elastic_manager.search(query, requested_communities, user_id=str(user_id), page_size=num_results, highlight=highlight)
         # Case - querying all submissions
         else:
-            number_of_hits, hits = elastic_manager.search(query, requested_communities, page_size=num_results)
-            
+            number_of_hits, hits = elastic_manager.search(query, requested_communities, page_size=num_results, highlight=highlight)
+
+    if entry_key:
+        try:
+            query_cache.store(entry_key, number_of_hits, hits)
+        except Exception as e:
+            traceback.print_exc()
     return number_of_hits, hits
 
 
-def export_helper(user_id, search_id):
+def submissions_query(user_id, requested_communities, query="", own_submissions=True, num_results=2000, highlight=True):
+    """Builds the Elastic query of search_submissions (same 4 cases), to fetch its hits page by page.
+
+    Method Parameters
+    ----------
+    See search_submissions.
+
+    Returns
+    ---------
+    dict, int
+        The query body, and the maximum number of hits to fetch.
+    """
+    if query == "":
+        if own_submissions:
+            if len(requested_communities) == 1:
+                return elastic_manager.build_submissions_query(user_id, community_id=requested_communities[0]), num_results
+            return elastic_manager.build_submissions_query(user_id), num_results
+        elif len(requested_communities) == 1:
+            return elastic_manager.build_community_query(requested_communities[0]), num_results
+        return elastic_manager.build_most_recent_query(user_id, requested_communities), 50
+    elif own_submissions:
+        return elastic_manager.build_search_query(query, requested_communities, user_id=str(user_id), highlight=highlight), num_results
+    return elastic_manager.build_search_query(query, requested_communities, highlight=highlight), num_results
+
+
+def fetch_lazy_hits(session, count):
+    """Fetches the next hits of a lazy search, from its point in time and search_after cursor.
+
+    Method Parameters
+    ----------
+    session : dict, required
+        The lazy search session, with the query, limit, and cursor (see website_search).
+    count : int, required
+        The number of hits to fetch.
+
+    Returns
+    ---------
+    int, list, dict
+        The number of hits (from Elastic, up to the limit), the hits, and the updated session,
+        which is None once every hit has been fetched.
+    """
+    cursor = session["cursor"]
+    number_of_hits = session.get("number_of_hits", 0)
+    hits = []
+    exhausted = False
+    while len(hits) < count and cursor["offset"] < session["limit"]:
+        size = min(count - len(hits), session["limit"] - cursor["offset"])
+        number_of_hits, page_hits, cursor = elastic_manager.search_page(session["query"], size, cursor)
+        hits += page_hits
+        if len(page_hits) < size:
+            exhausted = True
+            break
+
+    number_of_hits = min(number_of_hits, session["limit"])
+    if exhausted or cursor["offset"] >= number_of_hits:
+        if cursor["pit_id"]:
+            elastic_manager.close_point_in_time(cursor["pit_id"])
+        return cursor["offset"] if exhausted else number_of_hits, hits, None
+
+    session = dict(session)
+    session["cursor"] = cursor
+    session["number_of_hits"] = number_of_hits
+    return number_of_hits, hits, session
+
+
+def materialize_search(cache, user_id, search_id, count=None):
+    """Fetches and caches more results of a lazy search, so that at least the first count results
+    (plus lazy_search_pages pages ahead) are cached. Does nothing for searches that are fully cached.
+
+    Method Parameters
+    ----------
+    cache : Cache, required
+    user_id : str, required
+        The ID of the user.
+    search_id : str, required
+        The ID of the search.
+    count : int, optional
+        The number of results needed, default is every result.
+
+    Returns
+    ---------
+    bool
+        True if more results were cached.
+    """
+    session = cache.get_session(user_id, search_id)
+    if not session:
+        return False
+    materialized = session.pop("materialized")
+    if count is None:
+        count = session["limit"]
+    elif materialized >= count:
+        return False
+    count += int(os.environ.get("lazy_search_pages", 0)) * Cache.PAGE_SIZE
+
+    community_names = session["community_names"]
+    number_of_hits, hits, session = fetch_lazy_hits(session, count - materialized)
+    highlight_query = cache.get_highlight_query(user_id, search_id)
+
+    results = create_pages_submission(hits, search_id, community_names, deferred_highlight=highlight_query is not None)
+    if not cache.append(user_id, search_id, materialized, results, number_of_hits, session=session):
+        # a concurrent request already cached these results
+        return False
+    if not session:
+        # lazy searches stay in relevance order until every result is cached (see search_sort_by)
+        _, results = cache.get_all(user_id, search_id)
+        cache.insert(user_id, search_id, results, 0, sort_orders=compute_sort_orders(results), highlight_query=highlight_query)
+    return True
+
+
+def export_helper(user_id, search_id, with_mentions=False):
     """Helper function to export search results. Note that the entire submission is included, not just the matching search text.
 
     Method Parameters
@@ -804,6 +1185,8 @@ def export_helper(user_id, search_id):
         The ID of the user performing the search.
     search_id: str, required
         The ID of the search.
+    with_mentions: bool, optional
+        If True, each result also has "mentioned_ids", the IDs of the submissions it links to. Defaults to False.
 
     Returns
     ---------
@@ -816,15 +1199,37 @@ def export_helper(user_id, search_id):
             data (the formatted search results)
     """
     all_results = []
-    index = 0
     try:
         cache = Cache()
     except Exception as e:
         print(e)
         cache = None
 
+    export_obj = get_export_info(search_id)
+
+    if cache:
+        materialize_search(cache, user_id, search_id)
+        # the whole result set in one request
+        _, all_results = cache.get_all(user_id, search_id)
+
+    export_obj["data"] = format_export_results(all_results, with_mentions=with_mentions)
+    return export_obj
+
+
+def get_export_info(search_id):
+    """Returns the description of an exported search.
+
+    Method Parameters
+    ----------
+    search_id: str, required
+        The ID of the search.
+
+    Returns
+    ---------
+    dict
+        With the query, own_submissions, search_time and requested_communities of the search (None if it is not found).
+    """
     search_logs = SearchLogs()
-    submissions = Logs()
     prior_search = search_logs.find_one({"_id": ObjectId(search_id)})
     if prior_search:
         intent = prior_search.intent
@@ -842,20 +1247,33 @@ def export_helper(user_id, search_id):
         search_time = None
         print("Could not find prior search")
 
-    if cache:
-        number_of_hits, page = cache.search(user_id, search_id, index)
-        all_results += page
-        number_of_hits = int(number_of_hits)
-        while number_of_hits > (index * 10) + 10:
-            index += 1
-            number_of_hits, page = cache.search(user_id, search_id, index)
-            number_of_hits = int(number_of_hits)
-            all_results += page
+    return {
+            "query": query,
+            "own_submissions": own_submissions,
+            "search_time": search_time,
+            "requested_communities": requested_communities,
+        }
 
+
+def format_export_results(results, with_mentions=False):
+    """Formats cached search results for export, with the whole text of each submission as its description.
+    The descriptions are loaded with a single query, so results should be passed in bounded batches.
+
+    Method Parameters
+    ----------
+    results : list of dict, required
+        Cached search results (see create_pages_submission), formatted in place.
+    with_mentions: bool, optional
+        If True, each result also has "mentioned_ids", the IDs of the submissions it links to. Defaults to False.
+
+    Returns
+    ---------
+    list of dict
+        The formatted results.
+    """
     # To query all the results in batch
     submission_ids_to_find = []
-    webpages_ids_to_find = []
-    for result in all_results:
+    for result in results:
         del result["redirect_url"]
         del result["display_url"]
 
@@ -871,68 +1289,114 @@ def export_helper(user_id, search_id):
 
         if result["type"] == "submission":
             submission_ids_to_find.append(ObjectId(result["submission_id"]))
-        else:
-            webpages_ids_to_find.append(ObjectId(result["submission_id"]))
 
+        # the description is replaced by the whole text below, so it is never highlighted for exports
         del result["description"]
-
+        result.pop("highlight_pending", None)
 
         del result["username"]
 
         if "children" in result:
             del result["children"]
 
-        del result["hashtags"]
+        result.pop("hashtags", None)
+
+    if not submission_ids_to_find:
+        return results
 
-    submissions = list(submissions.find_db({'_id': {'$in': submission_ids_to_find}}))
+    submissions = Logs().find_db({'_id': {'$in': submission_ids_to_find}}, {"highlighted_text": 1, "mentions": 1})
 
     # Map to hold id -> result obj
     id_result_map = {}
     for sub in submissions:
         id_result_map[str(sub['_id'])] = sub
 
-    for result in all_results:
-        # Get the sub/web return from MongoDB
-        curr = id_result_map[result["submission_id"]]
-        result["description"] = curr['highlighted_text']
+    for result in results:
+        # Get the sub/web return from MongoDB, submissions deleted since the search have no text
+        curr = id_result_map.get(result["submission_id"], {})
+        result["description"] = curr.get('highlighted_text', "")
+        if with_mentions:
+            # stored when the submission is written, older submissions are scanned here
+            mentions = curr.get("mentions")
+            result["mentioned_ids"] = mentions if mentions is not None else find_mentions(result["description"])
 
+    return results
 
-    return {
-            "query": query,
-            "own_submissions": own_submissions,
-            "search_time": search_time,
-            "requested_communities": requested_communities,
-            "data": all_results,
-        }
 
-def create_redirect_url(url, search_id):
-    """Create the redirect URL for logging clicks.
+def stream_export(user_id, search_id, export_format="ndjson"):
+    """Generates the export of search results in chunks, reading export_batch_size results (default 500) at a time
+    from the cache and joining their descriptions from MongoDB, so memory does not grow with the number of results.
+    The results of lazy searches that are not cached yet are read from Elastic in batches of the same size.
 
     Method Parameters
     ----------
-    url : str, required
-        The target URL page to visit.
-
-    search_id : str, required
-        The search event ID.
+    user_id : str, required
+        The ID of the user performing the search.
+    search_id: str, required
+        The ID of the search.
+    export_format: str, optional
+        "ndjson": the first line is the search (see get_export_info), then one formatted result per line.
+        "csv": a header, then one formatted result per row (see EXPORT_CSV_FIELDS).
+        Defaults to "ndjson".
 
     Returns
     ---------
-    str
-        The redirect URL that includes the target URL and the search ID.
+    generator of str
+        The chunks of the export, one per batch of results.
     """
-
-    redirect_url = os.environ["api_url"] + ":" + os.environ["api_port"] + "/api/search/redirect?"
-    redirect_url += "search_id=" + search_id
-    url, fragment = urldefrag(url)
-    # handling edge cases
-    if "pdf" in url or "smartdiff" in url and fragment != "":  # for proxies
-        redirect_url += "&redirect_url=" + url + "#" + fragment
-    elif "youtube" in url:
-        redirect_url += "&redirect_url=" + quote(url)
+    batch_size = int(os.environ.get("export_batch_size", 500))
+
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
     else:
-        redirect_url += "&redirect_url=" + url
-    return redirect_url
+        buffer = None
+        writer = None
+        yield json.dumps(get_export_info(search_id), default=str) + "\n"
+
+    try:
+        cache = Cache()
+    except Exception as e:
+        print(e)
+        cache = None
+
+    def format_batch(results):
+        results = format_export_results(results)
+        if writer:
+            for result in results:
+                row = dict(result)
+                row["communities"] = "; ".join(result.get("communities_part_of", {}).values())
+                writer.writerow(row)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            return chunk
+        return "".join(json.dumps(result, default=str) + "\n" for result in results)
+
+    # the results of lazy searches that are not cached yet are streamed from Elastic, without caching them
+    session = cache.get_session(user_id, search_id) if cache else None
+    start = 0
+    while cache:
+        number_of_hits, results = cache.get_window(user_id, search_id, start, batch_size)
+        if number_of_hits < 0 or not results:
+            break
+        yield format_batch(results)
+        start += len(results)
+        if start >= (session["materialized"] if session else number_of_hits):
+            break
+
+    community_names = session["community_names"] if session else {}
+    while session:
+        _, hits, session = fetch_lazy_hits(session, batch_size)
+        if not hits:
+            break
+        # exports replace the descriptions with the whole text, so they are not highlighted
+        yield format_batch(create_pages_submission(hits, search_id, community_names, deferred_highlight=True))
+
 
 def validate_community_access(user_communities, requested_communities):
     """Ensures that a user has access to the communities that they are requesting.
@@ -983,7 +1447,9 @@ def find_community_names(communities):
 
 
 def search_sort_by(user_id, search_id, sort_by):
-    """Sort cached search results by relevance, popularity, or date.
+    """Switch the sort of cached search results to relevance, popularity, or date.
+    The orders are precomputed when the results are cached (see compute_sort_orders),
+    so this only changes the active sort, which is also saved to the search log.
 
     Method Parameters
     ----------
@@ -993,62 +1459,79 @@ def search_sort_by(user_id, search_id, sort_by):
         The search ID that needs to be sorted.
     sort_by : str, required
         Can be one of
-            relevant : sort by match to query
+            relevance : sort by match to query
             popularity : sort by likes, dislikes, and clicks
-            date : sort by submission time
+            date (or time) : sort by submission time
 
     Returns
     ---------
-    None
+    bool
+        True if the sort was applied.
     """
-    user_id = user_id
-    search_id = search_id
-    sort_by = sort_by
-    name = user_id + '-' + search_id
-    sorted_submissions = []
+    if sort_by == "time":
+        sort_by = "date"
     cache = Cache()
-    all_values = cache.hash_vals(name)
-    submissions = SubmissionStats()
-  
-    all_submissions = list()
-    for pages in all_values:
-        pages = json.loads(pages)
-        if isinstance(pages,int):
-            pass
-        else:
-            for submission in pages: 
-                all_submissions.append(submission)
-   
-    if sort_by == 'date':
-        sorted_submissions = sorted(all_submissions,reverse=True,key = lambda x :x['time'])
-    elif sort_by == 'popularity': 
-        # Limit to top 50 for now for efficiency
-        for x in all_submissions[:50]:
-            metrics = submissions.find_one({"submission_id":ObjectId(x["submission_id"])})
-            # because we did not backfill
-            if metrics:
-                clicks = metrics.search_clicks + metrics.recomm_clicks
-                views = metrics.views
-                upvotes = metrics.likes
-                downvotes = metrics.dislikes if metrics.dislikes > 0 else 1
-            else:
-                clicks = 0
-                views = 0
-                upvotes = 0
-                downvotes = 1
-            penalize = 0.6*downvotes if downvotes > 1 else 1 # > 1 coz if 1, then penalize = 0.6, which would increase the score
-            rewards = 0.6* upvotes + 0.1* views + 0.5* clicks
-            metrics_score = 1 + math.log10(1 + (rewards /penalize)) #always greater than score
-            x["popularity"] = x["score"] + metrics_score
+    if sort_by != "relevance":
+        # the orders cover every result, so lazy searches are fetched in full first
+        materialize_search(cache, user_id, search_id)
+    if not cache.set_sort(user_id, search_id, sort_by):
+        return False
+    SearchLogs().update_one({"_id": ObjectId(search_id)}, {"$set": {"filters.sort_by": sort_by}}, upsert=False)
+    return True
 
-        sorted_submissions = sorted(all_submissions,reverse=True,key = lambda x :float(x['popularity']))
 
-    elif sort_by == 'relevance':
-        sorted_submissions = sorted(all_submissions,reverse=True,key = lambda x :float(x['score']))
+def compute_sort_orders(results):
+    """Precomputes the date and popularity orders of formatted search results.
 
-    cache.insert(user_id,search_id,sorted_submissions,0)
+    Method Parameters
+    ----------
+    results : list of dict, required
+        The output of create_pages_submission, in relevance order.
 
-def rerank(queries, documents):
+    Returns
+    ---------
+    dict
+        {"date": <list of positions in results>, "popularity": <list of positions in results>}
+    """
+    def time_key(i):
+        try:
+            return int(results[i]["time"])
+        except (TypeError, ValueError):
+            return 0
+
+    positions = range(len(results))
+    date_order = sorted(positions, reverse=True, key=time_key)
+
+    # one query for the metrics of every result
+    submission_ids = [ObjectId(x["submission_id"]) for x in results if x.get("submission_id")]
+    all_metrics = {}
+    if submission_ids:
+        for metrics in SubmissionStats().find_db({"submission_id": {"$in": submission_ids}}):
+            all_metrics[str(metrics["submission_id"])] = metrics
+
+    popularity = []
+    for x in results:
+        # because we did not backfill
+        metrics = all_metrics.get(x.get("submission_id"))
+        if metrics:
+            clicks = metrics.get("search_clicks", 0) + metrics.get("recomm_clicks", 0)
+            views = metrics.get("views", 0)
+            upvotes = metrics.get("likes", 0)
+            downvotes = metrics.get("dislikes", 0) if metrics.get("dislikes", 0) > 0 else 1
+        else:
+            clicks = 0
+            views = 0
+            upvotes = 0
+            downvotes = 1
+        penalize = 0.6*downvotes if downvotes > 1 else 1 # > 1 coz if 1, then penalize = 0.6, which would increase the score
+        rewards = 0.6* upvotes + 0.1* views + 0.5* clicks
+        metrics_score = 1 + math.log10(1 + (rewards /penalize)) #always greater than score
+        popularity.append(float(x.get("score") or 0) + metrics_score)
+
+    popularity_order = sorted(positions, reverse=True, key=lambda i: popularity[i])
+    return {"date": date_order, "popularity": popularity_order}
+
+def rerank(queries, documents, timeout=None):
     """Calls neural rerank to rank documents given queries.
 
     Method Parameters
@@ -1057,6 +1540,8 @@ def rerank(queries, documents):
         A list of queries, each str.
     documents : list, required
         A list of documents to score against the queries, each str.
+    timeout : float, optional
+        The timeout of the request in seconds, defaults to no timeout.
 
     Returns
     ---------
@@ -1080,7 +1565,8 @@ def rerank(queries, documents):
         print("Rerank not currently supported.")
         return {}
     try:
-        resp = requests.post(neural_api + "/neural/rerank/", json={"queries": queries, "documents": chunked_docs})
+        with timed("neural"):
+            resp = requests.post(neural_api + "/neural/rerank/", json={"queries": queries, "documents": chunked_docs}, timeout=timeout)
         resp_json = resp.json()
 
         if resp.status_code == 200:
@@ -1099,7 +1585,7 @@ def rerank(queries, documents):
         traceback.print_exc()
         return {}
 
-def generate(input_text, prefix, suffix, line_type="Question: "):
+def generate(input_text, prefix, suffix, line_type="Question: ", timeout=None):
     """Call the Neural API to generate text from a language model.
 
     Input to the model is concatenated as a string:
@@ -1117,6 +1603,8 @@ def generate(input_text, prefix, suffix, line_type="Question: "):
         The suffix of the prompt.
     line_type : str, optional
         The beginning of the target line(s), defaults to "Question: "
+    timeout : float, optional
+        The timeout of the request in seconds, defaults to no timeout.
 
     Returns
     ---------
@@ -1128,7 +1616,8 @@ def generate(input_text, prefix, suffix, line_type="Question: "):
         print("Generation not currently supported.")
         return []
     try:
-        resp = requests.post(neural_api + "/neural/generate", json={"input": prefix + input_text + suffix})
+        with timed("neural"):
+            resp = requests.post(neural_api + "/neural/generate", json={"input": prefix + input_text + suffix}, timeout=timeout)
         resp_json = resp.json()
 
         if resp.status_code == 200:
@@ -1155,6 +1644,7 @@ def generate(input_text, prefix, suffix, line_type="Question: "):
 def log_search_click(search_id, clicked_url):
     """Handles the clicking of a search result.
     Also updates SubmissionStats if the URL is a TextData submission ID.
+    Both writes are queued on the event pipeline, so the redirect does not wait on them.
 
     Method Parameters
     ----------
@@ -1168,14 +1658,13 @@ def log_search_click(search_id, clicked_url):
     """
     sl_db = SearchClicks()
     search_click_log = SearchClick(search_id, clicked_url)
-    sl_db.insert(search_click_log)
+    sl_db.insert(search_click_log, deferred=True)
 
     if "/submissions/" in clicked_url:
         sub_idx = clicked_url.index("/submissions/") + len("/submissions/")
         submission_id = clicked_url[sub_idx:]
         try:
-            stats = SubmissionStats()
-            update_search = stats.update_stats(submission_id,"click_search_result")
+            get_event_pipeline().increment_stats(ObjectId(submission_id), "click_search_result")
         except Exception as e:
             traceback.print_exc()
     return
@@ -1240,9 +1729,159 @@ def log_search_request(user_id, source, scope=[], context={}, intent={}, filters
         filters=filters
     )
     search_id = sl.insert(new_search_log)
+
+    # Keep the users also ask index of the webpage up to date
+    url = context.get("url")
+    question = intent.get("generated_question")
+    if url and question:
+        try:
+            UrlQuestions().record(url, question, asked_time=new_search_log.time, communities=filters.get("communities"),
+                                  typed=intent.get("typed_query", "") != "")
+        except Exception as e:
+            traceback.print_exc()
     return search_id
 
 
+def build_search_graph(user_id, search_id, requested_communities):
+    """Builds the graph of the results of a search, and of the questions asked on their webpages, for website_visualize.
+    Graphs are cached per result set and communities, and rerank scores per question/document pair (see GraphCache).
+
+    Method Parameters
+    ----------
+    user_id : str, required
+        The ID of the user performing the search.
+    search_id : str, required
+        The ID of the search.
+    requested_communities : list of ObjectId, required
+        The communities that questions are drawn from.
+
+    Returns
+    ---------
+    dict
+        The graph, see prep_subs_viz_conns.
+    """
+    try:
+        graph_cache = GraphCache()
+        digest = Cache().get_result_digest(user_id, search_id)
+    except Exception as e:
+        print(e)
+        graph_cache = None
+        digest = None
+
+    if digest:
+        graph_data = graph_cache.get_graph(digest, requested_communities)
+        if graph_data:
+            return graph_data
+
+    submissions = export_helper(user_id, search_id, with_mentions=True)
+
+    sub_mentions = {}
+    urls_to_find = {}
+    docs = []
+    for obj in submissions['data']:
+        for par_sub_id in obj.pop("mentioned_ids"):
+            sub_mentions.setdefault(par_sub_id, []).append(obj['submission_id'])
+
+        # submission_url is the textdata url, source_url the external webpage (if any)
+        for url in [obj["submission_url"], obj["source_url"]]:
+            if url:
+                urls_to_find.setdefault(url, []).append(obj["submission_id"])
+
+        docs.append(obj["title"] + " - " + obj["description"])
+
+    questions_list = []
+    seen_questions = set()
+    if urls_to_find:
+        for url, question in UrlQuestions().find_typed_questions(list(urls_to_find.keys()), requested_communities):
+            for source_id in urls_to_find[url]:
+                if (question, source_id) not in seen_questions:
+                    seen_questions.add((question, source_id))
+                    questions_list.append({"text": question, "source_id": source_id})
+
+    complete = True
+    if docs and questions_list:
+        questions = list(dict.fromkeys(x["text"] for x in questions_list))
+        targets, complete = find_question_targets(questions, docs, graph_cache)
+        for question in questions_list:
+            if question["text"] in targets:
+                question["target_id"] = submissions["data"][targets[question["text"]]]["submission_id"]
+
+    # Using sub_mentions dict to create mentions
+    for obj in submissions['data']:
+        curr_id = obj['submission_id']
+        obj["mentions"] = sub_mentions.get(curr_id, [])
+
+    graph_data = prep_subs_viz_conns(submissions['data'], questions_list)
+    # without every rerank score, the graph is missing answers, so it is rebuilt next time
+    if digest and complete:
+        try:
+            graph_cache.set_graph(digest, requested_communities, graph_data)
+        except Exception as e:
+            traceback.print_exc()
+    return graph_data
+
+
+def find_question_targets(questions, docs, graph_cache=None):
+    """Finds the document answering each question, if any, with rerank.
+    Only question/document pairs without a cached score are sent to rerank.
+
+    Method Parameters
+    ----------
+    questions : list of str, required
+        The distinct questions.
+    docs : list of str, required
+        The documents.
+    graph_cache : GraphCache, optional
+        Where rerank scores are cached, if available.
+
+    Returns
+    ---------
+    dict, bool
+        {<question>: <index of the answering document>} for questions with a really good match (score above 40),
+        and whether every pair was scored.
+    """
+    if graph_cache:
+        try:
+            scores = graph_cache.get_scores(questions, docs)
+        except Exception as e:
+            traceback.print_exc()
+            graph_cache = None
+    if not graph_cache:
+        scores = [[None] * len(docs) for _ in questions]
+
+    missing_questions = [i for i, row in enumerate(scores) if None in row]
+    if missing_questions:
+        missing_docs = sorted({j for i in missing_questions for j, score in enumerate(scores[i]) if score is None})
+        scored_docs = rerank([questions[i] for i in missing_questions], [docs[j] for j in missing_docs])
+        new_scores = {}
+        for qidx in scored_docs:
+            i = missing_questions[int(qidx)]
+            # documents without any chunk to rerank get no score
+            row = {j: -1.0 for j in missing_docs}
+            for index, score in zip(scored_docs[qidx]["indices"], scored_docs[qidx]["scores"]):
+                row[missing_docs[index]] = max(row[missing_docs[index]], score)
+            for j, score in row.items():
+                scores[i][j] = score
+            new_scores[questions[i]] = {docs[j]: score for j, score in row.items()}
+        if graph_cache and new_scores:
+            try:
+                graph_cache.set_scores(new_scores)
+            except Exception as e:
+                traceback.print_exc()
+
+    targets = {}
+    complete = True
+    for question, row in zip(questions, scores):
+        known = [(score, j) for j, score in enumerate(row) if score is not None]
+        complete = complete and len(known) == len(row)
+        if known:
+            # Only check top question-doc pair, and only have a single target
+            score, j = max(known, key=lambda x: x[0])
+            if score > 40:
+                targets[question] = j
+    return targets, complete
+
+
 def prep_subs_viz_conns(result_list, question_list):
     """Function to convert the submissions and questions to nodes and edges for connection viz.
 
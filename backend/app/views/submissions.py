@@ -12,7 +12,7 @@ import validators
 
 from app.helpers.helpers import token_required, token_required_public, build_display_url,\
     format_time_for_display, hydrate_with_hashtags, \
-    extract_hashtags, format_url, build_display_url, get_communities_helper
+    extract_hashtags, format_url, build_display_url, get_communities_helper, build_preview, find_mentions
 from app.helpers import response
 from app.helpers.status import Status
 from app.models.communities import Communities
@@ -23,9 +23,11 @@ from app.models.user_feedback import UserFeedbacks, UserFeedback
 from elastic.manage_data import ElasticManager
 from app.models.users import Users
 from app.models.submission_stats import SubmissionStats
+from app.models.query_cache import QueryCache
 from app.models.judgment import *
 from app.models.relevance_judgements import *
 from app.views.search import get_mentions
+from app.event_pipeline import get_event_pipeline
 
 submissions = Blueprint('submissions', __name__)
 CORS(submissions)
@@ -124,6 +126,9 @@ def create_batch_submission(current_user):
     anonymous = r.get("anonymous", True)
     results = {}
     errors = []
+    # submissions are logged one at a time, then indexed together with a single _bulk request
+    index_queue = []
+    queued = {}
     for i, submission in enumerate(data):
         try:
             ip = request.remote_addr
@@ -136,7 +141,8 @@ def create_batch_submission(current_user):
                                                                       user_communities=user_communities,
                                                                       highlighted_text=highlighted_text,
                                                                       source_url=source_url, explanation=explanation,
-                                                                      community=community, anonymous=anonymous)
+                                                                      community=community, anonymous=anonymous,
+                                                                      index_queue=index_queue)
 
             if status == Status.OK:
                 results[f'Submission {i}'] = {
@@ -144,6 +150,7 @@ def create_batch_submission(current_user):
                     "submission_id": str(submission_id),
                     "status": status
                 }
+                queued[str(submission_id)] = i
             else:
                 results[f'Submission {i}'] = {'message': message, 'status': status}
                 errors.append(i)
@@ -154,6 +161,21 @@ def create_batch_submission(current_user):
             error_status = Status.INTERNAL_SERVER_ERROR
             results[f'Submission {i}'] = {'message': error_message, 'status': error_status}
             errors.append(i)
+
+    if index_queue:
+        index_status = elastic_manager.bulk_index(index_queue)
+        invalidate_community_searches(index_queue)
+        for i in queued.values():
+            results[f'Submission {i}']["message"] = "Context successfully submitted and indexed."
+        for index_error in index_status["errors"]:
+            print("Error indexing submission", index_error)
+            i = queued.get(index_error["id"])
+            if i is None:
+                continue
+            results[f'Submission {i}']["message"] = "Submission saved, but could not be indexed."
+            results[f'Submission {i}']["status"] = Status.INTERNAL_SERVER_ERROR
+            errors.append(i)
+
     if len(errors) == 0:
         return response.success(results, Status.OK)
     else:
@@ -253,6 +275,9 @@ def submission(current_user, id):
                     index_update = elastic_manager.delete_document(id)
 
                     print(index_update)
+                    deleted_submission = cdl_logs.find_one({"_id": ObjectId(id)})
+                    if deleted_submission:
+                        invalidate_community_searches([deleted_submission])
 
                     return response.success({"message": "Deletion successful."}, Status.OK)
                 else:
@@ -283,6 +308,7 @@ def submission(current_user, id):
                     current_submission.communities = submission_communities
                     deleted_index_status = elastic_manager.delete_document(id)
                     added_index_status, _ = elastic_manager.add_to_index(current_submission)
+                    invalidate_community_searches([current_submission], community_ids=[community_id])
                     log_community_action(ip, user_id, community_id, "DELETE", submission_id=current_submission.id)
 
                     return response.success({"message": "Removed from community."}, Status.OK)
@@ -353,6 +379,8 @@ def submission(current_user, id):
 
                 if highlighted_text != None:
                     insert_obj["highlighted_text"] = highlighted_text
+                    insert_obj["preview"] = build_preview(highlighted_text)
+                    insert_obj["mentions"] = find_mentions(highlighted_text)
 
                     
 
@@ -381,6 +409,8 @@ def submission(current_user, id):
                     hashtags += extract_hashtags(highlighted_text)
                     old_hashtags = extract_hashtags(submission.highlighted_text)
                     submission.highlighted_text = highlighted_text
+                    submission.preview = insert_obj["preview"]
+                    submission.mentions = insert_obj["mentions"]
                 else:
                     hashtags += extract_hashtags(submission.highlighted_text)
 
@@ -399,6 +429,7 @@ def submission(current_user, id):
 
                 deleted_index_status = elastic_manager.delete_document(id)
                 added_index_status, hashtags = elastic_manager.add_to_index(submission)
+                invalidate_community_searches([submission])
 
 
                 if "communities" in insert_obj:
@@ -700,7 +731,12 @@ def fetch_submission_judgement(current_user):
 ### Helpers ###
 
 def create_submission_helper(ip=None, user_id=None, user_communities=None, highlighted_text=None, source_url=None,
-                             explanation=None, community=None, anonymous=True):
+                             explanation=None, community=None, anonymous=True, index_queue=None):
+    """
+    Validates, logs, and indexes a new submission.
+    If index_queue (a list) is provided, the logged submission is appended to it instead of being
+    indexed right away, so that the caller can index a batch with elastic_manager.bulk_index.
+    """
     # assumed string, so check to make sure is not none
     if highlighted_text == None:
         highlighted_text = ""
@@ -733,11 +769,12 @@ def create_submission_helper(ip=None, user_id=None, user_communities=None, highl
     if status.acknowledged:
         doc.id = status.inserted_id
 
-
+        if index_queue is not None:
+            index_queue.append(doc)
+            return "Context successfully submitted and queued for indexing.", Status.OK, status.inserted_id
 
         index_status, hashtags = elastic_manager.add_to_index(doc)
-
-
+        invalidate_community_searches([doc])
         return "Context successfully submitted and indexed.", Status.OK, status.inserted_id
 
     else:
@@ -745,6 +782,21 @@ def create_submission_helper(ip=None, user_id=None, user_communities=None, highl
 
 
 
+def invalidate_community_searches(submissions, community_ids=[]):
+    """
+    Invalidates the search results shared across users (see QueryCache) of every community of the submissions,
+    and of any other communities they were removed from. Called once the submissions are (re)indexed.
+    """
+    communities = list(community_ids)
+    for submission in submissions:
+        for user_communities in submission.communities.values():
+            communities += user_communities
+    try:
+        QueryCache().bump_versions(communities)
+    except Exception as e:
+        traceback.print_exc()
+
+
 def format_submission_for_display(submission, current_user, search_id, submission_public_communities):
     """
 	Helper method to format a raw mongodb submission for frontend display.
@@ -902,7 +954,9 @@ def log_submission(ip, user_id, highlighted_text, source_url, explanation, commu
 	communities = {
 		str(user_id): [ObjectId(community)]
 	}
-	log = Log(ip, user_id, highlighted_text, source_url, explanation, communities, anonymous=anonymous)
+	# sanitized once here, instead of every time the submission is displayed in search results
+	log = Log(ip, user_id, highlighted_text, source_url, explanation, communities, anonymous=anonymous,
+			  preview=build_preview(highlighted_text), mentions=find_mentions(highlighted_text))
 	cdl_logs = Logs()
 	inserted_status = cdl_logs.insert(log)
 	return inserted_status, log
@@ -912,12 +966,13 @@ def log_submission(ip, user_id, highlighted_text, source_url, explanation, commu
 def log_submission_view(ip, user_id, submission_id):
 	"""
 	Logs when a user views the full submission.
+	The log and the view count are queued on the event pipeline and written in the background.
 	Arguments:
 		ip : (string) : the IP address of the request sent by the user.
 		user_id : (ObjectID) : the ID of the user viewing the submission.
 		submission_id : (ObjectID) : the submission ID being viewed.
 	Returns:
-		insert : Pymongo object with property .acknowledged (should be true on success).
+		insert : object with properties .acknowledged and .inserted_id (see DeferredInsertResult).
 	"""
 	log = {
 		"ip": ip,
@@ -926,10 +981,9 @@ def log_submission_view(ip, user_id, submission_id):
 		"type": "submission_view",
 		"time": time.time()
 	}
-	cdl_submit_stats = SubmissionStats()
-	update_clicks = cdl_submit_stats.update_stats(submission_id,"submission_view")
+	get_event_pipeline().increment_stats(submission_id, "submission_view")
 	cdl_searches_clicks = SearchesClicks()
-	insert = cdl_searches_clicks.insert_one_db(log)
+	insert = cdl_searches_clicks.insert_one_deferred(log)
 	return insert
 
 
@@ -947,7 +1001,7 @@ def log_community_action(ip, user_id, community_id, action, submission_id=None):
 	cdl_community_logs = CommunityLogs()
 
 	log = CommunityLog(ip, user_id, community_id, action, submission_id=submission_id)
-	insert = cdl_community_logs.insert(log)
+	insert = cdl_community_logs.insert(log, deferred=True)
 	if not insert.acknowledged:
 		print("Error logging community action!", log)
 	return insert
@@ -1009,15 +1063,15 @@ def update_relevance_stats(stats, submission_id, relevance):
 	'''
 	if relevance == 1:
 		likes_result = stats.update_stats(submission_id, "likes", 1)
-		if likes_result['nModified'] == 1:
+		if likes_result['n'] == 1:
 			dislikes_result = stats.update_stats(submission_id, "dislikes", -1)
-			return dislikes_result['nModified'] == 1
+			return dislikes_result['n'] == 1
 		
 	elif relevance == 0:
 		dislikes_result = stats.update_stats(submission_id, "dislikes", 1)
-		if dislikes_result['nModified'] == 1:
+		if dislikes_result['n'] == 1:
 			likes_result = stats.update_stats(submission_id, "likes", -1)
-			return likes_result['nModified'] == 1
+			return likes_result['n'] == 1
 		
 	return False
 
@@ -1039,7 +1093,7 @@ def update_stats_for_new_relevance(stats,submission_id, relevance):
 	elif relevance == 0:
 		result= stats.update_stats(submission_id, "dislikes", 1)
 	
-	return result['nModified'] == 1
+	return result['n'] == 1
 	
 # Judgments
 def log_rel_judgment(ip, user_id, judgments):
@@ -1073,7 +1127,7 @@ def log_rel_judgment(ip, user_id, judgments):
 
 		judgment = Judgment(ip, user_id, judgments)
 		cdl_judgments = Judgments()
-		return cdl_judgments.insert(judgment)
+		return cdl_judgments.insert(judgment, deferred=True)
 	except Exception as e:
 		print(e)
 		return response.error("Failed to log relevant judgement, please try again later.", Status.INTERNAL_SERVER_ERROR)
@@ -0,0 +1,93 @@
+"""
+Compares the cache codecs (see app/models/cache_codecs.py) against plain JSON,
+on synthetic formatted search results.
+
+python backend/benchmarks/cache_codecs.py --hits 2000
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# create_redirect_url and format_url read these, any value works here
+os.environ.setdefault("api_url", "http://localhost")
+os.environ.setdefault("api_port", "8080")
+
+from bson import ObjectId
+from app.helpers.helpers import format_url, build_display_url, create_redirect_url, URLFormatter
+from app.models.cache_codecs import CacheCodec, get_codec
+
+
+def random_words(n):
+    return " ".join("".join(random.choices(string.ascii_lowercase, k=random.randint(3, 10))) for _ in range(n))
+
+
+def build_results(hits, search_id):
+    results = []
+    for i in range(hits):
+        submission_id = str(ObjectId())
+        orig_url = f"https://www.example.com/{random_words(3).replace(' ', '/')}?page={i}"
+        results.append({
+            "redirect_url": create_redirect_url(format_url("", submission_id), search_id),
+            "display_url": build_display_url(format_url(orig_url, submission_id)),
+            "orig_url": orig_url,
+            "submission_id": submission_id,
+            "title": random_words(8),
+            "description": random_words(20) + " <mark>" + random_words(1) + "</mark> " + random_words(20),
+            "score": random.random() * 20,
+            "time": "Jan 01, 2024",
+            "type": "submission",
+            "communities_part_of": {str(ObjectId()): random_words(2)},
+            "username": random_words(1),
+            "hashtags": ["#" + random_words(1) for _ in range(3)]
+        })
+    return results
+
+
+def bench(name, encode, decode, results, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encoded = [encode(x) for x in results]
+    encode_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decoded = [decode(x) for x in encoded]
+    decode_ms = (time.perf_counter() - start) * 1000 / rounds
+
+    assert decoded == results, f"{name} does not round trip"
+    size = sum(len(x) for x in encoded)
+    return name, size, encode_ms, decode_ms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hits", type=int, default=2000, help="Number of results in the search")
+    parser.add_argument("--rounds", type=int, default=5, help="Number of timed rounds")
+    args = parser.parse_args()
+
+    search_id = str(ObjectId())
+    results = build_results(args.hits, search_id)
+
+    # the original format, one JSON string per result
+    rows = [bench("json (original)", lambda x: json.dumps(x).encode("utf8"), json.loads, results, args.rounds)]
+    # as in Cache, one URLFormatter per search
+    urls = URLFormatter(search_id)
+    for name in ["json", "compact", "msgpack", "msgpack-lz4"]:
+        codec = get_codec(name)
+        rows.append(bench(
+            f"{name} ({codec.name})",
+            lambda x: codec.encode(x, search_id, urls=urls),
+            lambda x: CacheCodec.decode(x, search_id, urls=urls),
+            results, args.rounds
+        ))
+
+    baseline = rows[0][1]
+    print(f"{args.hits} results, {args.rounds} rounds")
+    print(f"{'codec':<40}{'bytes':>12}{'ratio':>8}{'encode ms':>12}{'decode ms':>12}")
+    for name, size, encode_ms, decode_ms in rows:
+        print(f"{name:<40}{size:>12}{size / baseline:>8.2f}{encode_ms:>12.1f}{decode_ms:>12.1f}")
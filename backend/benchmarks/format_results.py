@@ -0,0 +1,110 @@
+"""
+Compares create_pages_submission against the previous per-hit implementation, on synthetic hits.
+Needs the backend environment (MongoDB for the usernames, and the settings read when importing the views).
+
+python backend/benchmarks/format_results.py --env_path backend/env_local.ini --hits 2000
+"""
+import argparse
+import os
+import random
+import re
+import string
+import sys
+import time
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(BACKEND)
+
+
+def random_words(n):
+    return " ".join("".join(random.choices(string.ascii_lowercase, k=random.randint(3, 10))) for _ in range(n))
+
+
+def build_hits(hits, community_id, creator_ids, highlighted):
+    from bson import ObjectId
+
+    results = []
+    for i in range(hits):
+        text = random_words(60) + " #" + random_words(1) + " " + random_words(60)
+        source = {
+            "explanation": random_words(8) + " #" + random_words(1),
+            "source_url": random.choice(["", f"https://www.example.com/{random_words(3).replace(' ', '/')}"]),
+            "time": int(time.time()) - random.randint(0, 10 ** 7),
+            "communities": [community_id],
+            "user_id": random.choice(creator_ids),
+            "anonymous": random.random() < 0.5,
+            "highlighted_text": text,
+            "preview": text[:500]
+        }
+        source["hashtags"] = list(set(x for x in (source["explanation"] + " " + text).split() if x.startswith("#")))
+        hit = {"_id": str(ObjectId()), "_score": random.random() * 20, "_source": source}
+        if highlighted:
+            hit["highlight"] = {"highlighted_text": [random_words(10) + " <mark>" + random_words(1) + "</mark> " + random_words(10)]}
+        results.append(hit)
+    return results
+
+
+def legacy_create_pages_submission(search_results, search_id, community_names):
+    """The per-hit implementation, before batching."""
+    from bson import ObjectId
+    from app.helpers.helpers import format_url, format_time_for_display, sanitize_input, build_display_url, hydrate_with_hashtags, create_redirect_url
+    from app.models.users import Users
+
+    return_obj = []
+    cdl_users = Users()
+    for hit in search_results:
+        result = {"score": hit.get("_score", 0) or 0, "time": "", "type": "submission", "username": ""}
+        result["title"] = hit["_source"].get("explanation", "No Title Available")
+        if not hit["_source"].get("anonymous", True):
+            creator = cdl_users.find_one({"_id": ObjectId(hit["_source"]["user_id"])})
+            if creator:
+                result["username"] = creator.username
+        description = " .... ".join(hit["highlight"].get("highlighted_text", [])) if hit.get("highlight", None) else hit["_source"].get("highlighted_text", None)
+        description = re.sub("<mark>", "@startmark@", description or "No Preview Available")
+        description = re.sub("<\\/mark>", "@endmark@", description)
+        description = sanitize_input(description)
+        description = re.sub("@startmark@", "<mark>", description)
+        result["description"] = re.sub("@endmark@", "</mark>", description)
+        result["communities_part_of"] = {x: community_names[x] for x in hit["_source"].get("communities", []) if x in community_names}
+        result["submission_id"] = str(hit["_id"])
+        if "time" in hit["_source"]:
+            result["time"] = format_time_for_display(hit["_source"]["time"])
+        url = hit["_source"].get("source_url", "")
+        result["display_url"] = build_display_url(format_url(url, result["submission_id"]))
+        result["orig_url"] = url
+        result["redirect_url"] = create_redirect_url(format_url("", result["submission_id"]), search_id)
+        result["hashtags"] = hydrate_with_hashtags(result["title"], result["description"])
+        return_obj.append(result)
+    return return_obj
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env_path", required=True, help="path to env file")
+    parser.add_argument("--hits", type=int, default=2000, help="number of hits")
+    parser.add_argument("--rounds", type=int, default=3, help="number of timed rounds")
+    parser.add_argument("--highlighted", action="store_true", help="hits have highlight fragments (query searches)")
+    args = parser.parse_args()
+
+    with open(args.env_path, "r") as f:
+        for line in f:
+            split_line = line.split("=")
+            os.environ[split_line[0]] = "=".join(split_line[1:]).strip("\n")
+    # ElasticManager reads stopwords.txt relative to the backend
+    os.chdir(BACKEND)
+
+    from bson import ObjectId
+    from app.models.users import Users
+    from app.views.search import create_pages_submission
+
+    creator_ids = [str(x["_id"]) for x in Users().find_db({}, {"_id": 1}).limit(50)] or [str(ObjectId())]
+    community_id = str(ObjectId())
+    hits = build_hits(args.hits, community_id, creator_ids, args.highlighted)
+    search_id = str(ObjectId())
+
+    for name, function in [("per hit (before)", legacy_create_pages_submission), ("batched", create_pages_submission)]:
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            function(hits, search_id, {community_id: "benchmark"})
+        elapsed = (time.perf_counter() - start) * 1000 / args.rounds
+        print(f"{name:<20}{elapsed:>10.1f} ms for {args.hits} hits")
@@ -0,0 +1,62 @@
+"""
+Measures the bytes returned per search query, with and without the _source filtering and filter_path
+of ElasticManager, against a running cluster.
+
+python backend/benchmarks/search_payload.py --env_path backend/env_local.ini --query "machine learning" --community <community id>
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "elastic"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from manage_data import ElasticManager, SEARCH_FILTER_PATH
+
+
+def measure(elastic_manager, body, filtered, size):
+    body = dict(body)
+    body["size"] = size
+    params = None
+    if filtered:
+        params = {"filter_path": SEARCH_FILTER_PATH}
+    else:
+        # as before, the full _source of every hit
+        body.pop("_source", None)
+    r = elastic_manager.request("post", elastic_manager.index_name + "/_search", "search", json_body=body, params=params)
+    return len(r.content)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env_path", required=True, help="path to env file")
+    parser.add_argument("--query", default="", help="the query to search, or none for the community listing")
+    parser.add_argument("--community", required=True, help="the community to search")
+    parser.add_argument("--size", type=int, default=2000, help="number of hits per query")
+    args = parser.parse_args()
+
+    with open(args.env_path, "r") as f:
+        for line in f:
+            split_line = line.split("=")
+            os.environ[split_line[0]] = "=".join(split_line[1:]).strip("\n")
+
+    elastic_manager = ElasticManager(os.environ["elastic_username"],
+                                     os.environ["elastic_password"],
+                                     os.environ["elastic_domain"],
+                                     os.environ["elastic_index_name"],
+                                     None,
+                                     "submissions")
+
+    if args.query:
+        bodies = {
+            "search": elastic_manager.build_search_query(args.query, [args.community]),
+            "search (deferred highlighting)": elastic_manager.build_search_query(args.query, [args.community], highlight=False)
+        }
+    else:
+        bodies = {"community": elastic_manager.build_community_query(args.community)}
+
+    print(f"{'query':<35}{'before (bytes)':>16}{'after (bytes)':>16}{'ratio':>8}")
+    for name, body in bodies.items():
+        before = measure(elastic_manager, body, False, args.size)
+        after = measure(elastic_manager, body, True, args.size)
+        print(f"{name:<35}{before:>16}{after:>16}{after / max(before, 1):>8.2f}")
@@ -13,10 +13,10 @@ community permissions?
 """
 
 
-from pymongo import MongoClient
 import argparse
 import os
 from manage_data import ElasticManager
+from app.models.logs import Logs
 
 
 if __name__ == "__main__":
@@ -35,16 +35,14 @@ if __name__ == "__main__":
                 os.environ[name] = value
     
     # Mongodb conn information 
-    client = MongoClient(os.environ["cdl_uri"])
-    cdl_db = client[os.environ["db_name"]]
-
-    cdl_submissions = cdl_db.logs
+    cdl_submissions = Logs()
 
     elastic_manager = ElasticManager(os.environ["elastic_username"], 
                                      os.environ["elastic_password"],
                                      os.environ["elastic_domain"],
                                      os.environ["elastic_index_name"],
-                                     None)
+                                     None,
+                                     "submissions")
 
 
     date_update = {
@@ -67,13 +65,10 @@ if __name__ == "__main__":
     #print(elastic_manager.add_to_mapping(user_id_update))
     print(elastic_manager.list_indices())
 
-    all_submissions = cdl_submissions.find()
-    for submission in all_submissions:
-        if "deleted" not in submission:
-            id = str(submission["_id"])
-            print(id)
-            deleted_index_status = elastic_manager.delete_document(id)
-            print("\t", deleted_index_status)
-            added_index_status = elastic_manager.add_to_index(submission)
-            print("\t", added_index_status)
+    # indexing with _bulk overwrites existing documents, so no need to delete first
+    all_submissions = cdl_submissions.find_db({"deleted": {"$exists": False}})
+    index_status = elastic_manager.bulk_index(cdl_submissions.convert(x) for x in all_submissions)
+    print("Indexed: ", index_status["indexed"])
+    for error in index_status["errors"]:
+        print("\t", error)
 
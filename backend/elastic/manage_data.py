@@ -1,23 +1,71 @@
 import os
+import gzip
+import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 import json
 import traceback
 import validators
 
+# Faster JSON parser for search responses, in requirements.txt. Without it, the json module is used.
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    orjson = None
+    json_loads = json.loads
+
 import sys
 sys.path.append("..")
-from app.helpers.helpers import extract_hashtags
+from app.helpers.helpers import extract_hashtags, build_preview
+from app.helpers.helper_constants import HIGHLIGHT_PRE_TAG, HIGHLIGHT_POST_TAG
+from app.metrics import record
+
+
+# Default (connect, read) timeouts in seconds for each kind of operation.
+# Can be overridden with the elastic_timeout_<operation> environment variable (read timeout only).
+DEFAULT_TIMEOUTS = {
+    "search": (3.05, 10),
+    "suggest": (1, 2),
+    "index": (3.05, 30),
+    "bulk": (3.05, 120),
+    "admin": (3.05, 60),
+}
+
+# Only requests larger than this are gzip compressed, small bodies are not worth the CPU.
+COMPRESSION_MIN_BYTES = 1024
+
+# The _source fields needed to display a submission hit (see create_pages_submission in views/search.py).
+# highlighted_text is not returned, hits are displayed from their preview, so existing documents must be
+# backfilled with elastic/oct2026_sanitize_previews.py before this is deployed.
+SUBMISSION_RESULT_FIELDS = ["explanation", "preview", "source_url", "time", "communities", "user_id", "anonymous", "hashtags"]
+
+# The parts of search responses that are read (see postprocess and search_page), everything else is dropped by the cluster.
+SEARCH_FILTER_PATH = "took,error,hits.total.value,hits.hits._id,hits.hits._score,hits.hits._source,hits.hits.highlight,hits.hits.sort"
+
+# The title completion subfield used for autocomplete (see suggest_titles), with the communities of each submission as context.
+TITLE_SUGGEST_FIELD = "explanation.suggest"
+TITLE_SUGGEST_MAPPING = {
+    "type": "completion",
+    "contexts": [{"name": "communities", "type": "category", "path": "communities"}]
+}
 
 
 class ElasticManager:
-    def __init__(self, elastic_username, elastic_password, elastic_domain, elastic_index_name, cdl_logs, index_mapping):
+    def __init__(self, elastic_username, elastic_password, elastic_domain, elastic_index_name, cdl_logs, index_mapping,
+                 pool_size=None, max_retries=None, compression=None):
         """
     Initializes the ElasticManager.
 
     Arguments:
         elastic_config : (dict) : connection information for Elastic index
         cdl_logs : (MongoDB connection) : the logs for MongoDB. Only needed for backfilling.
+        pool_size : (int) : the number of keep-alive connections to keep open (default elastic_pool_size or 10).
+        max_retries : (int) : the number of retries for idempotent reads (default elastic_max_retries or 2).
+        compression : (bool) : gzip request bodies (default elastic_http_compression or True).
     
     """
         self.auth = HTTPBasicAuth(elastic_username, elastic_password)
@@ -26,6 +74,24 @@ class ElasticManager:
         self.cdl_logs = cdl_logs
         self.stopwords = {}
 
+        if pool_size is None:
+            pool_size = int(os.environ.get("elastic_pool_size", 10))
+        if max_retries is None:
+            max_retries = int(os.environ.get("elastic_max_retries", 2))
+        if compression is None:
+            compression = os.environ.get("elastic_http_compression", "true").lower() == "true"
+        self.compression = compression
+        self.session = self.create_session(pool_size, max_retries)
+
+        self.timeouts = {}
+        for operation, (connect_timeout, read_timeout) in DEFAULT_TIMEOUTS.items():
+            read_timeout = float(os.environ.get("elastic_timeout_" + operation, read_timeout))
+            self.timeouts[operation] = (connect_timeout, read_timeout)
+
+        # per-operation latency counters, see get_latency_stats
+        self.latency_stats = {}
+        self.latency_lock = threading.Lock()
+
         # comment this out for updating elastic mapping
         with open("stopwords.txt", "r", encoding="utf8") as f:
             for line in f:
@@ -33,13 +99,121 @@ class ElasticManager:
 
         # check if index exists, if not make it (primarily for local)
 
-        resp = requests.head(self.domain + self.index_name, auth=self.auth)
+        resp = self.request("head", self.index_name, "admin")
         if resp.status_code != 200:
             self.create_index_with_mapping(index_mapping)
             print(f"Index not found, created with {index_mapping} mapping.")
         else:
             print("Index already exists!")
 
+    def create_session(self, pool_size, max_retries):
+        """
+        Creates the keep-alive HTTP session shared by all calls of this manager.
+        Retries with exponential backoff only apply to idempotent reads (GET/HEAD);
+        writes are never retried once sent.
+        """
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=0.2,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry, pool_block=False)
+        session = requests.Session()
+        session.auth = self.auth
+        session.headers.update({"Accept-Encoding": "gzip"})
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def request(self, method, path, operation, json_body=None, data=None, headers=None, params=None):
+        """
+        Sends a request to the cluster over the pooled session.
+
+        Arguments:
+            method : (string) : the HTTP method (get, put, post, delete, head).
+            path : (string) : the path after the domain, e.g. index_name + "/_search".
+            operation : (string) : the kind of operation, one of DEFAULT_TIMEOUTS, used for the timeout.
+            json_body : (dict) : the body to send as JSON.
+            data : (bytes or string) : a raw body, for when the body is not a single JSON document.
+            headers : (dict) : any additional headers.
+            params : (dict) : URL parameters.
+
+        Returns:
+            The requests response.
+        """
+        headers = dict(headers) if headers else {}
+        if json_body is not None:
+            data = json.dumps(json_body)
+            headers.setdefault("Content-Type", "application/json")
+        if isinstance(data, str):
+            data = data.encode("utf8")
+        if data is not None and self.compression and len(data) >= COMPRESSION_MIN_BYTES:
+            data = gzip.compress(data, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+
+        start = time.time()
+        error = False
+        response_bytes = 0
+        try:
+            r = self.session.request(method.upper(), self.domain + path, data=data, headers=headers,
+                                     params=params, timeout=self.timeouts[operation])
+            response_bytes = len(r.content)
+            return r
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record_latency(operation, time.time() - start, error, response_bytes)
+
+    def record_latency(self, operation, elapsed, error=False, response_bytes=0):
+        # also attributed to the current request, see app.metrics
+        record("elastic", elapsed)
+        with self.latency_lock:
+            stats = self.latency_stats.setdefault(operation, self.new_latency_stats())
+            stats["count"] += 1
+            if error:
+                stats["errors"] += 1
+            stats["total_ms"] += elapsed * 1000
+            stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+            stats["bytes"] += response_bytes
+
+    def record_decode(self, operation, took_ms, elapsed):
+        with self.latency_lock:
+            stats = self.latency_stats.setdefault(operation, self.new_latency_stats())
+            stats["decoded"] += 1
+            stats["took_ms"] += took_ms
+            stats["decode_ms"] += elapsed * 1000
+            stats["max_decode_ms"] = max(stats["max_decode_ms"], elapsed * 1000)
+
+    @staticmethod
+    def new_latency_stats():
+        return {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "bytes": 0,
+                "decoded": 0, "took_ms": 0.0, "decode_ms": 0.0, "max_decode_ms": 0.0}
+
+    def get_latency_stats(self):
+        """
+        Returns the per-operation latency counters (count, errors, avg_ms, max_ms),
+        the average size of the (decompressed) responses in bytes (avg_bytes),
+        and for parsed search responses, the average time Elastic took (avg_took_ms)
+        and the average and max time to decode them (avg_decode_ms, max_decode_ms).
+        """
+        with self.latency_lock:
+            return {operation: {
+                        "count": stats["count"],
+                        "errors": stats["errors"],
+                        "avg_ms": stats["total_ms"] / stats["count"] if stats["count"] else 0.0,
+                        "max_ms": stats["max_ms"],
+                        "avg_bytes": stats["bytes"] / stats["count"] if stats["count"] else 0.0,
+                        "avg_took_ms": stats["took_ms"] / stats["decoded"] if stats["decoded"] else 0.0,
+                        "avg_decode_ms": stats["decode_ms"] / stats["decoded"] if stats["decoded"] else 0.0,
+                        "max_decode_ms": stats["max_decode_ms"]
+                    } for operation, stats in self.latency_stats.items()}
+
     def process_query(self, query):
         """
         Cleans up query for stopwords.
@@ -82,21 +256,28 @@ class ElasticManager:
         Returns:
             The JSON hits for the community.
         """
-        query = {
-            "from": page * page_size,
-            "size": page_size,
+        query = self.build_community_query(community)
+        query["from"] = page * page_size
+        query["size"] = page_size
+
+        r = self.request("get", self.index_name + "/_search", "search", json_body=query, params={"filter_path": SEARCH_FILTER_PATH})
+        hits_total_value, hits = self.postprocess(r)
+        return hits_total_value, hits
+
+    def build_community_query(self, community):
+        """
+        Builds the query body for the submissions to a community, newest first (see get_community).
+        """
+        return {
             "sort": [{"time": "desc"}],
             "query": {
                 "match": {
                     "communities": community
                 }
-            }
+            },
+            "_source": {"includes": SUBMISSION_RESULT_FIELDS}
         }
 
-        r = requests.get(self.domain + self.index_name + "/_search", json=query, auth=self.auth)
-        hits_total_value, hits = self.postprocess(r.text)
-        return hits_total_value, hits
-
     def get_submissions(self, user_id, community_id=None, page=0, page_size=10):
         """
         Get the community submissions.
@@ -110,11 +291,22 @@ class ElasticManager:
         Returns:
             The JSON hits for the community.
         """
-        
+        query = self.build_submissions_query(user_id, community_id=community_id)
+        query["from"] = page * page_size
+        query["size"] = page_size
+
+        r = self.request("get", self.index_name + "/_search", "search", json_body=query, params={"filter_path": SEARCH_FILTER_PATH})
+
+        hits_total_value, hits = self.postprocess(r)
+        return hits_total_value, hits
+
+    def build_submissions_query(self, user_id, community_id=None):
+        """
+        Builds the query body for a user's submissions, newest first (see get_submissions).
+        """
         query = {
-            "from": page * page_size,
-            "size": page_size,
             "sort": [{"time": "desc"}],
+            "_source": {"includes": SUBMISSION_RESULT_FIELDS},
             "query": {
                 "bool": {
                     "must": [
@@ -130,11 +322,7 @@ class ElasticManager:
 
         if community_id:
             query["query"]["bool"]["must"].append({"match": {"communities": community_id}})
-
-        r = requests.get(self.domain + self.index_name + "/_search", json=query, auth=self.auth)
-
-        hits_total_value, hits = self.postprocess(r.text)
-        return hits_total_value, hits
+        return query
 
     
     def auto_complete(self, query, communities, page=0, page_size=10):
@@ -165,7 +353,7 @@ class ElasticManager:
                     ]
                 }
             },
-            "_source": {"exclude": ["highlighted_text"]},
+            "_source": {"includes": ["explanation"]},
             "from": page * page_size,
             "size": page_size,
             "min_score": 0.1
@@ -178,11 +366,48 @@ class ElasticManager:
                 }
             }
         query_comm["query"]["bool"]["filter"] = filter
-        r = requests.get(self.domain + self.index_name + "/_search", json=query_comm, auth=self.auth)
-        hits_total_value, hits = self.postprocess(r.text)
+        r = self.request("get", self.index_name + "/_search", "search", json_body=query_comm, params={"filter_path": SEARCH_FILTER_PATH})
+        hits_total_value, hits = self.postprocess(r)
         return hits_total_value, hits
 
-    def search(self, query, communities, user_id=None, page=0, page_size=10):
+    def suggest_titles(self, prefix, communities, size=10):
+        """
+        Suggests submission titles starting with a prefix, from the in-memory completion subfield of explanation.
+        Suggestions are deduplicated by title by the cluster, so one small request returns the final list.
+
+        Arguments:
+            prefix : (string) : what was typed so far.
+            communities : list : the communities to suggest from.
+            size : (int) : the number of suggestions (default 10).
+
+        Returns:
+            The suggestions as hits, with _id and _source.explanation.
+            Raises an exception if the suggestion fails, e.g. when the index does not have the subfield yet.
+        """
+        # without any context, a completion suggester would suggest from every community
+        if not communities or not prefix:
+            return []
+        query_suggest = {
+            "_source": {"includes": ["explanation"]},
+            "suggest": {
+                "titles": {
+                    "prefix": prefix,
+                    "completion": {
+                        "field": TITLE_SUGGEST_FIELD,
+                        "size": size,
+                        "skip_duplicates": True,
+                        "contexts": {"communities": communities}
+                    }
+                }
+            }
+        }
+        r = self.request("post", self.index_name + "/_search", "suggest", json_body=query_suggest,
+                         params={"filter_path": "suggest.titles.options._id,suggest.titles.options._source"})
+        r.raise_for_status()
+        suggestions = r.json().get("suggest", {}).get("titles", [])
+        return suggestions[0].get("options", []) if suggestions else []
+
+    def search(self, query, communities, user_id=None, page=0, page_size=10, highlight=True):
 
         """
         The method for searching a query over all of the saved webpage submissions.
@@ -192,10 +417,24 @@ class ElasticManager:
             communities : (list) : the communities to condition the search.
             page : (int) : the page number to return (default 0).
             page_size : (int) : the number of results per page (default 10).
+            highlight : (bool) : highlight the hits (default True), see build_search_query.
         Returns:
             The JSON hits for the query.
         """
+        query_comm = self.build_search_query(query, communities, user_id=user_id, highlight=highlight)
+        query_comm["from"] = page * page_size
+        query_comm["size"] = page_size
+
+        r = self.request("get", self.index_name + "/_search", "search", json_body=query_comm, params={"filter_path": SEARCH_FILTER_PATH})
+        hits_total_value, hits = self.postprocess(r)
+        return hits_total_value, hits
 
+    def build_search_query(self, query, communities, user_id=None, highlight=True):
+        """
+        Builds the query body for searching a query, by relevance with highlighting (see search).
+        With highlight=False, the submission text is neither highlighted nor returned, for ranking only
+        (see get_highlights to highlight the hits afterwards).
+        """
         query_obj = self.process_query(query)
         print("new query: ", query_obj["query"])
         print("hashtags", query_obj["hashtags"])
@@ -229,8 +468,6 @@ class ElasticManager:
                 "tags_schema": "styled",
                 "fields": {}
             },
-            "from": page * page_size,
-            "size": page_size,
             "min_score": 0.1
         }
 
@@ -254,10 +491,14 @@ class ElasticManager:
             query_comm["query"]["bool"]["filter"] = filter
             query_comm["highlight"]["fields"] = {
                 "highlighted_text": {
-                    "pre_tags": ['<mark>'],
-                    "post_tags": ['</mark>']
+                    "pre_tags": [HIGHLIGHT_PRE_TAG],
+                    "post_tags": [HIGHLIGHT_POST_TAG]
                 }
             }
+            # the text is highlighted from the index, only the preview is returned
+            query_comm["_source"] = {"includes": SUBMISSION_RESULT_FIELDS}
+            if not highlight:
+                del query_comm["highlight"]
         else:
             # Exclude paragraphs to test latency
             query_comm["_source"] = {"exclude": ["webpage.all_paragraphs"]}
@@ -275,10 +516,127 @@ class ElasticManager:
                     "post_tags": ['</mark>']
                 },
             }
+        return query_comm
 
-        r = requests.get(self.domain + self.index_name + "/_search", json=query_comm, auth=self.auth)
-        hits_total_value, hits = self.postprocess(r.text)
-        return hits_total_value, hits
+    def get_highlights(self, query, ids):
+        """
+        Highlights a few hits of a query built with build_search_query(highlight=False), e.g. a page of results.
+
+        Arguments:
+            query : (dict) : the ranking query.
+            ids : (list) : the IDs of the hits to highlight.
+
+        Returns:
+            A dict {id : hit}, where each hit has the preview in _source and any highlight fragments.
+        """
+        if not ids:
+            return {}
+        highlight_comm = {
+            "query": {
+                "bool": {
+                    "should": query["query"]["bool"]["should"],
+                    "filter": {"ids": {"values": ids}}
+                }
+            },
+            "highlight": {
+                "tags_schema": "styled",
+                "fields": {
+                    "highlighted_text": {
+                        "pre_tags": [HIGHLIGHT_PRE_TAG],
+                        "post_tags": [HIGHLIGHT_POST_TAG]
+                    }
+                }
+            },
+            "_source": {"includes": ["preview"]},
+            "size": len(ids)
+        }
+        r = self.request("post", self.index_name + "/_search", "search", json_body=highlight_comm, params={"filter_path": SEARCH_FILTER_PATH})
+        _, hits = self.postprocess(r)
+        return {hit["_id"]: hit for hit in hits}
+
+    def open_point_in_time(self, keep_alive=None):
+        """
+        Opens a point in time over the index, so that pages fetched later see the same snapshot.
+
+        Arguments:
+            keep_alive : (string) : how long the point in time is kept between requests (default elastic_pit_keep_alive or 10m).
+
+        Returns:
+            The point in time ID, or None if it could not be opened.
+        """
+        keep_alive = keep_alive or os.environ.get("elastic_pit_keep_alive", "10m")
+        try:
+            r = self.request("post", self.index_name + "/_search/point_in_time", "search", params={"keep_alive": keep_alive})
+            if r.status_code == 200:
+                return r.json()["pit_id"]
+            print("Could not open point in time: ", r.text)
+        except Exception as e:
+            traceback.print_exc()
+        return None
+
+    def close_point_in_time(self, pit_id):
+        try:
+            self.request("delete", "_search/point_in_time", "search", json_body={"pit_id": [pit_id]})
+        except Exception as e:
+            traceback.print_exc()
+
+    def open_cursor(self, keep_alive=None):
+        """
+        Returns a cursor for search_page, over a new point in time if one can be opened.
+
+        Arguments:
+            keep_alive : (string) : how long the point in time is kept between pages (see open_point_in_time).
+                Pages fetched after it expired continue with from/size.
+        """
+        keep_alive = keep_alive or os.environ.get("elastic_pit_keep_alive", "10m")
+        return {"pit_id": self.open_point_in_time(keep_alive), "search_after": None, "offset": 0, "keep_alive": keep_alive}
+
+    def search_page(self, query, size, cursor=None):
+        """
+        Fetches the next page of hits of a query, from a cursor. Pages are fetched with the point in time
+        and search_after when the cursor has them, otherwise with from/size.
+
+        Arguments:
+            query : (dict) : the query body, from one of the build_*_query methods.
+            size : (int) : the number of hits to fetch.
+            cursor : (dict) : {"pit_id", "search_after", "offset", "keep_alive"}, from open_cursor or the previous page.
+
+        Returns:
+            The total number of hits, the hits, and the cursor for the next page.
+        """
+        cursor = cursor or {"pit_id": None, "search_after": None, "offset": 0}
+        body = dict(query)
+        body["size"] = size
+        # search_after needs an explicit sort; with a point in time, ties are broken by the implicit shard/doc order
+        body.setdefault("sort", [{"_score": "desc"}])
+        body["track_total_hits"] = True
+
+        r = None
+        if cursor["pit_id"]:
+            body["pit"] = {"id": cursor["pit_id"], "keep_alive": cursor.get("keep_alive") or os.environ.get("elastic_pit_keep_alive", "10m")}
+            if cursor["search_after"]:
+                body["search_after"] = cursor["search_after"]
+            r = self.request("post", "_search", "search", json_body=body, params={"filter_path": SEARCH_FILTER_PATH})
+            if r.status_code != 200:
+                # e.g. the point in time expired, continue from the offset without it
+                print("Point in time search failed, falling back to from/size: ", r.status_code)
+                r = None
+                body.pop("pit")
+                body.pop("search_after", None)
+                cursor = {"pit_id": None, "search_after": None, "offset": cursor["offset"], "keep_alive": cursor.get("keep_alive")}
+
+        if r is None:
+            body["from"] = cursor["offset"]
+            r = self.request("post", self.index_name + "/_search", "search", json_body=body, params={"filter_path": SEARCH_FILTER_PATH})
+
+        hits_total_value, hits = self.postprocess(r)
+        next_cursor = {
+            "pit_id": cursor["pit_id"],
+            "search_after": hits[-1].get("sort") if hits else cursor["search_after"],
+            "offset": cursor["offset"] + len(hits),
+            "keep_alive": cursor.get("keep_alive")
+        }
+        return hits_total_value, hits, next_cursor
 
 
     def add_to_index(self, doc):
@@ -292,7 +650,20 @@ class ElasticManager:
         Returns:
             The response string from elastic, and the hashtags, if any
         """
+        doc_id, inserted_doc, hashtags = self.build_index_doc(doc)
+        r = self.request("put", self.index_name + "/_doc/" + doc_id, "index", json_body=inserted_doc)
+        return r.text, hashtags
+
+    def build_index_doc(self, doc):
+        """
+        Converts a Log (submissions index) or Webpage (webpages index) into the document stored in Elastic.
 
+        Arguments:
+            doc : (Log or Webpage) : the object to index.
+
+        Returns:
+            The document ID, the document to index, and the hashtags, if any
+        """
         if self.index_name == os.environ["elastic_index_name"]:
             highlighted_text = doc.highlighted_text
             doc_id = str(doc.id)
@@ -323,6 +694,8 @@ class ElasticManager:
             inserted_doc = {
                 "source_url": source_url,
                 "highlighted_text": highlighted_text,
+                # sanitized when the submission was written, older submissions are sanitized here
+                "preview": getattr(doc, "preview", None) or build_preview(highlighted_text),
                 "explanation": explanation,
                 "communities": flat_communities,
                 "user_id": user_id,
@@ -345,8 +718,118 @@ class ElasticManager:
             }
             hashtags = []
 
-        r = requests.put(self.domain + self.index_name + "/_doc/" + doc_id, json=inserted_doc, auth=self.auth)
-        return r.text, hashtags
+        return doc_id, inserted_doc, hashtags
+
+    def bulk_index(self, docs, chunk_size=500, max_chunk_bytes=5 * 1024 * 1024, refresh=None):
+        """
+        Indexes many documents with the _bulk API. The documents are streamed as NDJSON in chunks
+        bounded by both the number of documents and the size of the request body, so any
+        iterable (e.g. a MongoDB cursor) can be passed without loading it into memory.
+
+        Arguments:
+            docs : (iterable) : Log (submissions index) or Webpage (webpages index) objects.
+            chunk_size : (int) : the max number of documents per _bulk request (default 500).
+            max_chunk_bytes : (int) : the max size in bytes of a _bulk request body (default 5MB).
+            refresh : (string) : the refresh setting for the requests, one of "true", "false", "wait_for" (default None, index setting).
+
+        Returns:
+            A dict with
+                indexed : the number of documents indexed.
+                errors : a list of {"id", "status", "error"} for each document that failed.
+                hashtags : a dict {document ID : hashtags} for the indexed documents.
+        """
+        result = {"indexed": 0, "errors": [], "hashtags": {}}
+
+        lines = []
+        chunk_ids = []
+        chunk_hashtags = {}
+        chunk_bytes = 0
+
+        for doc in docs:
+            try:
+                doc_id, inserted_doc, hashtags = self.build_index_doc(doc)
+            except Exception as e:
+                result["errors"].append({"id": str(getattr(doc, "id", None)), "status": None, "error": str(e)})
+                continue
+
+            action = json.dumps({"index": {"_index": self.index_name, "_id": doc_id}})
+            source = json.dumps(inserted_doc)
+            lines.append(action)
+            lines.append(source)
+            chunk_ids.append(doc_id)
+            chunk_hashtags[doc_id] = hashtags
+            chunk_bytes += len(action) + len(source) + 2
+
+            if len(chunk_ids) >= chunk_size or chunk_bytes >= max_chunk_bytes:
+                self.send_bulk_chunk(lines, chunk_ids, chunk_hashtags, refresh, result)
+                lines, chunk_ids, chunk_hashtags, chunk_bytes = [], [], {}, 0
+
+        if chunk_ids:
+            self.send_bulk_chunk(lines, chunk_ids, chunk_hashtags, refresh, result)
+
+        return result
+
+    def bulk_update(self, updates, chunk_size=500, refresh=None):
+        """
+        Partially updates many documents with the _bulk API, e.g. to backfill a field.
+
+        Arguments:
+            updates : (iterable) : (document ID, dict of the fields to set) tuples.
+            chunk_size : (int) : the max number of documents per _bulk request (default 500).
+            refresh : (string) : see bulk_index.
+
+        Returns:
+            A dict with
+                indexed : the number of documents updated.
+                errors : a list of {"id", "status", "error"} for each document that failed.
+        """
+        result = {"indexed": 0, "errors": [], "hashtags": {}}
+        lines = []
+        chunk_ids = []
+        for doc_id, fields in updates:
+            lines.append(json.dumps({"update": {"_index": self.index_name, "_id": str(doc_id)}}))
+            lines.append(json.dumps({"doc": fields}))
+            chunk_ids.append(str(doc_id))
+            if len(chunk_ids) >= chunk_size:
+                self.send_bulk_chunk(lines, chunk_ids, {}, refresh, result)
+                lines, chunk_ids = [], []
+        if chunk_ids:
+            self.send_bulk_chunk(lines, chunk_ids, {}, refresh, result)
+        del result["hashtags"]
+        return result
+
+    def send_bulk_chunk(self, lines, chunk_ids, chunk_hashtags, refresh, result):
+        """
+        Sends one NDJSON chunk to _bulk and records per-document successes and failures in result.
+        If the request itself fails, every document in the chunk is reported as failed.
+        """
+        params = {"refresh": refresh} if refresh else None
+        body = "\n".join(lines) + "\n"
+        try:
+            r = self.request("post", self.index_name + "/_bulk", "bulk", data=body,
+                             headers={"Content-Type": "application/x-ndjson"}, params=params)
+            resp = r.json()
+        except Exception as e:
+            traceback.print_exc()
+            for doc_id in chunk_ids:
+                result["errors"].append({"id": doc_id, "status": None, "error": str(e)})
+            return
+
+        if "items" not in resp:
+            for doc_id in chunk_ids:
+                result["errors"].append({"id": doc_id, "status": r.status_code, "error": resp.get("error")})
+            return
+
+        for item in resp["items"]:
+            # {"index": {...}} or {"update": {...}}
+            item = next(iter(item.values()), {})
+            doc_id = item.get("_id")
+            status = item.get("status", 500)
+            if status in (200, 201):
+                result["indexed"] += 1
+                result["hashtags"][doc_id] = chunk_hashtags.get(doc_id, [])
+            else:
+                result["errors"].append({"id": doc_id, "status": status, "error": item.get("error")})
 
     def create_index_with_mapping(self, index_mapping):
         """
@@ -356,32 +839,32 @@ class ElasticManager:
         with open(mapping_file) as f:
             mapping = json.load(f)
 
-        r = requests.put(self.domain + self.index_name, json=mapping, auth=self.auth)
+        r = self.request("put", self.index_name, "admin", json_body=mapping)
         return r.text
 
     def delete_index(self):
-        r = requests.delete(self.domain + self.index_name, auth=self.auth)
+        r = self.request("delete", self.index_name, "admin")
         return r.text
 
     def delete_document(self, id):
-        r = requests.delete(self.domain + self.index_name + "/_doc/" + id, auth=self.auth)
+        r = self.request("delete", self.index_name + "/_doc/" + id, "index")
         return r.text
 
     def get_document(self, id):
-        r = requests.get(self.domain + self.index_name + "/_doc/" + id, auth=self.auth)
+        r = self.request("get", self.index_name + "/_doc/" + id, "search")
         return r.text
 
     def update_document(self, id, body):
-        r = requests.post(self.domain + self.index_name + "/_doc/" + id, auth=self.auth, json=body)
+        r = self.request("post", self.index_name + "/_doc/" + id, "index", json_body=body)
         return r.text
 
     def list_indices(self):
-        r = requests.get(self.domain + "_cat/indices", auth=self.auth)
-        r2 = requests.get(self.domain + self.index_name + "/_mapping", auth=self.auth)
+        r = self.request("get", "_cat/indices", "admin")
+        r2 = self.request("get", self.index_name + "/_mapping", "admin")
         return r2.text
 
     def add_to_mapping(self, map_update):
-        r = requests.put(self.domain + self.index_name + "/_mapping", json=map_update, auth=self.auth)
+        r = self.request("put", self.index_name + "/_mapping", "admin", json_body=map_update)
         return r.text
 
     # recs
@@ -395,8 +878,19 @@ class ElasticManager:
     Returns:
         The JSON hits for the query.
     """
+        query_comm = self.build_most_recent_query(user_id, communities)
+        query_comm["from"] = 0
+        query_comm["size"] = topn
 
-        query_comm = {
+        r = self.request("get", self.index_name + "/_search", "search", json_body=query_comm, params={"filter_path": SEARCH_FILTER_PATH})
+        hits_total_value, hits = self.postprocess(r)
+        return hits_total_value, hits
+
+    def build_most_recent_query(self, user_id, communities):
+        """
+        Builds the query body for the most recent submissions to communities, excluding the user's own.
+        """
+        return {
             "query": {
                 "bool": {
                     "filter": {
@@ -418,15 +912,10 @@ class ElasticManager:
                     }
                 }
             },
-            "from": 0,
-            "size": topn,
             "sort": [{"time": "desc"}],
+            "_source": {"includes": SUBMISSION_RESULT_FIELDS}
         }
 
-        r = requests.get(self.domain + self.index_name + "/_search", json=query_comm, auth=self.auth)
-        hits_total_value, hits = self.postprocess(r.text)
-        return hits_total_value, hits
-
     def flatten_communities(self, communities) -> list:
         flat_communities = []
         for user_id in communities:
@@ -436,22 +925,33 @@ class ElasticManager:
         return flat_communities
 
 
-    def postprocess(self, text):
+    def postprocess(self, r, operation="search"):
+        """
+        Parses a search response, decoding its (UTF-8) body once, with orjson if installed.
+        The time Elastic took and the decode time are recorded with the operation's latency (see get_latency_stats).
 
+        Arguments:
+            r : the requests response.
+            operation : (string) : the kind of operation, see DEFAULT_TIMEOUTS.
+
+        Returns:
+            The total number of hits, and the hits.
+        """
+        start = time.time()
         try:
-            text = text.encode("latin1", errors="strict").decode("utf8", errors="strict")
-        except Exception as e:
-            text = text.encode("utf8", errors="ignore").decode("utf8", errors="ignore")
-        
-        try:
-            hits = json.loads(text)["hits"]
-            resp = json.loads(text)
-            hits = resp["hits"]
-            print("\tTook: ", resp["took"])
-        except Exception as e:
-            print(e)
-            print(json.loads(text))
-            traceback.print_exc()
+            resp = json_loads(r.content)
+        except ValueError:
+            # not valid UTF-8 or JSON, drop any invalid bytes
+            try:
+                resp = json.loads(r.content.decode("utf8", errors="ignore"))
+            except ValueError:
+                traceback.print_exc()
+                return 0, []
+        self.record_decode(operation, resp.get("took", 0), time.time() - start)
+
+        if "hits" not in resp:
+            print("Search failed: ", r.status_code, resp.get("error"))
             return 0, []
-
-        return hits["total"]["value"], hits["hits"]
\ No newline at end of file
+        hits = resp["hits"]
+        # with filter_path, hits.hits is left out when there are no hits
+        return hits["total"]["value"], hits.get("hits", [])
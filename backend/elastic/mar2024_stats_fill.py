@@ -1,7 +1,10 @@
 import argparse
-import os
-from pymongo import MongoClient
-from bson.objectid import ObjectId
+import time
+from pymongo import MongoClient, UpdateOne
+
+# Where the time of the last backfill is stored, for --incremental.
+BACKFILL_STATE_ID = "submission_stats"
+
 
 def parse_env_file(env_file):
     env_vars = {}
@@ -18,57 +21,118 @@ def connect_to_mongodb(env_vars):
     mongo_client = MongoClient(mongo_host)
     return mongo_client
 
-def insert_stats(submission_id, mongo_client, database_name):
-    submission_id = ObjectId(submission_id)
-    db = mongo_client[database_name]
-    searches_clicks_collection = db.searches_clicks
-    recommendations_clicks_collection = db.recommendations_clicks
-    stats_collection = db.submission_stats
-
-    cdl_searches_clicks = searches_clicks_collection
-    cdl_recommendations_clicks = recommendations_clicks_collection
-    submission_exists = cdl_searches_clicks.count_documents({"submission_id": submission_id})
-
-    if submission_exists > 0:
-        num_search_clicks = cdl_searches_clicks.count_documents({"submission_id": submission_id, "type": "click_search_result"})
-        num_rec_clicks = cdl_recommendations_clicks.count_documents({"submission_id": submission_id})
-        num_views = cdl_searches_clicks.count_documents({"submission_id": submission_id, "type": "submission_view"})
-
-        stats_data = {
-            "submission_id": submission_id,
-            "search_clicks": num_search_clicks,
-            "recomm_clicks": num_rec_clicks,
-            "views": num_views,
-            "likes":0,
-            "dislikes":0
-        }
-        return
-
-        try:
-            stats_collection.insert_one(stats_data)
-            #print(f"Stats inserted for submission: {submission_id}")
-        except Exception as e:
-            print(f"Error occurred while inserting stats for submission {submission_id}: {e}")
+def aggregate_stats(db, submission_ids=None):
+    """
+    Counts search clicks, views, and recommendation clicks per submission with two server-side $group passes.
+
+    Arguments:
+        db : the MongoDB database.
+        submission_ids : (list) : if provided, only these submissions are aggregated.
+
+    Returns:
+        A dict {submission_id : {"search_clicks", "views", "recomm_clicks"}}
+    """
+    match = {"submission_id": {"$exists": True}, "type": {"$in": ["click_search_result", "submission_view"]}}
+    if submission_ids is not None:
+        match["submission_id"] = {"$in": submission_ids}
+
+    stats = {}
+    searches_pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$submission_id",
+            "search_clicks": {"$sum": {"$cond": [{"$eq": ["$type", "click_search_result"]}, 1, 0]}},
+            "views": {"$sum": {"$cond": [{"$eq": ["$type", "submission_view"]}, 1, 0]}}
+        }}
+    ]
+    for row in db.searches_clicks.aggregate(searches_pipeline, allowDiskUse=True):
+        stats[row["_id"]] = {"search_clicks": row["search_clicks"], "views": row["views"], "recomm_clicks": 0}
+
+    recomm_match = {"submission_id": {"$exists": True}}
+    if submission_ids is not None:
+        recomm_match["submission_id"] = {"$in": submission_ids}
+    recomm_pipeline = [
+        {"$match": recomm_match},
+        {"$group": {"_id": "$submission_id", "recomm_clicks": {"$sum": 1}}}
+    ]
+    for row in db.recommendations_clicks.aggregate(recomm_pipeline, allowDiskUse=True):
+        counts = stats.setdefault(row["_id"], {"search_clicks": 0, "views": 0, "recomm_clicks": 0})
+        counts["recomm_clicks"] = row["recomm_clicks"]
+
+    return stats
+
+def find_updated_submissions(db, since):
+    """
+    Returns the IDs of submissions with click, view, or recommendation events newer than since.
+    """
+    updated = set()
+    pipeline = [
+        {"$match": {"time": {"$gt": since}, "submission_id": {"$exists": True}}},
+        {"$group": {"_id": "$submission_id"}}
+    ]
+    for collection in [db.searches_clicks, db.recommendations_clicks]:
+        for row in collection.aggregate(pipeline, allowDiskUse=True):
+            updated.add(row["_id"])
+    return list(updated)
+
+def write_stats(db, stats, batch_size=1000):
+    """
+    Upserts the aggregated counts into submission_stats with batched bulk_write calls.
+    Likes and dislikes are not derived from events, so existing values are kept.
+    """
+    requests = []
+    written = 0
+    for submission_id, counts in stats.items():
+        requests.append(UpdateOne(
+            {"submission_id": submission_id},
+            {
+                "$set": counts,
+                "$setOnInsert": {"likes": 0, "dislikes": 0}
+            },
+            upsert=True
+        ))
+        if len(requests) == batch_size:
+            db.submission_stats.bulk_write(requests, ordered=False)
+            written += len(requests)
+            requests = []
+            print(f"Wrote {written}/{len(stats)} submission stats ({written / len(stats):.0%}).")
+    if requests:
+        db.submission_stats.bulk_write(requests, ordered=False)
+        written += len(requests)
+    return written
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--env_file", required=True, help="Path to the environment file")
+    parser.add_argument("--incremental", action="store_true", help="Only re-aggregate submissions with events since the last run")
+    parser.add_argument("--batch_size", type=int, default=1000, help="Number of upserts per bulk_write")
     args = parser.parse_args()
 
     env_vars = parse_env_file(args.env_file)
     mongo_client = connect_to_mongodb(env_vars)
     database_name = env_vars.get('db_name', 'cdl-local')
+    db = mongo_client[database_name]
+
+    run_time = time.time()
+    last_run = db.backfill_state.find_one({"_id": BACKFILL_STATE_ID})
 
-    searches_clicks_collection = mongo_client[database_name].searches_clicks
-    submission_ids = searches_clicks_collection.distinct("submission_id")
+    if args.incremental and last_run:
+        # counts are recomputed in full for the touched submissions, so re-running is safe
+        submission_ids = find_updated_submissions(db, last_run["time"])
+        print(f"{len(submission_ids)} submissions with new events since {last_run['time']}")
+        stats = {}
+        for i in range(0, len(submission_ids), args.batch_size):
+            stats.update(aggregate_stats(db, submission_ids[i:i + args.batch_size]))
+    else:
+        stats = aggregate_stats(db)
+        print(f"{len(stats)} submissions with events")
 
-    for i,submission_id in enumerate(submission_ids):
-        insert_stats(str(submission_id), mongo_client, database_name)
-        print(i)
-        if i % 100 == 0: print(i / len(submission_ids))
+    written = write_stats(db, stats, batch_size=args.batch_size)
+    db.backfill_state.update_one({"_id": BACKFILL_STATE_ID}, {"$set": {"time": run_time}}, upsert=True)
 
-    print("Backfill completed.")
+    print(f"Backfill completed, {written} submissions updated.")
 
 
-# python backend\elastic\mar2024_stats_fill.py --env_file backend\env_local_offline.ini      
\ No newline at end of file
+# python backend\elastic\mar2024_stats_fill.py --env_file backend\env_local_offline.ini
+# python backend\elastic\mar2024_stats_fill.py --env_file backend\env_local_offline.ini --incremental
@@ -0,0 +1,43 @@
+# add preview as field, a bounded and sanitized start of highlighted_text returned with hits instead of the full text
+# existing documents get the field with: python backend/elastic/oct2026_sanitize_previews.py --env_path <env file>
+# Run both before deploying the server, search results no longer include highlighted_text and have no preview without them.
+
+import argparse
+import os
+from manage_data import ElasticManager
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--env_path", required=True, help="path to env file")
+    args = parser.parse_args()
+
+    if args.env_path:
+        with open(args.env_path, "r") as f:
+            for line in f:
+                split_line = line.split("=")
+                name = split_line[0]
+                value = "=".join(split_line[1:]).strip("\n")
+                os.environ[name] = value
+
+    elastic_manager = ElasticManager(os.environ["elastic_username"], 
+                                     os.environ["elastic_password"],
+                                     os.environ["elastic_domain"],
+                                     os.environ["elastic_index_name"],
+                                     None,
+                                     "submissions")
+
+    preview_update = {
+        "properties": {
+            "preview": {
+                "type": "text",
+                "index": False
+            }
+        }
+    }
+
+    print(elastic_manager.add_to_mapping(preview_update))
+    print(elastic_manager.list_indices())
@@ -0,0 +1,50 @@
+# add explanation.suggest, a completion subfield of submission titles (with the communities as context) for autocomplete
+# new and edited submissions get it when indexed, existing documents are reindexed in place with _update_by_query
+# until it completes, autocomplete falls back to searching titles (see autocomplete in views/search.py)
+
+import argparse
+import os
+from manage_data import ElasticManager, TITLE_SUGGEST_MAPPING
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--env_path", required=True, help="path to env file")
+    args = parser.parse_args()
+
+    if args.env_path:
+        with open(args.env_path, "r") as f:
+            for line in f:
+                split_line = line.split("=")
+                name = split_line[0]
+                value = "=".join(split_line[1:]).strip("\n")
+                os.environ[name] = value
+
+    elastic_manager = ElasticManager(os.environ["elastic_username"], 
+                                     os.environ["elastic_password"],
+                                     os.environ["elastic_domain"],
+                                     os.environ["elastic_index_name"],
+                                     None,
+                                     "submissions")
+
+    suggest_update = {
+        "properties": {
+            "explanation": {
+                "type": "text",
+                "fields": {
+                    "suggest": TITLE_SUGGEST_MAPPING
+                }
+            }
+        }
+    }
+
+    print(elastic_manager.add_to_mapping(suggest_update))
+
+    # runs as a task on the cluster, follow it with GET _tasks/<task>
+    r = elastic_manager.request("post", elastic_manager.index_name + "/_update_by_query", "admin",
+                                params={"conflicts": "proceed", "wait_for_completion": "false"})
+    print(r.text)
+    print(elastic_manager.list_indices())
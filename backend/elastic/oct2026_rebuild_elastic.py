@@ -0,0 +1,238 @@
+# Rebuilds the submissions index from MongoDB.
+# Streams the logs collection in _id order, indexes batches with _bulk from a pool of workers,
+# and checkpoints the last indexed _id so that an interrupted rebuild can be resumed. Documents that
+# failed are kept in the checkpoint and retried when the rebuild is run again.
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from manage_data import ElasticManager
+from app.models.logs import Logs, Log
+
+
+# Only the fields used by ElasticManager.build_index_doc are read from MongoDB.
+INDEXED_FIELDS = {
+    "highlighted_text": 1,
+    "source_url": 1,
+    "explanation": 1,
+    "communities": 1,
+    "user_id": 1,
+    "time": 1,
+    "anonymous": 1,
+    "preview": 1
+}
+
+
+class Checkpoint:
+    """
+    The progress of a rebuild, saved after each batch: the last _id of the batches indexed so far,
+    the number of documents indexed, and the _ids of the documents that failed, which are retried
+    when the rebuild is resumed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.last_id = None
+        self.indexed = 0
+        self.failed_ids = []
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                checkpoint = json.load(f)
+            self.last_id = ObjectId(checkpoint["last_id"]) if checkpoint.get("last_id") else None
+            self.indexed = checkpoint["indexed"]
+            self.failed_ids = [ObjectId(x) for x in checkpoint.get("failed_ids", [])]
+
+    def save(self):
+        # write then rename, so that a crash never leaves a partial checkpoint
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "last_id": str(self.last_id) if self.last_id else None,
+                "indexed": self.indexed,
+                "failed_ids": [str(x) for x in self.failed_ids],
+                "time": time.time()
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def record_batch(self, batch_last_id, result):
+        """
+        Advances past a batch, keeping the _ids of its failed documents to be retried.
+        """
+        self.indexed += result["indexed"]
+        self.failed_ids += [ObjectId(error["id"]) for error in result["errors"] if ObjectId.is_valid(error["id"])]
+        self.last_id = batch_last_id
+        self.save()
+
+    def record_retry(self, retried_ids, result):
+        """
+        Keeps only the retried _ids that failed again.
+        """
+        retried_ids = set(retried_ids)
+        failed_again = {ObjectId(error["id"]) for error in result["errors"] if ObjectId.is_valid(error["id"])}
+        self.indexed += result["indexed"]
+        self.failed_ids = [x for x in self.failed_ids if x not in retried_ids or x in failed_again]
+        self.save()
+
+    def resume_query(self, query):
+        if self.last_id:
+            return dict(query, _id={"$gt": self.last_id})
+        return query
+
+
+def retry_failed(cdl_logs, elastic_manager, checkpoint, query, batch_size):
+    """
+    Indexes again the documents that failed in an earlier run.
+
+    Returns:
+        A list of the errors of the documents that failed again.
+    """
+    errors = []
+    # record_retry rewrites failed_ids, so the batches are taken from a copy
+    failed_ids = list(checkpoint.failed_ids)
+    for start in range(0, len(failed_ids), batch_size):
+        retried_ids = failed_ids[start:start + batch_size]
+        cursor = cdl_logs.collection.find(dict(query, _id={"$in": retried_ids}), INDEXED_FIELDS)
+        result = elastic_manager.bulk_index([to_log(x) for x in cursor], chunk_size=batch_size)
+        checkpoint.record_retry(retried_ids, result)
+        errors += result["errors"]
+    return errors
+
+
+def to_log(submission):
+    return Log(
+        None,
+        submission["user_id"],
+        submission.get("highlighted_text", ""),
+        submission.get("source_url", ""),
+        submission.get("explanation", ""),
+        submission.get("communities", {}),
+        submit_time=submission["time"],
+        id=submission["_id"],
+        anonymous=submission.get("anonymous", True),
+        preview=submission.get("preview")
+    )
+
+
+def stream_batches(cdl_logs, query, batch_size):
+    """
+    Yields lists of Log objects in _id order, using a single server-side cursor.
+    """
+    cursor = cdl_logs.collection.find(query, INDEXED_FIELDS).sort("_id", 1).batch_size(batch_size)
+    batch = []
+    for submission in cursor:
+        batch.append(to_log(submission))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m{seconds % 60:02d}s"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--env_path", required=True, help="path to env file")
+    parser.add_argument("--batch_size", type=int, default=1000, help="documents read from MongoDB and sent per _bulk request")
+    parser.add_argument("--workers", type=int, default=4, help="number of concurrent _bulk requests")
+    parser.add_argument("--max_docs_per_sec", type=float, default=0, help="throttle, 0 for no limit")
+    parser.add_argument("--checkpoint", default="rebuild_checkpoint.json", help="path to the checkpoint file")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and rebuild from the start")
+    args = parser.parse_args()
+
+    if args.env_path:
+        with open(args.env_path, "r") as f:
+            for line in f:
+                split_line = line.split("=")
+                name = split_line[0]
+                value = "=".join(split_line[1:]).strip("\n")
+                os.environ[name] = value
+
+    cdl_logs = Logs()
+
+    elastic_manager = ElasticManager(os.environ["elastic_username"],
+                                     os.environ["elastic_password"],
+                                     os.environ["elastic_domain"],
+                                     os.environ["elastic_index_name"],
+                                     None,
+                                     "submissions",
+                                     pool_size=args.workers)
+
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.remove()
+        checkpoint = Checkpoint(args.checkpoint)
+
+    base_query = {"deleted": {"$exists": False}}
+    total = cdl_logs.count(base_query)
+    if checkpoint.last_id:
+        print(f"Resuming after {checkpoint.last_id}, {checkpoint.indexed} documents already indexed.")
+    if checkpoint.failed_ids:
+        print(f"Retrying {len(checkpoint.failed_ids)} documents that failed.")
+        for error in retry_failed(cdl_logs, elastic_manager, checkpoint, base_query, args.batch_size):
+            print("\t", error)
+    query = checkpoint.resume_query(base_query)
+    remaining = cdl_logs.count(query)
+    print(f"{remaining} of {total} documents to index.")
+
+    start = time.time()
+    submitted = 0
+    processed = 0
+    failed = 0
+    # (future, last _id of batch, batch size), in submission order, so that the checkpoint
+    # only advances past batches for which every earlier batch has also finished
+    pending = []
+
+    def drain(max_pending):
+        global processed, failed
+        while len(pending) > max_pending or (pending and pending[0][0].done()):
+            future, batch_last_id, batch_len = pending.pop(0)
+            result = future.result()
+            processed += batch_len
+            failed += len(result["errors"])
+            for error in result["errors"]:
+                print("\t", error)
+            # the failed documents are kept in the checkpoint and retried on the next run
+            checkpoint.record_batch(batch_last_id, result)
+
+            elapsed = time.time() - start
+            rate = processed / elapsed if elapsed else 0
+            eta = (remaining - processed) / rate if rate else 0
+            print(f"{processed}/{remaining} ({rate:.0f} docs/sec, ETA {format_duration(eta)}, {failed} failed)")
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for batch in stream_batches(cdl_logs, query, args.batch_size):
+            future = executor.submit(elastic_manager.bulk_index, batch, chunk_size=args.batch_size)
+            pending.append((future, batch[-1].id, len(batch)))
+            submitted += len(batch)
+
+            # keep at most two batches per worker in flight
+            drain(args.workers * 2)
+
+            if args.max_docs_per_sec > 0:
+                ahead = submitted / args.max_docs_per_sec - (time.time() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        drain(0)
+
+    print(f"Done in {format_duration(time.time() - start)}: {checkpoint.indexed} indexed, {len(checkpoint.failed_ids)} failed.")
+    if checkpoint.failed_ids:
+        print(f"Run again to retry the failed documents, they are listed in {args.checkpoint}.")
+    else:
+        checkpoint.remove()
+
+
+# python elastic\oct2026_rebuild_elastic.py --env_path env_local.ini --workers 4 --max_docs_per_sec 500
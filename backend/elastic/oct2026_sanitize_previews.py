@@ -0,0 +1,83 @@
+# Backfills the sanitized preview of existing submissions, in MongoDB and in the submissions index.
+# Submissions written since the preview was added already have it (see build_preview), so search results are
+# displayed without sanitizing on every read. Safe to re-run, only submissions without a preview are updated.
+# Must run before deploying the server: search results no longer include highlighted_text, so submissions
+# without a preview are displayed with no description.
+
+import argparse
+import os
+import time
+
+from pymongo import UpdateOne
+from manage_data import ElasticManager
+from app.models.logs import Logs
+from app.helpers.helpers import build_preview
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--env_path", required=True, help="path to env file")
+    parser.add_argument("--batch_size", type=int, default=500, help="submissions per MongoDB bulk_write and _bulk request")
+    args = parser.parse_args()
+
+    if args.env_path:
+        with open(args.env_path, "r") as f:
+            for line in f:
+                split_line = line.split("=")
+                name = split_line[0]
+                value = "=".join(split_line[1:]).strip("\n")
+                os.environ[name] = value
+
+    cdl_logs = Logs()
+
+    elastic_manager = ElasticManager(os.environ["elastic_username"],
+                                     os.environ["elastic_password"],
+                                     os.environ["elastic_domain"],
+                                     os.environ["elastic_index_name"],
+                                     None,
+                                     "submissions")
+
+    query = {"preview": {"$exists": False}}
+    total = cdl_logs.count(query)
+    print(f"{total} submissions without a preview.")
+
+    start = time.time()
+    updated = 0
+    failed = 0
+
+    def migrate(batch):
+        global updated, failed
+        previews = {submission["_id"]: build_preview(submission.get("highlighted_text", "")) for submission in batch}
+
+        # deleted submissions are not in the index, only MongoDB is updated for them
+        indexed = [x["_id"] for x in batch if not x.get("deleted")]
+        result = elastic_manager.bulk_update((x, {"preview": previews[x]}) for x in indexed)
+        # a submission missing from the index is not an error here
+        errors = {error["id"] for error in result["errors"] if error["status"] != 404}
+        for error in result["errors"]:
+            if error["status"] != 404:
+                print("\t", error)
+
+        # only mark the submissions that were updated in the index, the rest are retried on the next run
+        requests = [UpdateOne({"_id": x}, {"$set": {"preview": preview}}) for x, preview in previews.items() if str(x) not in errors]
+        if requests:
+            cdl_logs.collection.bulk_write(requests, ordered=False)
+        updated += len(requests)
+        failed += len(errors)
+        print(f"{updated + failed}/{total} ({failed} failed, {time.time() - start:.0f}s)")
+
+    batch = []
+    for submission in cdl_logs.collection.find(query, {"highlighted_text": 1, "deleted": 1}).sort("_id", 1).batch_size(args.batch_size):
+        batch.append(submission)
+        if len(batch) == args.batch_size:
+            migrate(batch)
+            batch = []
+    if batch:
+        migrate(batch)
+
+    print(f"Done: {updated} updated, {failed} failed.")
+
+
+# python elastic\oct2026_sanitize_previews.py --env_path env_local.ini
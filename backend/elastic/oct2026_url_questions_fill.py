@@ -0,0 +1,91 @@
+# Builds the users also ask index (url_questions) from the existing search logs.
+# New searches keep it up to date (see log_search_request), this only fills in the history.
+# Safe to re-run, counts are recomputed from the search logs and the last asked time only moves forward.
+
+import argparse
+from pymongo import MongoClient, UpdateOne
+
+
+def parse_env_file(env_file):
+    env_vars = {}
+    with open(env_file, 'r') as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                key, value = line.strip().split('=', 1)
+                env_vars[key] = value
+    return env_vars
+
+def connect_to_mongodb(env_vars):
+    #mongo_host = env_vars.get('cdl_uri', 'mongodb://localhost:27017') #in prod
+    mongo_host = env_vars.get('cdl_test_uri', 'localhost')
+    mongo_client = MongoClient(mongo_host)
+    return mongo_client
+
+def aggregate_questions(db):
+    """
+    Groups the generated questions of the search logs by webpage with one server-side $group pass.
+
+    Returns:
+        A cursor of {"_id": {"url", "question"}, "count", "typed_count", "communities", "first_asked", "last_asked"}
+        where communities is the list of the communities lists of the searches.
+    """
+    pipeline = [
+        {"$match": {"context.url": {"$nin": [None, ""]}, "intent.generated_question": {"$nin": [None, ""]}}},
+        {"$group": {
+            "_id": {"url": "$context.url", "question": "$intent.generated_question"},
+            "count": {"$sum": 1},
+            "typed_count": {"$sum": {"$cond": [{"$ne": [{"$ifNull": ["$intent.typed_query", ""]}, ""]}, 1, 0]}},
+            "communities": {"$addToSet": "$filters.communities"},
+            "first_asked": {"$min": "$time"},
+            "last_asked": {"$max": "$time"}
+        }}
+    ]
+    return db.search_logs.aggregate(pipeline, allowDiskUse=True)
+
+def write_questions(db, rows, batch_size=1000):
+    """
+    Upserts the aggregated questions into url_questions with batched bulk_write calls.
+
+    Returns:
+        The number of (url, question) documents written.
+    """
+    db.url_questions.create_index([("url", 1), ("question", 1)], unique=True)
+    db.url_questions.create_index([("url", 1), ("last_asked", -1)])
+
+    written = 0
+    requests = []
+    for row in rows:
+        communities = list({x for search_communities in row["communities"] for x in (search_communities or [])})
+        requests.append(UpdateOne(
+            {"url": row["_id"]["url"], "question": row["_id"]["question"]},
+            {
+                "$set": {"count": row["count"], "typed_count": row["typed_count"]},
+                "$addToSet": {"communities": {"$each": communities}},
+                "$min": {"first_asked": row["first_asked"]},
+                "$max": {"last_asked": row["last_asked"]}
+            },
+            upsert=True
+        ))
+        if len(requests) >= batch_size:
+            db.url_questions.bulk_write(requests, ordered=False)
+            written += len(requests)
+            requests = []
+    if requests:
+        db.url_questions.bulk_write(requests, ordered=False)
+        written += len(requests)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--env_file", required=True, help="Path to the environment file")
+    parser.add_argument("--batch_size", type=int, default=1000, help="documents per bulk_write")
+    args = parser.parse_args()
+
+    env_vars = parse_env_file(args.env_file)
+    mongo_client = connect_to_mongodb(env_vars)
+    database_name = env_vars.get('db_name', 'cdl-local')
+    db = mongo_client[database_name]
+
+    written = write_questions(db, aggregate_questions(db), batch_size=args.batch_size)
+    print(f"Wrote {written} questions to url_questions.")
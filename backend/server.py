@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, Response
 import argparse
 from flask_cors import CORS
 import os
@@ -6,10 +6,16 @@ import nltk
 
 from app.views.users import users
 from app.views.communities import communities
-from app.views.search import search
+from app.views.search import search, elastic_manager
 from app.views.submissions import submissions
 
-from app.db import get_db, get_redis
+from app.db import get_redis, warm_up_db, get_mongo_pool_stats
+from app.event_pipeline import get_event_pipeline
+from app.models.cache import get_cache_memory_stats
+from app import metrics
+from app.helpers import response
+from app.helpers.helpers import monitoring_access_required
+from app.helpers.status import Status
 
 app = Flask(__name__)
 CORS(app)
@@ -19,6 +25,40 @@ app.register_blueprint(communities)
 app.register_blueprint(search)
 app.register_blueprint(submissions)
 
+# Server-Timing headers and per-endpoint latency histograms, see /api/metrics
+metrics.init_app(app)
+
+
+@app.route("/api/stats/pools", methods=["GET"])
+@monitoring_access_required
+def pool_stats():
+	"""
+	Connection pool and backend latency statistics for monitoring.
+	"""
+	return response.success({
+		"mongo": get_mongo_pool_stats(),
+		"elastic": elastic_manager.get_latency_stats(),
+		"events": get_event_pipeline().stats(),
+		"cache_memory": get_cache_memory_stats()
+	}, Status.OK)
+
+
+@app.route("/api/metrics", methods=["GET"])
+@monitoring_access_required
+def prometheus_metrics():
+	"""
+	Request latency histograms per endpoint and backend, along with the pool, Elastic, event pipeline and
+	cache memory statistics of /api/stats/pools, in the Prometheus text format.
+	"""
+	body = metrics.request_metrics.render()
+	body += metrics.format_stats("textdata_mongo_pool", "MongoDB connection pool statistics.", get_mongo_pool_stats())
+	body += metrics.format_stats("textdata_elastic", "Elastic request statistics by operation.",
+								 elastic_manager.get_latency_stats(), label="operation")
+	body += metrics.format_stats("textdata_events", "Event pipeline counters.", get_event_pipeline().stats())
+	body += metrics.format_stats("textdata_search_cache", "Memory used per cached search, from a sample of searches.",
+								 get_cache_memory_stats())
+	return Response(body, mimetype="text/plain; version=0.0.4")
+
 
 parser = argparse.ArgumentParser()
 
@@ -36,10 +76,15 @@ if args.env_path:
 
 app.config['SECRET_KEY'] = os.environ["jwt_secret"]
 
+# open the shared MongoDB connection pool before serving requests
+warm_up_db()
+
 with app.app_context():
-	get_db()
 	get_redis()
 
+# start the background writer for telemetry logs, it flushes on shutdown
+get_event_pipeline()
+
 # for nltk data, used for parsing queries
 nltk.download("brown")
 nltk.download("punkt")
@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session", autouse=True)
+def env():
+    """
+    Loads env_local.ini into the environment, for the tests that use the databases directly.
+    """
+    env_file_path = os.path.join(os.path.dirname(__file__), "..", "env_local.ini")
+    if os.path.exists(env_file_path):
+        with open(env_file_path, "r") as f:
+            for line in f:
+                split_line = line.split("=")
+                name = split_line[0]
+                value = "=".join(split_line[1:]).strip("\n")
+                os.environ.setdefault(name, value)
@@ -0,0 +1,23 @@
+from bson import ObjectId
+
+from app.models.cache import Cache
+
+
+def test_set_sort_of_expired_search():
+    cache = Cache()
+    user_id, search_id = str(ObjectId()), str(ObjectId())
+
+    assert not cache.set_sort(user_id, search_id, "date")
+    # the meta hash is not recreated without a TTL
+    assert not cache.rds.exists(cache.get_meta_key(user_id, search_id))
+
+
+def test_set_sort_of_cached_search():
+    cache = Cache()
+    user_id, search_id = str(ObjectId()), str(ObjectId())
+    cache.rds.hset(cache.get_meta_key(user_id, search_id), Cache.NUMBER_OF_HITS, 0)
+    cache.rds.expire(cache.get_meta_key(user_id, search_id), 60)
+
+    assert cache.set_sort(user_id, search_id, "date")
+    assert cache.get_sort(user_id, search_id) == "date"
+    assert not cache.set_sort(user_id, search_id, "unknown")
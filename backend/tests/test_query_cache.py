@@ -0,0 +1,54 @@
+import pytest
+from bson import ObjectId
+
+from app.models.query_cache import QueryCache
+
+
+@pytest.fixture
+def query_cache():
+    cache = QueryCache()
+    cache.enabled = True
+    cache.refresh_seconds = 1
+    return cache
+
+
+def new_communities(n):
+    return [str(ObjectId()) for _ in range(n)]
+
+
+SIGNATURE = {"query": "test", "own_submissions": False, "user_id": None, "num_results": 10, "highlight": False}
+
+
+def test_lookup_miss_then_hit(query_cache):
+    communities = new_communities(2)
+    cached, entry_key = query_cache.lookup(SIGNATURE, communities)
+    assert cached is None
+    assert entry_key
+
+    query_cache.store(entry_key, 1, [{"_id": "a"}])
+    cached, entry_key = query_cache.lookup(SIGNATURE, list(reversed(communities)))
+    assert cached == (1, [{"_id": "a"}])
+    assert entry_key is None
+
+
+def test_different_communities_do_not_share_entries(query_cache):
+    # neither set has ever changed, so all their versions are 0
+    first, second = new_communities(2), new_communities(2)
+    _, first_key = query_cache.lookup(SIGNATURE, first)
+    query_cache.store(first_key, 1, [{"_id": "a"}])
+
+    cached, second_key = query_cache.lookup(SIGNATURE, second)
+    assert cached is None
+    assert second_key != first_key
+
+
+def test_bump_invalidates(query_cache):
+    communities = new_communities(1)
+    _, entry_key = query_cache.lookup(SIGNATURE, communities)
+    query_cache.store(entry_key, 1, [{"_id": "a"}])
+
+    query_cache.bump_versions(communities)
+    cached, recent_key = query_cache.lookup(SIGNATURE, communities)
+    assert cached is None
+    # the community is still refreshing, so its results are not cached yet
+    assert recent_key is None
@@ -0,0 +1,92 @@
+import os
+import sys
+from unittest import mock
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "elastic"))
+from oct2026_rebuild_elastic import Checkpoint, retry_failed
+
+
+def result(indexed, failed_ids=()):
+    return {"indexed": indexed, "errors": [{"id": str(x), "status": 500, "error": "failed"} for x in failed_ids], "hashtags": {}}
+
+
+def test_resume_after_last_batch(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    first, second = ObjectId(), ObjectId()
+    checkpoint = Checkpoint(path)
+    checkpoint.record_batch(first, result(10))
+    checkpoint.record_batch(second, result(10))
+
+    resumed = Checkpoint(path)
+    assert resumed.last_id == second
+    assert resumed.indexed == 20
+    assert resumed.failed_ids == []
+    assert resumed.resume_query({"deleted": {"$exists": False}}) == {"deleted": {"$exists": False}, "_id": {"$gt": second}}
+
+
+def test_failed_documents_are_kept_for_retry(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    failed_id, batch_last_id = ObjectId(), ObjectId()
+    Checkpoint(path).record_batch(batch_last_id, result(9, [failed_id]))
+
+    resumed = Checkpoint(path)
+    assert resumed.last_id == batch_last_id
+    assert resumed.indexed == 9
+    assert resumed.failed_ids == [failed_id]
+
+
+def test_retry_failed(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    fixed_id, still_failing_id = ObjectId(), ObjectId()
+    checkpoint = Checkpoint(path)
+    checkpoint.record_batch(ObjectId(), result(8, [fixed_id, still_failing_id]))
+
+    cdl_logs = mock.MagicMock()
+    cdl_logs.collection.find.return_value = [
+        {"_id": x, "user_id": ObjectId(), "time": 0} for x in (fixed_id, still_failing_id)
+    ]
+    elastic_manager = mock.MagicMock()
+    elastic_manager.bulk_index.return_value = result(1, [still_failing_id])
+
+    errors = retry_failed(cdl_logs, elastic_manager, checkpoint, {"deleted": {"$exists": False}}, 100)
+    assert [error["id"] for error in errors] == [str(still_failing_id)]
+    query = cdl_logs.collection.find.call_args.args[0]
+    assert query["_id"] == {"$in": [fixed_id, still_failing_id]}
+
+    resumed = Checkpoint(path)
+    assert resumed.indexed == 9
+    assert resumed.failed_ids == [still_failing_id]
+
+
+def test_missing_checkpoint(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    assert checkpoint.last_id is None
+    assert checkpoint.resume_query({}) == {}
+
+
+def test_retry_failed_in_batches(tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    failed_ids = [ObjectId() for _ in range(6)]
+    still_failing_id = failed_ids[3]
+    checkpoint = Checkpoint(path)
+    checkpoint.record_batch(ObjectId(), result(0, failed_ids))
+
+    cdl_logs = mock.MagicMock()
+    cdl_logs.collection.find.side_effect = lambda query, fields: [
+        {"_id": x, "user_id": ObjectId(), "time": 0} for x in query["_id"]["$in"]
+    ]
+    elastic_manager = mock.MagicMock()
+    elastic_manager.bulk_index.side_effect = lambda docs, chunk_size: result(
+        len([x for x in docs if x.id != still_failing_id]), [x.id for x in docs if x.id == still_failing_id])
+
+    errors = retry_failed(cdl_logs, elastic_manager, checkpoint, {}, 2)
+    # every failed document is retried once, in batches
+    retried = [call.args[0]["_id"]["$in"] for call in cdl_logs.collection.find.call_args_list]
+    assert retried == [failed_ids[0:2], failed_ids[2:4], failed_ids[4:6]]
+    assert [error["id"] for error in errors] == [str(still_failing_id)]
+
+    resumed = Checkpoint(path)
+    assert resumed.indexed == 5
+    assert resumed.failed_ids == [still_failing_id]
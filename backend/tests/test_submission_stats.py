@@ -0,0 +1,105 @@
+import time
+import uuid
+from unittest import mock
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+import app.models.submission_stats as submission_stats
+from app.db import get_redis
+from app.models.submission_stats import SubmissionStats
+
+
+@pytest.fixture
+def pending_key(monkeypatch):
+    key = "test_submission_stats:" + str(uuid.uuid4())
+    monkeypatch.setattr(submission_stats, "PENDING_STATS_KEY", key)
+    yield key
+    rds = get_redis()
+    rds.delete(key, *rds.keys(key + ":*"))
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    monkeypatch.setenv("stats_write_behind", "false")
+    collection = mock.MagicMock()
+    monkeypatch.setattr(submission_stats, "get_db", lambda: mock.MagicMock(submission_stats=collection))
+    monkeypatch.setattr(SubmissionStats, "index_created", True)
+    return SubmissionStats()
+
+
+def applied_increments(collection):
+    increments = {}
+    for call in collection.bulk_write.call_args_list:
+        for request in call.args[0]:
+            increments[str(request._filter["submission_id"])] = request._doc["$inc"]
+    return increments
+
+
+def test_flush_writes_pending(stats, pending_key):
+    first, second = str(ObjectId()), str(ObjectId())
+    rds = get_redis()
+    rds.hset(pending_key, mapping={f"{first}:views": 2, f"{second}:search_clicks": 1})
+
+    assert stats.flush_pending() == 2
+    assert applied_increments(stats.collection) == {first: {"views": 2}, second: {"search_clicks": 1}}
+    assert not rds.exists(pending_key)
+    assert not rds.keys(pending_key + ":*")
+
+
+def test_flush_retries_only_failed_operations(stats, pending_key):
+    first, second, third = str(ObjectId()), str(ObjectId()), str(ObjectId())
+    rds = get_redis()
+    rds.hset(pending_key, mapping={f"{first}:views": 1, f"{second}:views": 3, f"{third}:recomm_clicks": 2})
+
+    def bulk_write(requests, ordered):
+        failed_index = [str(x._filter["submission_id"]) for x in requests].index(second)
+        raise BulkWriteError({"writeErrors": [{"index": failed_index, "code": 11000, "errmsg": "E11000"}]})
+    stats.collection.bulk_write.side_effect = bulk_write
+
+    assert stats.flush_pending() == 2
+    # only the failed increment is put back, the others were applied by the unordered bulk_write
+    assert rds.hgetall(pending_key) == {f"{second}:views": "3"}
+    assert not rds.keys(pending_key + ":*")
+
+
+def test_flush_retries_everything_on_other_errors(stats, pending_key):
+    submission_id = str(ObjectId())
+    rds = get_redis()
+    rds.hset(pending_key, mapping={f"{submission_id}:views": 4})
+    stats.collection.bulk_write.side_effect = Exception("connection lost")
+
+    assert stats.flush_pending() == 0
+    assert rds.hgetall(pending_key) == {f"{submission_id}:views": "4"}
+
+
+def test_flush_picks_up_stale_buffers(stats, pending_key, monkeypatch):
+    monkeypatch.setenv("stats_flush_stale_seconds", "60")
+    stale, recent = str(ObjectId()), str(ObjectId())
+    rds = get_redis()
+    # buffers renamed by flushes that did not finish
+    stale_key = f"{pending_key}:{time.time() - 120}:{uuid.uuid4()}"
+    recent_key = f"{pending_key}:{time.time()}:{uuid.uuid4()}"
+    rds.hset(stale_key, mapping={f"{stale}:views": 5})
+    rds.hset(recent_key, mapping={f"{recent}:views": 1})
+
+    assert stats.flush_pending() == 1
+    assert applied_increments(stats.collection) == {stale: {"views": 5}}
+    assert not rds.exists(stale_key)
+    # a recent buffer may still be flushed by another process
+    assert rds.exists(recent_key)
+
+
+def test_increment_many_buffers_with_write_behind(pending_key, monkeypatch):
+    monkeypatch.setenv("stats_write_behind", "true")
+    monkeypatch.setattr(submission_stats.StatsFlusher, "start", lambda: None)
+    collection = mock.MagicMock()
+    monkeypatch.setattr(submission_stats, "get_db", lambda: mock.MagicMock(submission_stats=collection))
+    monkeypatch.setattr(SubmissionStats, "index_created", True)
+    submission_id = str(ObjectId())
+
+    SubmissionStats().increment_many([(submission_id, "submission_view"), (submission_id, "submission_view"), (submission_id, "likes")])
+    assert get_redis().hgetall(pending_key) == {f"{submission_id}:views": "2"}
+    # likes are written through
+    assert applied_increments(collection) == {submission_id: {"likes": 1}}
@@ -0,0 +1,31 @@
+import pytest
+from bson import ObjectId
+
+from app.helpers.helpers import URLFormatter, format_url, create_redirect_url, build_display_url
+
+
+URLS = [
+    "",
+    "https://example.com",
+    "https://example.com/",
+    "https://example.com/a/b/",
+    "https://example.com/a/b?q=x&y=1#section",
+    "http://localhost:3000/path with spaces"
+]
+
+
+@pytest.fixture(params=[("http://localhost", "8080"), ("https://textdata.org", "443")])
+def api_url(request, monkeypatch):
+    monkeypatch.setenv("api_url", request.param[0])
+    monkeypatch.setenv("api_port", request.param[1])
+
+
+@pytest.mark.parametrize("url", URLS)
+def test_matches_url_functions(api_url, url):
+    search_id = str(ObjectId())
+    submission_id = str(ObjectId())
+    urls = URLFormatter(search_id)
+
+    assert urls.format_url(url, submission_id) == format_url(url, submission_id)
+    assert urls.redirect_url(submission_id) == create_redirect_url(format_url("", submission_id), search_id)
+    assert urls.display_url(url, submission_id) == build_display_url(format_url(url, submission_id))